@@ -27,6 +27,7 @@ def create_app(config_name="default"):
     configure_auth_providers(app)
     configure_errors(app)
     configure_logging(app)
+    configure_catalog(app)
     set_config_options(app)
 
     """
@@ -89,6 +90,17 @@ def configure_models(app):
     return
 
 
+def configure_catalog(app):
+    from app.utils.catalog import catalog
+
+    # loaded before the workers fork when gunicorn runs with --preload
+    try:
+        catalog.load(app)
+    except Exception as e:
+        logging.error(f"Failed to load the framework catalog. Error:{e}")
+    return
+
+
 def configure_extensions(app):
     db.init_app(app)
     mail.init_app(app)
@@ -154,6 +166,18 @@ def configure_errors(app):
     def not_authorized(e):
         return handle_error(e, "Unauthorized")
 
+    @app.errorhandler(409)
+    def conflict(e):
+        return handle_error(e, "Conflict")
+
+    @app.errorhandler(410)
+    def gone(e):
+        return handle_error(e, "Gone")
+
+    @app.errorhandler(416)
+    def range_not_satisfiable(e):
+        return handle_error(e, "Range not satisfiable")
+
     @app.errorhandler(500)
     def internal_error(e):
         return handle_error(e, "Internal error")
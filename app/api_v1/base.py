@@ -10,6 +10,9 @@ from . import api
 from app import models, db
 from flask_login import current_user
 from app.utils.decorators import login_required
+from app.utils.streaming import wants_stream, ndjson_response, stream_query
+from app.utils.cache import summary_cache
+from app.utils.storage_clients import storage_clients
 from app.email import send_email
 from app.utils.authorizer import Authorizer
 from app.utils import misc
@@ -301,11 +304,18 @@ def add_tenant():
             data.get("name"),
             data.get("contact_email"),
             approved_domains=data.get("approved_domains"),
-            init_data=True,
         )
     except Exception as e:
         return jsonify({"message": str(e)}), 400
-    return jsonify(tenant.as_dict())
+    job = tenant.submit_bootstrap(user=current_user)
+    return jsonify({**tenant.as_dict(), "job": job.as_dict()})
+
+
+@api.route("/jobs/<string:id>", methods=["GET"])
+@login_required
+def get_job(id):
+    result = Authorizer(current_user).can_user_read_job(id)
+    return jsonify(result["extra"]["job"].as_dict())
 
 
 @api.route("/users/<string:uid>/tenants", methods=["GET"])
@@ -411,11 +421,37 @@ def get_labels_for_tenant(tid):
 @login_required
 def get_logs():
     Authorizer(current_user).can_user_manage_platform()
+    if wants_stream():
+        return ndjson_response(
+            log.as_dict()
+            for log in stream_query(models.Logs.get(as_query=True, limit=500))
+        )
     return jsonify(models.Logs.get(as_dict=True, limit=500))
 
 
+@api.route("/cache/stats")
+@login_required
+def get_cache_stats():
+    Authorizer(current_user).can_user_manage_platform()
+    return jsonify({"project_summary": summary_cache.stats()})
+
+
+@api.route("/storage/stats")
+@login_required
+def get_storage_stats():
+    Authorizer(current_user).can_user_manage_platform()
+    return jsonify({"clients": storage_clients.stats()})
+
+
 @api.route("/tenants/<string:id>/logs")
 @login_required
 def get_logs_for_tenant(id):
     result = Authorizer(current_user).can_user_access_tenant(id)
+    if wants_stream():
+        return ndjson_response(
+            log.as_dict()
+            for log in stream_query(
+                result["extra"]["tenant"].get_logs(as_query=True, limit=500)
+            )
+        )
     return jsonify(result["extra"]["tenant"].get_logs(as_dict=True, limit=500))
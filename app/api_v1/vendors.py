@@ -7,6 +7,7 @@ from app.models import *
 from flask_login import current_user
 from app.utils.authorizer import Authorizer
 from app.utils.decorators import login_required
+from app.utils.downloads import file_response
 
 
 @api.route("/tenants/<string:id>/vendors", methods=["GET"])
@@ -70,6 +71,17 @@ def update_vendor(id):
     return jsonify(vendor.as_dict())
 
 
+@api.route("/vendors/<string:id>/files/<string:fid>/file", methods=["GET"])
+@login_required
+def download_file_for_vendor(id, fid):
+    result = Authorizer(current_user).can_user_access_vendor(id)
+    vendor_file = (
+        result["extra"]["vendor"].files.filter(VendorFile.id == fid).first_or_404()
+    )
+    provider, path, etag = vendor_file.get_file_location()
+    return file_response(provider, path, vendor_file.name, etag=etag)
+
+
 @api.route("/vendors/<string:id>/applications", methods=["GET"])
 @login_required
 def get_vendor_applications(id):
@@ -5,16 +5,33 @@ from flask import (
     abort,
     render_template,
     Response,
+    stream_with_context,
 )
 from . import api
 from app import models, db
 from flask_login import current_user
 from app.utils.decorators import login_required
 from app.utils.misc import project_creation, get_users_from_text
-from sqlalchemy import func
+from sqlalchemy import func, case, and_
 from app.email import send_email
 from app.utils.reports import Report
 from app.utils.authorizer import Authorizer
+from app.utils.loaders import ProjectControlLoader
+from app.utils.pagination import keyset_paginate
+from app.utils.fields import get_fields
+from app.utils.streaming import (
+    wants_stream,
+    ndjson_response,
+    stream_query,
+    STREAM_PAGE_SIZE,
+)
+from app.utils.etag import not_modified, with_etag
+from app.utils.downloads import file_response
+from app.utils.archive import stream_archive
+from werkzeug.utils import secure_filename
+from werkzeug.http import parse_content_range_header
+from app.utils.control_import import ControlImporter, reader_for
+from app.utils.bulk import DEFAULT_BATCH_SIZE
 import arrow
 
 
@@ -204,13 +221,15 @@ def delete_comment_for_project(pid, cid):
 @login_required
 def get_comments_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
+    if response := not_modified(result["extra"]["project"]):
+        return response
     data = [
         comment.as_dict()
         for comment in result["extra"]["project"]
         .comments.order_by(models.ProjectComment.date_added.asc())
         .all()
     ]
-    return jsonify(data)
+    return with_etag(jsonify(data), result["extra"]["project"])
 
 
 @api.route("/projects/<string:pid>/findings", methods=["GET"])
@@ -334,8 +353,41 @@ def get_frameworks_for_tenant(tid):
 def create_control_for_tenant(tid):
     Authorizer(current_user).can_user_manage_tenant(tid)
     payload = request.get_json()
-    models.Control.create(payload, tid)
-    return jsonify({"message": "ok"})
+    report = models.Control.bulk_create(payload, tid)
+    return jsonify({"message": "ok", "import": report})
+
+
+@api.route("/tenants/<string:tid>/controls/import", methods=["POST"])
+@login_required
+def import_controls_for_tenant(tid):
+    """
+    Streaming import of a custom framework, the body is the JSON or CSV
+    document (or a "file" form field). See app/utils/control_import.py
+    """
+    Authorizer(current_user).can_user_manage_tenant(tid)
+    stream = request.stream
+    filename = ""
+    if file := request.files.get("file"):
+        stream = file.stream
+        filename = file.filename or ""
+    format = request.args.get("format")
+    if not format:
+        is_csv = filename.lower().endswith(".csv") or request.mimetype == "text/csv"
+        format = "csv" if is_csv else "json"
+    if format not in ["json", "csv"]:
+        abort(422, "format must be json or csv")
+    importer = ControlImporter(
+        tid,
+        framework=request.args.get("framework"),
+        batch_size=min(
+            max(request.args.get("batch-size", DEFAULT_BATCH_SIZE, type=int), 1),
+            DEFAULT_BATCH_SIZE,
+        ),
+    )
+    report = importer.run(reader_for(stream, format))
+    if report["error"]:
+        return jsonify({"message": report["error"], "import": report}), 422
+    return jsonify({"message": "ok", "import": report})
 
 
 @api.route("/tenants/<string:tid>/policies", methods=["GET"])
@@ -367,16 +419,41 @@ def create_policy_for_tenant(tid):
 @login_required
 def reload_tenant_frameworks(tid):
     result = Authorizer(current_user).can_user_admin_tenant(tid)
-    result["extra"]["tenant"].create_base_frameworks()
-    return jsonify({"message": "ok"})
+    job = result["extra"]["tenant"].submit_bootstrap(["frameworks"], user=current_user)
+    return jsonify({"message": "ok", "job": job.as_dict()}), 202
+
+
+@api.route("/tenants/<string:tid>/storage", methods=["GET"])
+@login_required
+def get_tenant_storage(tid):
+    result = Authorizer(current_user).can_user_admin_tenant(tid)
+    tenant = result["extra"]["tenant"]
+    rows = models.StorageUsage.query.filter(
+        models.StorageUsage.tenant_id == tenant.id
+    ).all()
+    return jsonify(
+        {
+            "used": models.StorageUsage.get_tenant_bytes(tenant),
+            "cap": int(tenant.storage_cap) if tenant.storage_cap else None,
+            "usage": [row.as_dict() for row in rows],
+        }
+    )
+
+
+@api.route("/tenants/<string:tid>/storage/reconcile", methods=["PUT"])
+@login_required
+def reconcile_tenant_storage(tid):
+    result = Authorizer(current_user).can_user_admin_tenant(tid)
+    job = result["extra"]["tenant"].submit_storage_reconcile(user=current_user)
+    return jsonify({"message": "ok", "job": job.as_dict()}), 202
 
 
 @api.route("/tenants/<string:tid>/load-policies", methods=["PUT"])
 @login_required
 def reload_tenant_policies(tid):
     result = Authorizer(current_user).can_user_admin_tenant(tid)
-    result["extra"]["tenant"].create_base_policies()
-    return jsonify({"message": "ok"})
+    job = result["extra"]["tenant"].submit_bootstrap(["policies"], user=current_user)
+    return jsonify({"message": "ok", "job": job.as_dict()}), 202
 
 
 @api.route("/projects/<string:pid>", methods=["GET"])
@@ -386,7 +463,10 @@ def get_project(pid):
     if request.args.get("summary"):
         with_summary = True
     result = Authorizer(current_user).can_user_access_project(pid)
-    return jsonify(result["extra"]["project"].as_dict(with_summary=with_summary))
+    project = result["extra"]["project"]
+    if response := not_modified(project):
+        return response
+    return with_etag(jsonify(project.as_dict(with_summary=with_summary)), project)
 
 
 @api.route("/projects/<string:pid>", methods=["PUT"])
@@ -444,7 +524,8 @@ def get_framework(fid):
 @login_required
 def get_evidence(eid):
     result = Authorizer(current_user).can_user_read_evidence(eid)
-    return jsonify(result["extra"]["evidence"].as_dict())
+    fields = get_fields("evidence", request.args)
+    return jsonify(result["extra"]["evidence"].as_dict(fields=fields))
 
 
 @api.route("/evidence/<string:id>/file", methods=["GET"])
@@ -452,12 +533,8 @@ def get_evidence(eid):
 def get_file_for_evidence(id):
     result = Authorizer(current_user).can_user_read_evidence(id)
     evidence = result["extra"]["evidence"]
-    file_bytes = evidence.get_file(as_blob=True)
-    return Response(
-        file_bytes,
-        mimetype="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={evidence.file_name}"},
-    )
+    provider, path, etag = evidence.get_file_location()
+    return file_response(provider, path, evidence.file_name, etag=etag)
 
 
 @api.route("/evidence/<string:eid>", methods=["PUT"])
@@ -492,6 +569,47 @@ def add_evidence_to_controls(eid):
     return jsonify({"message": "ok"})
 
 
+@api.route("/evidence/<string:eid>/mappings", methods=["GET"])
+@login_required
+def get_mapped_subcontrols_for_evidence(eid):
+    result = Authorizer(current_user).can_user_read_evidence(eid)
+    evidence = result["extra"]["evidence"]
+    project_ids = [
+        project.id for project in current_user.get_projects(evidence.tenant_id)
+    ]
+    query = evidence.get_mapped_subcontrols(project_ids=project_ids)
+    return jsonify(models.ControlMapping.results(query))
+
+
+@api.route("/evidence/<string:eid>/propagate", methods=["POST"])
+@login_required
+def propagate_evidence(eid):
+    """
+    Associate the evidence with the mapped subcontrols of the other projects
+    the user can edit. Optional payload: {"project_ids": [...]}
+    """
+    result = Authorizer(current_user).can_user_manage_evidence(eid)
+    evidence = result["extra"]["evidence"]
+    payload = request.get_json(silent=True) or {}
+    authorizer = Authorizer(current_user)
+    project_ids = [
+        project.id
+        for project in current_user.get_projects(evidence.tenant_id)
+        if authorizer._can_user_edit_project(project)
+    ]
+    requested = payload.get("project_ids") if isinstance(payload, dict) else None
+    if requested is not None:
+        if not isinstance(requested, list) or not all(
+            isinstance(pid, str) for pid in requested
+        ):
+            abort(422, "project_ids must be a list of ids")
+    if requested:
+        requested = set(requested)
+        project_ids = [pid for pid in project_ids if pid in requested]
+    counts = evidence.propagate(project_ids)
+    return jsonify({"associations": sum(counts.values()), "projects": counts})
+
+
 @api.route("/policies/<string:pid>", methods=["DELETE"])
 @login_required
 def delete_policy(pid):
@@ -504,8 +622,11 @@ def delete_policy(pid):
 @api.route("/controls/<string:cid>", methods=["DELETE"])
 @login_required
 def delete_control(cid):
-    result = Authorizer(current_user).can_user_manage_control(cid)
-    result["extra"]["control"].visible = False
+    result = Authorizer(current_user).can_user_manage_control(
+        cid, tenant=request.args.get("tenant-id")
+    )
+    control = result["extra"]["control"]
+    control.get_or_create_override(result["extra"]["tenant"]).visible = False
     db.session.commit()
     return jsonify({"message": "ok"})
 
@@ -523,8 +644,14 @@ def get_projects_in_tenant(tid):
     data = []
     result = Authorizer(current_user).can_user_access_tenant(tid)
     exclude = request.args.get("exclude-timely", False)
-    for record in current_user.get_projects(result["extra"]["tenant"].id):
-        data.append(record.as_dict(with_summary=True, exclude_timely=exclude))
+    projects = current_user.get_projects(result["extra"]["tenant"].id)
+    rollups = models.ProjectProgress.for_projects([project.id for project in projects])
+    for record in projects:
+        data.append(
+            record.as_dict(
+                with_summary=True, exclude_timely=exclude, rollup=rollups[record.id]
+            )
+        )
     return jsonify(data)
 
 
@@ -582,38 +709,72 @@ def get_project_completion_history(pid):
 @api.route("/projects/<string:pid>/controls", methods=["GET"])
 @login_required
 def get_controls_for_project(pid):
+    """
+    Query params:
+        view: filter, see Project.CONTROL_VIEWS
+        sort: ref_code, progress or owner. Prefix with "-" for descending
+        limit: page size, enables cursor pagination
+        cursor: value of the X-Next-Cursor header of the previous page
+        fields/include: sparse fieldset, see app.utils.fields
+        stream: NDJSON response, see app.utils.streaming
+    """
     result = Authorizer(current_user).can_user_access_project(pid)
-    data = []
-    view = request.args.get("view")
-    if view == "all":
-        view = None
-    stats = request.args.get("stats", False)
-    if stats:
-        stats = True
-
-    # controls = result["extra"]["project"].get_controls()
-    for control in result["extra"]["project"].controls.all():
-        record = control.as_dict()
-        if view:
-            if view == "with-evidence" and record["progress_evidence"] > 0:
-                data.append(record)
-            elif view == "missing-evidence" and record["progress_evidence"] == 0:
-                data.append(record)
-            elif view == "not-implemented" and record["progress_implemented"] == 0:
-                data.append(record)
-            elif view == "implemented" and record["progress_implemented"] == 100:
-                data.append(record)
-            elif view == "applicable" and record["is_applicable"]:
-                data.append(record)
-            elif view == "not-applicable" and not record["is_applicable"]:
-                data.append(record)
-            elif view == "complete" and record["is_complete"]:
-                data.append(record)
-            elif view == "not-complete" and not record["is_complete"]:
-                data.append(record)
-        else:
-            data.append(record)
-    return jsonify(data)
+    project = result["extra"]["project"]
+    if response := not_modified(project):
+        return response
+    fields = get_fields("control", request.args)
+    sort = request.args.get("sort")
+    descending = False
+    if sort and sort.startswith("-"):
+        sort = sort[1:]
+        descending = True
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    query, sort_columns = project.query_controls(
+        view=request.args.get("view"), sort=sort
+    )
+
+    if wants_stream() and not (limit or cursor):
+
+        def generate():
+            # walk the controls page by page so only one page is held in memory
+            next_cursor = None
+            while True:
+                controls, next_cursor = keyset_paginate(
+                    query,
+                    sort_columns,
+                    cursor=next_cursor,
+                    limit=STREAM_PAGE_SIZE,
+                    descending=descending,
+                )
+                loader = ProjectControlLoader(project, fields=fields)
+                for control in loader.load(controls):
+                    yield control.as_dict(fields=fields)
+                if not next_cursor:
+                    break
+
+        return with_etag(ndjson_response(generate()), project)
+
+    next_cursor = None
+    if limit or cursor:
+        controls, next_cursor = keyset_paginate(
+            query, sort_columns, cursor=cursor, limit=limit, descending=descending
+        )
+    elif sort:
+        order = [column.desc() if descending else column for column in sort_columns]
+        controls = query.order_by(*order)
+    else:
+        controls = query
+
+    loader = ProjectControlLoader(project, fields=fields)
+    records = [control.as_dict(fields=fields) for control in loader.load(controls)]
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if wants_stream():
+        return with_etag(ndjson_response(records, headers=headers), project)
+    response = jsonify(records)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return with_etag(response, project)
 
 
 @api.route("/projects/<string:pid>/risks", methods=["POST"])
@@ -676,18 +837,27 @@ def create_risk_from_feedback(cid, fid):
 @login_required
 def get_policies_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
+    if response := not_modified(result["extra"]["project"]):
+        return response
+    fields = get_fields("policy", request.args)
     data = []
     for policy in result["extra"]["project"].policies.all():
-        data.append(policy.as_dict())
-    return jsonify(data)
+        data.append(policy.as_dict(fields=fields))
+    return with_etag(jsonify(data), result["extra"]["project"])
 
 
 @api.route("/projects/<string:pid>/policies/<string:ppid>", methods=["GET"])
 @login_required
 def get_policy_for_project(pid, ppid):
     result = Authorizer(current_user).can_user_read_project_policy(ppid)
+    project = result["extra"]["policy"].project
+    if response := not_modified(project):
+        return response
     version_id = request.args.get("version-id")
-    return jsonify(result["extra"]["policy"].as_dict())
+    fields = get_fields("policy", request.args)
+    return with_etag(
+        jsonify(result["extra"]["policy"].as_dict(fields=fields)), project
+    )
 
 
 @api.route(
@@ -784,28 +954,60 @@ def remove_control_from_policy(pid, ppid, cid):
 @login_required
 def get_control_for_project(pid, cid):
     result = Authorizer(current_user).can_user_read_project_control(cid)
-    return jsonify(result["extra"]["control"].as_dict())
+    project = result["extra"]["control"].project
+    if response := not_modified(project):
+        return response
+    fields = get_fields("control", request.args)
+    return with_etag(
+        jsonify(result["extra"]["control"].as_dict(fields=fields)), project
+    )
 
 
 @api.route("/projects/<string:pid>/subcontrols/<string:sid>", methods=["GET"])
 @login_required
 def get_subcontrol_for_project(pid, sid):
     result = Authorizer(current_user).can_user_read_project_subcontrol(sid)
-    return jsonify(result["extra"]["subcontrol"].as_dict(include_evidence=True))
+    project = result["extra"]["subcontrol"].project
+    if response := not_modified(project):
+        return response
+    fields = get_fields("subcontrol", request.args)
+    return with_etag(
+        jsonify(
+            result["extra"]["subcontrol"].as_dict(include_evidence=True, fields=fields)
+        ),
+        project,
+    )
+
+
+@api.route("/projects/<string:pid>/subcontrols/<string:sid>/mappings", methods=["GET"])
+@login_required
+def get_mapped_subcontrols(pid, sid):
+    result = Authorizer(current_user).can_user_read_project_subcontrol(sid)
+    subcontrol = result["extra"]["subcontrol"]
+    project_ids = [
+        project.id
+        for project in current_user.get_projects(subcontrol.project.tenant_id)
+    ]
+    query = subcontrol.get_mapped_subcontrols(project_ids=project_ids)
+    return jsonify(models.ControlMapping.results(query))
 
 
 @api.route("/projects/<string:pid>/controls/<string:cid>/subcontrols", methods=["GET"])
 @login_required
 def get_subcontrols_for_control_in_project(pid, cid):
     result = Authorizer(current_user).can_user_read_project_control(cid)
+    project = result["extra"]["control"].project
+    if response := not_modified(project):
+        return response
+    fields = get_fields("subcontrol", request.args)
     data = []
     for subcontrol in (
         result["extra"]["control"]
         .subcontrols.order_by(models.ProjectSubControl.date_added.asc())
         .all()
     ):
-        data.append(subcontrol.as_dict(include_evidence=True))
-    return jsonify(data)
+        data.append(subcontrol.as_dict(include_evidence=True, fields=fields))
+    return with_etag(jsonify(data), project)
 
 
 @api.route("/projects/<string:pid>/controls/<string:cid>", methods=["DELETE"])
@@ -845,6 +1047,9 @@ def update_review_status_for_control(id):
         id, payload.get("review-status")
     )
     result["extra"]["control"].review_status = payload["review-status"].lower()
+    models.ProjectProgress.refresh(
+        result["extra"]["control"].project_id, [result["extra"]["control"].id]
+    )
     db.session.commit()
     return jsonify(result["extra"]["control"].as_dict())
 
@@ -866,6 +1071,29 @@ def update_subcontrols_in_control_for_project(cid, sid):
     return jsonify(subcontrol.as_dict())
 
 
+@api.route("/projects/<string:pid>/subcontrols", methods=["PATCH"])
+@login_required
+def bulk_update_subcontrols_for_project(pid):
+    """
+    Update many subcontrols in one transaction
+
+    Body:
+        [{"id": "...", "implemented": 100, "applicable": true, "notes": "...",
+          "owner_id": "...", "evidence": ["..."]}, ...]
+    """
+    result = Authorizer(current_user).can_user_manage_project_subcontrols(pid)
+    results = result["extra"]["project"].bulk_update_subcontrols(
+        request.get_json(), owner_id=result["extra"]["owner_id"]
+    )
+    return jsonify(
+        {
+            "updated": len([record for record in results if record["ok"]]),
+            "failed": len([record for record in results if not record["ok"]]),
+            "results": results,
+        }
+    )
+
+
 @api.route("/project-controls/<string:cid>/applicability", methods=["PUT"])
 @login_required
 def set_applicability_of_control_for_project(cid):
@@ -879,11 +1107,13 @@ def set_applicability_of_control_for_project(cid):
 @login_required
 def project_evidence_by_control(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
+    if response := not_modified(result["extra"]["project"]):
+        return response
     data = []
     if evidence := result["extra"]["project"].evidence_groupings():
         for rid, record in evidence.items():
             data.append(record)
-    return jsonify(data)
+    return with_etag(jsonify(data), result["extra"]["project"])
 
 
 @api.route("/projects/<string:pid>/controls/<string:cid>/notes", methods=["PUT"])
@@ -1004,13 +1234,16 @@ def delete_comment_for_control(pid, cid, ccid):
 @login_required
 def get_comments_for_control(pid, cid):
     result = Authorizer(current_user).can_user_read_project_control(cid)
+    project = result["extra"]["control"].project
+    if response := not_modified(project):
+        return response
     data = [
         comment.as_dict()
         for comment in result["extra"]["control"]
         .comments.order_by(models.ControlComment.date_added.asc())
         .all()
     ]
-    return jsonify(data)
+    return with_etag(jsonify(data), project)
 
 
 @api.route("/projects/<string:pid>/subcontrols/<string:sid>/comments", methods=["POST"])
@@ -1147,10 +1380,111 @@ def delete_feedback_for_control(pid, cid, fid):
 @login_required
 def get_evidence_for_project(pid):
     result = Authorizer(current_user).can_user_read_project(pid)
-    data = [
-        evidence.as_dict() for evidence in result["extra"]["project"].evidence.all()
-    ]
-    return jsonify(data)
+    project = result["extra"]["project"]
+    if response := not_modified(project):
+        return response
+    fields = get_fields("evidence", request.args)
+    if wants_stream():
+        return with_etag(
+            ndjson_response(
+                evidence.as_dict(fields=fields)
+                for evidence in stream_query(project.evidence)
+            ),
+            project,
+        )
+    data = [evidence.as_dict(fields=fields) for evidence in project.evidence.all()]
+    return with_etag(jsonify(data), project)
+
+
+@api.route("/projects/<string:pid>/evidence/archive", methods=["GET"])
+@login_required
+def get_evidence_archive_for_project(pid):
+    result = Authorizer(current_user).can_user_read_project(pid)
+    project = result["extra"]["project"]
+    items, manifest = project.get_evidence_archive()
+    response = Response(
+        stream_with_context(stream_archive(items, manifest)),
+        mimetype="application/zip",
+        direct_passthrough=True,
+    )
+    response.headers.set(
+        "Content-Disposition",
+        "attachment",
+        filename=f"{secure_filename(project.name) or project.id}-evidence.zip",
+    )
+    return response
+
+
+@api.route("/projects/<string:pid>/evidence/uploads", methods=["POST"])
+@login_required
+def create_evidence_upload(pid):
+    result = Authorizer(current_user).can_user_edit_project(pid)
+    data = request.get_json() or {}
+    upload, instructions = models.EvidenceUpload.create(
+        result["extra"]["project"],
+        current_user,
+        file_name=data.get("file_name"),
+        size=data.get("size"),
+        sha256=data.get("sha256"),
+        name=data.get("name"),
+        description=data.get("description"),
+        evidence_id=data.get("evidence_id"),
+    )
+    return jsonify({"upload": upload.as_dict(), **instructions}), 201
+
+
+def get_evidence_upload(pid, uid):
+    return (
+        models.EvidenceUpload.query.filter(models.EvidenceUpload.project_id == pid)
+        .filter(models.EvidenceUpload.id == uid)
+        .first_or_404()
+    )
+
+
+@api.route("/projects/<string:pid>/evidence/uploads/<string:uid>", methods=["GET"])
+@login_required
+def get_evidence_upload_status(pid, uid):
+    Authorizer(current_user).can_user_edit_project(pid)
+    return jsonify(get_evidence_upload(pid, uid).as_dict())
+
+
+@api.route("/projects/<string:pid>/evidence/uploads/<string:uid>", methods=["PUT"])
+@login_required
+def upload_evidence_chunk(pid, uid):
+    Authorizer(current_user).can_user_edit_project(pid)
+    upload = get_evidence_upload(pid, uid)
+    content_range = parse_content_range_header(request.headers.get("Content-Range"))
+    if not content_range or content_range.units != "bytes" or not content_range.length:
+        abort(400, "Content-Range header is required (bytes start-end/size)")
+    received = upload.write_chunk(
+        request.stream,
+        content_range.start,
+        content_range.stop - 1,
+        content_range.length,
+    )
+    return jsonify({"received": received, "size": upload.size})
+
+
+@api.route(
+    "/projects/<string:pid>/evidence/uploads/<string:uid>/finalize", methods=["POST"]
+)
+@login_required
+def finalize_evidence_upload(pid, uid):
+    Authorizer(current_user).can_user_edit_project(pid)
+    evidence = get_evidence_upload(pid, uid).finalize(current_user)
+    return jsonify(evidence.as_dict())
+
+
+@api.route("/projects/<string:pid>/evidence/uploads/<string:uid>", methods=["DELETE"])
+@login_required
+def cancel_evidence_upload(pid, uid):
+    Authorizer(current_user).can_user_edit_project(pid)
+    upload = get_evidence_upload(pid, uid)
+    upload.check_pending()
+    upload.status = "cancelled"
+    upload.delete_staged_file()
+    db.session.commit()
+    return jsonify({"message": "ok"})
 
 
 @api.route("/projects/<string:id>/evidence", methods=["POST"])
@@ -1184,8 +1518,10 @@ def remove_file_from_evidence(pid, sid, eid):
 @login_required
 def get_evidence_for_subcontrol(pid, sid):
     result = Authorizer(current_user).can_user_read_project_subcontrol(sid)
+    fields = get_fields("evidence", request.args)
     data = [
-        evidence.as_dict() for evidence in result["extra"]["subcontrol"].evidence.all()
+        evidence.as_dict(fields=fields)
+        for evidence in result["extra"]["subcontrol"].evidence.all()
     ]
     return jsonify(data)
 
@@ -1234,6 +1570,7 @@ def delete_evidence_for_subcontrol(pid, sid, eid):
         sid, eid
     )
     result["extra"]["subcontrol"].evidence.remove(result["extra"]["evidence"])
+    models.ProjectProgress.refresh_subcontrols([result["extra"]["subcontrol"].id])
     db.session.commit()
     return jsonify({"message": "ok"})
 
@@ -1584,7 +1921,11 @@ def generate_gap_assessment(pid):
 @api.route("/projects/<string:pid>/soa/export", methods=["GET"])
 @login_required  
 def export_soa_document(pid):
-    """Export SOA document as structured data for reporting"""
+    """Export SOA document as structured data for reporting
+
+    When streamed (see app.utils.streaming) the first line is the document
+    header and every following line is a control
+    """
     result = Authorizer(current_user).can_user_access_project(pid)
     project = result["extra"]["project"]
     
@@ -1595,40 +1936,77 @@ def export_soa_document(pid):
         "organization": project.tenant.name,
         "generated_date": arrow.now().format("YYYY-MM-DD"),
         "version": "1.0",
-        "controls": []
     }
-    
-    # Include all controls with applicability decisions
-    for control in project.controls.order_by(models.ProjectControl.control_id):
-        control_data = {
-            "ref_code": control.control.ref_code,
-            "name": control.control.name,
-            "description": control.control.description,
-            "category": control.control.category,
-            "applicable": control.is_applicable,
-            "justification": control.notes or "",
-            "implementation_status": "pending"
-        }
-        
-        if control.is_applicable:
-            # Check implementation status of subcontrols
-            implemented_count = control.subcontrols.filter(
-                models.ProjectSubControl.implementation_status == "implemented"
-            ).count()
-            total_count = control.subcontrols.filter(
-                models.ProjectSubControl.is_applicable == True
-            ).count()
-            
+
+    # Applicable and fully implemented subcontrols per control, in one query
+    counts = {
+        record.project_control_id: record
+        for record in db.session.query(
+            models.ProjectSubControl.project_control_id,
+            func.sum(
+                case([(models.ProjectSubControl.is_applicable == True, 1)], else_=0)
+            ).label("applicable"),
+            func.sum(
+                case(
+                    [
+                        (
+                            and_(
+                                models.ProjectSubControl.is_applicable == True,
+                                models.ProjectSubControl.implemented == 100,
+                            ),
+                            1,
+                        )
+                    ],
+                    else_=0,
+                )
+            ).label("implemented"),
+        )
+        .filter(models.ProjectSubControl.project_id == project.id)
+        .group_by(models.ProjectSubControl.project_control_id)
+        .all()
+    }
+
+    def soa_controls():
+        # Include all controls with applicability decisions
+        for control, parent in stream_query(
+            db.session.query(models.ProjectControl, models.Control)
+            .join(models.Control, models.Control.id == models.ProjectControl.control_id)
+            .filter(models.ProjectControl.project_id == project.id)
+            .order_by(models.ProjectControl.control_id)
+        ):
+            record = counts.get(control.id)
+            total_count = int(record.applicable or 0) if record else 0
+            implemented_count = int(record.implemented or 0) if record else 0
+            control_data = {
+                "ref_code": parent.ref_code,
+                "name": parent.name,
+                "description": parent.description,
+                "category": parent.category,
+                "applicable": total_count > 0,
+                "justification": control.notes or "",
+                "implementation_status": "pending"
+            }
+
             if total_count > 0:
+                # Check implementation status of subcontrols
                 if implemented_count == total_count:
                     control_data["implementation_status"] = "fully_implemented"
                 elif implemented_count > 0:
                     control_data["implementation_status"] = "partially_implemented"
                 else:
                     control_data["implementation_status"] = "not_implemented"
-        else:
-            control_data["implementation_status"] = "not_applicable"
-            
-        soa_document["controls"].append(control_data)
-    
+            else:
+                control_data["implementation_status"] = "not_applicable"
+
+            yield control_data
+
+    if wants_stream():
+
+        def generate():
+            yield soa_document
+            yield from soa_controls()
+
+        return ndjson_response(generate())
+
+    soa_document["controls"] = list(soa_controls())
     return jsonify(soa_document)
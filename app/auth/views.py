@@ -295,9 +295,10 @@ def post_get_started():
             current_user,
             tenant_name,
             current_user.email,
-            init_data=True,
         )
     except Exception as e:
         abort(400, str(e))
+    # the frameworks and policies are loaded in the background
+    tenant.submit_bootstrap(user=current_user)
     flash("Created tenant")
     return redirect(url_for("main.home"))
@@ -4,4 +4,13 @@ from .init_db import (
     CreateDbCommand,
     DataImportCommand,
     ForceDropTablesCommand,
+    RebuildProgressCommand,
+    CheckProgressCommand,
+    SnapshotCompletionCommand,
+    ImportFrameworkCommand,
+    BuildCatalogCommand,
+    ImportControlsCommand,
+    RebuildMappingsCommand,
+    UpgradeFrameworkCommand,
+    ReconcileStorageCommand,
 )
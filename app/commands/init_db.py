@@ -1,9 +1,13 @@
 from flask import current_app
-from flask_script import Command
+from flask_script import Command, Option
 from flask_migrate import Migrate
 from alembic import command
 from app.models import *
+from app.utils.catalog import catalog
+from app.utils.control_import import ControlImporter, reader_for
+from app.utils.framework_upgrade import FrameworkUpgrade
 from app import db
+import json
 
 
 class InitDbCommand(Command):
@@ -44,6 +48,203 @@ class ForceDropTablesCommand(Command):
         force_drop_all_tables()
 
 
+class RebuildProgressCommand(Command):
+    """Rebuild the project_progress rollups"""
+
+    option_list = (Option("--project", "-p", dest="project_id", default=None),)
+
+    def run(self, project_id=None):
+        for project in get_projects(project_id):
+            ProjectProgress.rebuild(project.id, commit=True)
+            print(f"[INFO] Rebuilt progress rollup for project:{project.id}")
+
+
+class CheckProgressCommand(Command):
+    """Compare the project_progress rollups with a full recompute"""
+
+    option_list = (
+        Option("--project", "-p", dest="project_id", default=None),
+        Option("--repair", dest="repair", action="store_true", default=False),
+    )
+
+    def run(self, project_id=None, repair=False):
+        drift = 0
+        for project in get_projects(project_id):
+            errors = ProjectProgress.check(project.id)
+            if not errors:
+                continue
+            drift += 1
+            print(f"[WARNING] Progress rollup drift for project:{project.id}")
+            for error in errors:
+                print(f"    {error}")
+            if repair:
+                ProjectProgress.rebuild(project.id, commit=True)
+                print(f"[INFO] Rebuilt progress rollup for project:{project.id}")
+        print(f"[INFO] Checked progress rollups. Projects with drift:{drift}")
+
+
+class SnapshotCompletionCommand(Command):
+    """Record the completion history of all projects in bulk"""
+
+    option_list = (
+        Option("--project", "-p", dest="project_id", default=None),
+        Option("--force", dest="force", action="store_true", default=False),
+    )
+
+    def run(self, project_id=None, force=False):
+        project_ids = None
+        if project_id:
+            project_ids = [project.id for project in get_projects(project_id)]
+        count = CompletionHistory.snapshot(project_ids=project_ids, force=force)
+        print(f"[INFO] Recorded completion history for {count} projects")
+
+
+class ImportFrameworkCommand(Command):
+    """Load the controls of a framework from FRAMEWORK_FOLDER into the global
+    catalog, and link a tenant to it when --tenant is given"""
+
+    option_list = (
+        Option("--tenant", "-t", dest="tenant_id", required=False),
+        Option("--name", "-n", dest="name", required=True),
+    )
+
+    def run(self, tenant_id, name):
+        if report := Framework.load_catalog(name):
+            print(
+                f"[INFO] Imported {report['controls']} controls and "
+                f"{report['subcontrols']} subcontrols in {report['seconds']}s "
+                f"({report['rows_per_second']} rows/s)"
+            )
+        else:
+            print(f"[INFO] Framework:{name} is already in the catalog")
+        if tenant_id:
+            tenant = Tenant.query.get_or_404(tenant_id)
+            if not Framework.find_by_name(name, tenant.id):
+                Framework.create(name, tenant)
+            tenant.create_base_controls_for_framework(name)
+            print(f"[INFO] Linked tenant:{tenant.id} to framework:{name}")
+
+
+class ImportControlsCommand(Command):
+    """Stream the controls of a large JSON or CSV file into a tenant framework"""
+
+    option_list = (
+        Option("--tenant", "-t", dest="tenant_id", required=True),
+        Option("--file", "-f", dest="path", required=True),
+        Option("--name", "-n", dest="name", default=None),
+        Option("--format", dest="format", default=None),
+        Option("--batch-size", dest="batch_size", type=int, default=1000),
+    )
+
+    def run(self, tenant_id, path, name=None, format=None, batch_size=1000):
+        tenant = Tenant.query.get_or_404(tenant_id)
+        format = format or ("csv" if path.lower().endswith(".csv") else "json")
+        with open(path, "rb") as f:
+            report = ControlImporter(
+                tenant.id, framework=name, batch_size=batch_size
+            ).run(reader_for(f, format))
+        print(
+            f"[INFO] Imported {report['controls']} controls and "
+            f"{report['subcontrols']} subcontrols in {report['seconds']}s "
+            f"({report['rows_per_second']} rows/s), {report['failed']} rows rejected"
+        )
+        for error in report["errors"]:
+            print(f"[WARNING] Row {error['row']} ({error['ref_code']}): {', '.join(error['errors'])}")
+        if report["error"]:
+            print(f"[ERROR] {report['error']}")
+
+
+class BuildCatalogCommand(Command):
+    """Compile the base frameworks and policies into the catalog snapshot"""
+
+    def run(self):
+        catalog.load(current_app, rebuild=True)
+        print(
+            f"[INFO] Catalog written to {current_app.config['CATALOG_CACHE']} with "
+            f"{len(catalog.framework_names())} frameworks and "
+            f"{len(catalog.policy_names())} policies"
+        )
+
+
+class RebuildMappingsCommand(Command):
+    """Rebuild the cross-framework control mappings from the controls"""
+
+    def run(self):
+        count = ControlMapping.rebuild()
+        print(f"[INFO] Rebuilt {count} control mappings")
+
+
+class UpgradeFrameworkCommand(Command):
+    """Apply the changes of a framework file to the stored controls of every
+    tenant. Without --file the file in FRAMEWORK_FOLDER is used"""
+
+    option_list = (
+        Option("--name", "-n", dest="name", required=True),
+        Option("--file", "-f", dest="path", default=None),
+        Option("--dry-run", dest="dry_run", action="store_true", default=False),
+        Option("--propagate", dest="propagate", action="store_true", default=False),
+        Option("--batch-size", dest="batch_size", type=int, default=1000),
+    )
+
+    def run(self, name, path=None, dry_run=False, propagate=False, batch_size=1000):
+        if path:
+            with open(path) as f:
+                controls = json.load(f)
+        else:
+            catalog.load(current_app)
+            if (controls := catalog.get_controls(name)) is None:
+                print(f"[ERROR] Framework:{name} is not in {current_app.config['FRAMEWORK_FOLDER']}")
+                return
+        report = FrameworkUpgrade(
+            name, controls, propagate=propagate, batch_size=batch_size
+        ).run(dry_run=dry_run)
+        prefix = "[DRY RUN] " if dry_run else ""
+        for framework in report["frameworks"]:
+            print(
+                f"[INFO] {prefix}Framework:{framework['framework_id']} "
+                f"(tenant:{framework['tenant_id'] or 'catalog'}): "
+                f"{len(framework['added'])} added, {len(framework['changed'])} changed, "
+                f"{len(framework['removed'])} removed, {len(framework['retained'])} retained, "
+                f"{framework['unchanged']} unchanged"
+            )
+            for change in framework["changed"]:
+                print(f"    {change['ref_code']}: {', '.join(change['fields']) or 'subcontrols'}")
+            if framework.get("propagated"):
+                print(f"    {framework['propagated']} subcontrols added to projects")
+            for tenant_id, ref_codes in framework["overrides"].items():
+                print(f"[WARNING] Tenant:{tenant_id} overrides {', '.join(ref_codes)}")
+        if not report["frameworks"]:
+            print(f"[INFO] Framework:{name} is not loaded")
+
+
+class ReconcileStorageCommand(Command):
+    """Correct the storage ledger against the storage provider, run it
+    periodically (e.g. nightly from cron)"""
+
+    option_list = (Option("--tenant", "-t", dest="tenant_id", default=None),)
+
+    def run(self, tenant_id=None):
+        if tenant_id:
+            tenants = [Tenant.query.get_or_404(tenant_id)]
+        else:
+            tenants = Tenant.query.all()
+        for tenant in tenants:
+            drift = StorageUsage.reconcile(tenant)
+            for scope, rows in drift.items():
+                for scope_id, usage in rows.items():
+                    print(
+                        f"[WARNING] Tenant:{tenant.id} {scope}:{scope_id} "
+                        f"{usage['before']} -> {usage['after']} bytes"
+                    )
+        print(f"[INFO] Reconciled the storage of {len(tenants)} tenants")
+
+
+def get_projects(project_id=None):
+    if project_id:
+        return [Project.query.get_or_404(project_id)]
+    return Project.query.all()
+
+
 def init_db():
     """Initialize the database. Will delete and recreate"""
     db.drop_all()
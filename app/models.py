@@ -1,23 +1,32 @@
-from sqlalchemy import func, distinct, case
-from sqlalchemy.orm import validates
+from sqlalchemy import func, distinct, case, or_, and_, exc, inspect as sqlalchemy_inspect
+from sqlalchemy.orm import validates, object_session
 from app.utils.mixin_models import (
     DateMixin,
     SubControlMixin,
     ControlMixin,
     QueryMixin,
     AuthorizerMixin,
+    PrefetchMixin,
 )
 from flask_login import UserMixin
-from flask import current_app, render_template, abort
+from flask import current_app, render_template, abort, request, url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.datastructures import FileStorage
-from datetime import datetime
+from werkzeug.exceptions import HTTPException
+from datetime import datetime, timedelta
 from sqlalchemy.event import listens_for
 from app import db, login
 from uuid import uuid4
-from app.utils import misc
+from app.utils import misc, progress, bulk, mappings, blobs, archive
+from app.utils import fields as fields_util
+from app.utils.completion import completion_queue
+from app.utils.cache import summary_cache
+from app.utils.catalog import catalog
+from app.utils.jobs import job_runner
 import arrow
 import json
+import hashlib
+import base64
 import os
 from string import Formatter
 from app.email import send_email
@@ -66,6 +75,450 @@ class Finding(db.Model):
         return data
 
 
+class FileBlob(db.Model):
+    """
+    Stored content of uploaded files, shared by the evidence and vendor files
+    of a tenant with the same SHA-256 (see app.utils.blobs)
+    """
+
+    __tablename__ = "file_blobs"
+    __table_args__ = (db.UniqueConstraint("tenant_id", "provider", "sha256"),)
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, default=0)
+    provider = db.Column(db.String(), nullable=False)
+    path = db.Column(db.String(), nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    def as_dict(self):
+        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return data
+
+    @staticmethod
+    def location(provider, path):
+        if provider == "local":
+            return os.path.join(current_app.config["EVIDENCE_FOLDER"], path)
+        return path
+
+    def get_file_location(self):
+        """
+        Returns:
+            (provider, path of the file in the provider, ETag)
+        """
+        storage_method = current_app.config["STORAGE_METHOD"]
+        if self.provider != storage_method:
+            abort(500, f"File storage backend: {self.provider} is not enabled.")
+        return self.provider, FileBlob.location(self.provider, self.path), self.sha256
+
+    def get_file(self, as_blob=False):
+        provider, path, _ = self.get_file_location()
+        file_handler = FileStorageHandler(provider=provider)
+        return file_handler.get_file(path=path, as_blob=as_blob)
+
+    @staticmethod
+    def acquire(tenant_id, provider, sha256):
+        """
+        Add a reference to stored content
+
+        Returns:
+            blob, None if the content is not stored
+        """
+        blob = FileBlob.query.filter(
+            FileBlob.tenant_id == tenant_id,
+            FileBlob.provider == provider,
+            FileBlob.sha256 == sha256,
+        ).first()
+        if not blob:
+            return None
+        table = FileBlob.__table__
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.id == blob.id)
+            .where(table.c.ref_count > 0)
+            .values(ref_count=table.c.ref_count + 1)
+        ).rowcount
+        # a blob without references is being deleted
+        if not updated:
+            return None
+        db.session.expire(blob, ["ref_count"])
+        return blob
+
+    @staticmethod
+    def store(file_object, tenant_id, provider):
+        """
+        Store an upload and add a reference to it, content that is already
+        stored is not uploaded again. Does not commit
+
+        Returns:
+            blob
+        """
+        folder = None
+        if provider == "local":
+            # next to the staged direct uploads, left out of the measured usage
+            folder = FileBlob.location(
+                provider, os.path.join("tenants", tenant_id.lower(), "uploads")
+            )
+            os.makedirs(folder, exist_ok=True)
+        sha256, size, temp_path = blobs.spool(file_object, folder=folder)
+        try:
+            if blob := FileBlob.acquire(tenant_id, provider, sha256):
+                return blob
+            if not Tenant.query.get(tenant_id).can_save_file_in_folder(size=size):
+                abort(400, "Tenant has exceeded storage limits")
+
+            def upload(location):
+                file_handler = FileStorageHandler(provider=provider)
+                if file_handler.upload_file(temp_path, abs_path=location) is False:
+                    abort(500, f"Unable to upload the file to {provider}")
+
+            return FileBlob.insert(tenant_id, provider, sha256, size, upload)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def insert(tenant_id, provider, sha256, size, put):
+        """
+        Add new content with one reference. Does not commit
+
+        Args:
+            put: function that writes the file at its location in the provider
+
+        Returns:
+            blob
+        """
+        blob_id = str(shortuuid.ShortUUID().random(length=8)).lower()
+        blob = FileBlob(
+            id=blob_id,
+            sha256=sha256,
+            size=size,
+            provider=provider,
+            path=blobs.blob_key(tenant_id, sha256, blob_id),
+            ref_count=1,
+            tenant_id=tenant_id,
+        )
+        location = FileBlob.location(provider, blob.path)
+        if provider == "local":
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+        put(location)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except exc.IntegrityError:
+            # stored at the same time by another request, under another path
+            try:
+                FileStorageHandler(provider=provider).delete_file(path=location)
+            except Exception as e:
+                logging.warning(f"Failed to delete the blob:{location}. Error:{e}")
+            if blob := FileBlob.acquire(tenant_id, provider, sha256):
+                return blob
+            raise
+        StorageUsage.add(tenant_id, "tenant", tenant_id, size, files=1)
+        return blob
+
+    @staticmethod
+    def release(blob_id, connection=None, session=None):
+        """
+        Remove a reference, the stored file is deleted with the last reference
+        once the session commits
+        """
+        session = session or db.session()
+        execute = (connection or session).execute
+        table = FileBlob.__table__
+        execute(
+            table.update()
+            .where(table.c.id == blob_id)
+            .values(ref_count=table.c.ref_count - 1)
+        )
+        row = execute(
+            db.select([table.c.provider, table.c.path, table.c.size, table.c.tenant_id])
+            .where(table.c.id == blob_id)
+            .where(table.c.ref_count <= 0)
+        ).first()
+        if row:
+            execute(table.delete().where(table.c.id == blob_id))
+            StorageUsage.add(
+                row.tenant_id,
+                "tenant",
+                row.tenant_id,
+                -(row.size or 0),
+                files=-1,
+                connection=connection,
+            )
+            blobs.schedule_delete(
+                session, row.provider, FileBlob.location(row.provider, row.path)
+            )
+
+    @staticmethod
+    def get_size(blob_id, connection=None):
+        table = FileBlob.__table__
+        return (connection or db.session).execute(
+            db.select([table.c.size]).where(table.c.id == blob_id)
+        ).scalar() or 0
+
+
+class StorageUsage(db.Model):
+    """
+    Ledger of the stored bytes of a tenant and of its projects and vendors.
+    It is updated on upload, overwrite and delete, so a quota check reads a
+    single row. The tenant row counts the stored content (a file shared by
+    several evidence items counts once), project and vendor rows count the
+    files that belong to them. StorageUsage.reconcile corrects the drift
+    against the storage provider
+    """
+
+    __tablename__ = "storage_usage"
+    __table_args__ = (db.UniqueConstraint("tenant_id", "scope", "scope_id"),)
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    # tenant, project or vendor
+    scope = db.Column(db.String(), nullable=False)
+    scope_id = db.Column(db.String(), nullable=False)
+    bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    date_reconciled = db.Column(db.DateTime)
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    def as_dict(self):
+        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return data
+
+    @staticmethod
+    def add(tenant_id, scope, scope_id, size, files=0, connection=None):
+        """
+        Add to the counters of a row (negative values to subtract), the row
+        is created on first use. Does not commit
+        """
+        if not tenant_id or not scope_id or (not size and not files):
+            return
+        table = StorageUsage.__table__
+        update = (
+            table.update()
+            .where(table.c.tenant_id == tenant_id)
+            .where(table.c.scope == scope)
+            .where(table.c.scope_id == scope_id)
+            .values(
+                bytes=table.c.bytes + size,
+                files=table.c.files + files,
+                date_updated=datetime.utcnow(),
+            )
+        )
+        insert = table.insert().values(
+            bulk.with_defaults(
+                StorageUsage,
+                {
+                    "tenant_id": tenant_id,
+                    "scope": scope,
+                    "scope_id": scope_id,
+                    "bytes": max(size, 0),
+                    "files": max(files, 0),
+                },
+            )
+        )
+        if connection is not None:
+            if not connection.execute(update).rowcount:
+                connection.execute(insert)
+            return
+        if db.session.execute(update).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert)
+        except exc.IntegrityError:
+            # created at the same time by another request
+            db.session.execute(update)
+
+    @staticmethod
+    def set(tenant_id, scope, scope_id, size, files):
+        table = StorageUsage.__table__
+        values = {
+            "bytes": size,
+            "files": files,
+            "date_reconciled": datetime.utcnow(),
+            "date_updated": datetime.utcnow(),
+        }
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.tenant_id == tenant_id)
+            .where(table.c.scope == scope)
+            .where(table.c.scope_id == scope_id)
+            .values(**values)
+        ).rowcount
+        if not updated:
+            db.session.execute(
+                table.insert().values(
+                    bulk.with_defaults(
+                        StorageUsage,
+                        {
+                            "tenant_id": tenant_id,
+                            "scope": scope,
+                            "scope_id": scope_id,
+                            **values,
+                        },
+                    )
+                )
+            )
+
+    @staticmethod
+    def get_bytes(tenant_id, scope="tenant", scope_id=None):
+        return (
+            db.session.query(StorageUsage.bytes)
+            .filter(
+                StorageUsage.tenant_id == tenant_id,
+                StorageUsage.scope == scope,
+                StorageUsage.scope_id == (scope_id or tenant_id),
+            )
+            .scalar()
+            or 0
+        )
+
+    @staticmethod
+    def get_tenant_bytes(tenant):
+        """
+        Stored bytes of a tenant for the quota checks. The ledger is
+        reconciled in the background when it is older than
+        STORAGE_RECONCILE_INTERVAL seconds. A tenant without a ledger yet
+        (files stored before it existed) is measured on the storage provider
+        instead of counted as empty, and its ledger is seeded
+        """
+        row = (
+            db.session.query(StorageUsage.bytes, StorageUsage.date_reconciled)
+            .filter(
+                StorageUsage.tenant_id == tenant.id,
+                StorageUsage.scope == "tenant",
+                StorageUsage.scope_id == tenant.id,
+            )
+            .first()
+        )
+        if row is None:
+            tenant.submit_storage_reconcile(detached=True)
+            return StorageUsage.measure(tenant)[("tenant", tenant.id)][0]
+        interval = int(current_app.config.get("STORAGE_RECONCILE_INTERVAL") or 0)
+        if interval and (
+            not row.date_reconciled
+            or row.date_reconciled < datetime.utcnow() - timedelta(seconds=interval)
+        ):
+            tenant.submit_storage_reconcile(detached=True)
+        return row.bytes
+
+    @staticmethod
+    def measure(tenant, provider=None):
+        """
+        Usage of a tenant from the listing of the provider (tenant row) and
+        the files of its projects and vendors, nothing is written
+
+        Returns:
+            {(scope, scope_id): [bytes, files]}
+        """
+        provider = provider or current_app.config["STORAGE_METHOD"]
+        handler = FileStorageHandler(provider=provider)
+        tenant_key = ("tenant", tenant.id)
+        after = {
+            tenant_key: [
+                handler.get_size(
+                    folder=tenant.get_evidence_folder(provider=provider), recursive=True
+                ),
+                FileBlob.query.filter(FileBlob.tenant_id == tenant.id).count(),
+            ]
+        }
+
+        def listed_size(folder, recursive=False):
+            try:
+                return handler.get_size(folder=folder, recursive=recursive)
+            except Exception as e:
+                logging.warning(f"Failed to list:{folder}. Error:{e}")
+                return 0
+
+        # files of pending direct uploads are reserved, not stored yet
+        after[tenant_key][0] -= listed_size(
+            os.path.join(tenant.get_evidence_folder(provider=provider), "uploads"),
+            recursive=True,
+        )
+
+        for scope, model, owner_id, owner in (
+            ("project", ProjectEvidence, ProjectEvidence.project_id, Project),
+            ("vendor", VendorFile, VendorFile.vendor_id, Vendor),
+        ):
+            files = (
+                db.session.query(owner_id)
+                .join(owner, owner.id == owner_id)
+                .filter(owner.tenant_id == tenant.id)
+                .group_by(owner_id)
+            )
+            for scope_id, size, count in files.join(
+                FileBlob, FileBlob.id == model.blob_id
+            ).add_columns(func.coalesce(func.sum(FileBlob.size), 0), func.count(model.id)):
+                after[(scope, scope_id)] = [size, count]
+
+            # files stored before the content addressed storage, in the folder
+            # of their project or vendor
+            legacy = files.filter(model.blob_id == None)
+            if scope == "project":
+                legacy = legacy.filter(model.file_name != None)
+            for scope_id, count in legacy.add_columns(func.count(model.id)):
+                if scope == "project":
+                    size = listed_size(
+                        tenant.get_evidence_folder(project_id=scope_id, provider=provider)
+                    )
+                else:
+                    size = listed_size(
+                        tenant.get_vendor_evidence_folder(scope_id, provider=provider)
+                    )
+                    # vendor folders are outside of the tenant folder
+                    after[tenant_key][0] += size
+                usage = after.setdefault((scope, scope_id), [0, 0])
+                usage[0] += size
+                usage[1] += count
+                after[tenant_key][1] += count
+        return after
+
+    @staticmethod
+    def reconcile(tenant, provider=None):
+        """
+        Recompute the ledger of a tenant (see StorageUsage.measure). Expired
+        direct uploads are deleted first (see EvidenceUpload). Commits
+
+        Returns:
+            {scope: {scope_id: {"before": bytes, "after": bytes}}} of the rows
+            that drifted
+        """
+        EvidenceUpload.purge(tenant_id=tenant.id)
+        before = {
+            (row.scope, row.scope_id): row.bytes
+            for row in StorageUsage.query.filter(StorageUsage.tenant_id == tenant.id)
+        }
+        after = StorageUsage.measure(tenant, provider=provider)
+        drift = {}
+        for key in set(before) | set(after):
+            size, files = after.get(key, [0, 0])
+            StorageUsage.set(tenant.id, key[0], key[1], size, files)
+            if before.get(key, 0) != size:
+                drift.setdefault(key[0], {})[key[1]] = {
+                    "before": before.get(key, 0),
+                    "after": size,
+                }
+        db.session.commit()
+        return drift
+
+
 class VendorFile(db.Model, QueryMixin):
     __tablename__ = "vendor_files"
     __table_args__ = (db.UniqueConstraint("name", "vendor_id"),)
@@ -81,6 +534,8 @@ class VendorFile(db.Model, QueryMixin):
     collected_on = db.Column(db.DateTime, default=datetime.utcnow)
     vendor_id = db.Column(db.String, db.ForeignKey("vendors.id"), nullable=False)
     owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False)
+    blob_id = db.Column(db.String, db.ForeignKey("file_blobs.id"), nullable=True)
+    blob = db.relationship("FileBlob")
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
@@ -96,11 +551,28 @@ class VendorFile(db.Model, QueryMixin):
                 f"Storage method mismatch. File provider:{self.provider}. STORAGE_METHOD:{storage_method}",
             )
 
+        if self.blob:
+            return self.blob.get_file()
         file_handler = FileStorageHandler(
             provider=current_app.config["STORAGE_METHOD"],
         )
         return file_handler.get_file(path=os.path.join(self.vendor_id, self.name))
 
+    def get_file_location(self):
+        """
+        Returns:
+            (provider, path of the file in the provider, ETag)
+        """
+        if self.blob:
+            return self.blob.get_file_location()
+        storage_method = current_app.config["STORAGE_METHOD"]
+        if self.provider != storage_method:
+            abort(
+                500,
+                f"Storage method mismatch. File provider:{self.provider}. STORAGE_METHOD:{storage_method}",
+            )
+        return self.provider, os.path.join(self.vendor_id, self.name), None
+
     def save_file(self, file_object):
         storage_method = current_app.config["STORAGE_METHOD"]
         if self.provider != storage_method:
@@ -109,16 +581,23 @@ class VendorFile(db.Model, QueryMixin):
                 f"Storage method mismatch. File provider:{self.provider}. STORAGE_METHOD:{storage_method}",
             )
 
-        if storage_method == "local":
-            folder = self.vendor.create_evidence_folder()
+        previous = self.blob
+        self.blob = FileBlob.store(file_object, self.vendor.tenant_id, storage_method)
+        StorageUsage.add(*self.usage_scope(), self.blob.size, files=1)
+        if previous:
+            StorageUsage.add(*self.usage_scope(), -(previous.size or 0), files=-1)
+            FileBlob.release(previous.id)
+        return True
 
-        upload_params = {
-            "file": file_object,
-            "file_name": f"{self.id}_{self.name}",
-            "folder": self.vendor.get_evidence_folder(storage_method),
-        }
-        file_handler = FileStorageHandler(provider=storage_method)
-        return file_handler.upload_file(**upload_params)
+    def usage_scope(self, connection=None):
+        """
+        Returns:
+            (tenant_id, scope, scope_id) of the storage ledger
+        """
+        tenant_id = (connection or db.session).execute(
+            db.select([Vendor.tenant_id]).where(Vendor.id == self.vendor_id)
+        ).scalar()
+        return tenant_id, "vendor", self.vendor_id
 
     @validates("provider")
     def _validate_provider(self, key, value):
@@ -1125,16 +1604,10 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         return user.email
 
     def get_valid_frameworks(self):
-        frameworks = []
-        folder = current_app.config["FRAMEWORK_FOLDER"]
-        for file in os.listdir(folder):
-            if file.endswith(".json"):
-                name = file.split(".json")[0]
-                frameworks.append(name.lower())
-        return frameworks
+        return catalog.framework_names()
 
     def check_valid_framework(self, name):
-        if name.lower() not in self.get_valid_frameworks():
+        if not catalog.has_framework(name):
             raise ValueError("framework is not implemented")
         return True
 
@@ -1149,44 +1622,60 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         return True
 
     def create_base_controls_for_framework(self, name):
+        """
+        Link the framework of the tenant to the global catalog of base
+        controls (see Framework.get_catalog), the controls are not copied
+        """
         name = name.lower()
-        with open(
-            os.path.join(current_app.config["FRAMEWORK_FOLDER"], f"{name}.json")
-        ) as f:
-            controls = json.load(f)
-            # TODO - reformat, takes forever b/c of commit
-            Control.create({"controls": controls, "framework": name}, self.id)
-        return True
+        framework = Control.get_or_create_framework({"framework": name}, self.id)
+        return framework.init_controls()
 
-    def create_base_frameworks(self, init_controls=False):
-        folder = current_app.config["FRAMEWORK_FOLDER"]
-        if not os.path.isdir(folder):
-            abort(422, f"Folder does not exist: {folder}")
-        for file in os.listdir(folder):
-            if file.endswith(".json"):
-                name = file.split(".json")[0]
-                if not Framework.find_by_name(name, self.id):
-                    Framework.create(name, self)
-                    if init_controls:
-                        self.create_base_controls_for_framework(name)
+    def create_base_frameworks(self, init_controls=False, progress=None):
+        """
+        Args:
+            progress: optional callback, called with the name of each
+                framework once it is done (see app.utils.jobs)
+        """
+        if not (names := catalog.framework_names()):
+            abort(422, f"No frameworks in: {current_app.config['FRAMEWORK_FOLDER']}")
+        for name in names:
+            if not Framework.find_by_name(name, self.id):
+                Framework.create(name, self)
+                if init_controls:
+                    self.create_base_controls_for_framework(name)
+            if progress:
+                progress(name)
         return True
 
+    def submit_bootstrap(self, steps=None, user=None, init_controls=False):
+        """
+        Load the base frameworks and policies in a background job. A single
+        bootstrap runs per tenant, a resubmission returns the running job
+        """
+        steps = sorted(steps or ["frameworks", "policies"])
+        job = job_runner.submit(
+            "tenant_bootstrap",
+            key=f"tenant_bootstrap:{self.id}",
+            params={"steps": steps, "init_controls": init_controls},
+            tenant_id=self.id,
+            user_id=getattr(user, "id", None),
+        )
+        if not set(steps).issubset((job.params or {}).get("steps", [])):
+            abort(409, f"Another bootstrap is running for the tenant:{job.id}")
+        return job
+
     def create_base_policies(self):
-        for filename in os.listdir(current_app.config["POLICY_FOLDER"]):
-            if filename.endswith(".html"):
-                name = filename.split(".html")[0].lower()
-                if not Policy.find_by_name(name, self.id):
-                    with open(
-                        os.path.join(current_app.config["POLICY_FOLDER"], filename)
-                    ) as f:
-                        p = Policy(
-                            name=name,
-                            description=f"Content for the {name} policy",
-                            content=f.read(),
-                            template=f.read(),
-                            tenant_id=self.id,
-                        )
-                        db.session.add(p)
+        for name in catalog.policy_names():
+            if not Policy.find_by_name(name, self.id):
+                content = catalog.get_policy(name)
+                p = Policy(
+                    name=name,
+                    description=f"Content for the {name} policy",
+                    content=content,
+                    template=content,
+                    tenant_id=self.id,
+                )
+                db.session.add(p)
         db.session.commit()
         return True
 
@@ -1282,17 +1771,34 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
             *(["projects", project_id.lower()] if project_id else []),
         )
 
-    def can_save_file_in_folder(self, provider=None):
-        if not provider:
-            provider = current_app.config["STORAGE_METHOD"]
-        handler = FileStorageHandler(provider=provider)
-        current_size = handler.get_size(folder=self.get_evidence_folder())
+    def can_save_file_in_folder(self, provider=None, size=0):
+        """
+        Quota check against the storage ledger (see StorageUsage)
+        """
+        current_size = StorageUsage.get_tenant_bytes(self)
+        # space promised to direct uploads that are not finalized yet
+        current_size += EvidenceUpload.get_reserved_bytes(self.id)
 
-        if current_size < int(self.storage_cap):
+        if current_size + size <= int(self.storage_cap):
             return True
 
         return False
 
+    def submit_storage_reconcile(self, user=None, detached=False):
+        """
+        Args:
+            detached: submit from another thread, the session of the caller
+                (e.g. a quota check in the middle of an upload) is not
+                committed and nothing is returned
+        """
+        submit = job_runner.submit_detached if detached else job_runner.submit
+        return submit(
+            "storage_reconcile",
+            key=f"storage_reconcile:{self.id}",
+            tenant_id=self.id,
+            user_id=getattr(user, "id", None),
+        )
+
     def get_tenant_info(self):
         data = {
             "projects": self.projects.count(),
@@ -1380,19 +1886,20 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
             project.framework_id = framework_id
 
         self.projects.append(project)
-        for control in controls:
-            project.add_control(control, commit=False)
-
         evidence = ProjectEvidence(
             name="Evidence N/A",
             description="Evidence is not required. Used to satisfy evidence collection.",
         )
         project.evidence.append(evidence)
+        db.session.flush()
+        # controls can be given as Control objects or ids
+        project.add_controls([getattr(control, "id", control) for control in controls])
+        ProjectProgress.rebuild(project.id)
         db.session.commit()
         return project
 
 
-class ProjectEvidence(db.Model, QueryMixin):
+class ProjectEvidence(db.Model, QueryMixin, PrefetchMixin):
     __tablename__ = "project_evidence"
     __table_args__ = (db.UniqueConstraint("name", "project_id"),)
     id = db.Column(
@@ -1408,21 +1915,39 @@ class ProjectEvidence(db.Model, QueryMixin):
     collected_on = db.Column(db.DateTime, default=datetime.utcnow)
     file_name = db.Column(db.String())
     file_provider = db.Column(db.String(), default="local")
+    blob_id = db.Column(db.String, db.ForeignKey("file_blobs.id"), nullable=True)
+    blob = db.relationship("FileBlob")
     owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=True)
     project_id = db.Column(db.String, db.ForeignKey("projects.id"))
     tenant_id = db.Column(db.String, db.ForeignKey("tenants.id"))
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
-    def as_dict(self):
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["control_count"] = self.control_count()
-        data["controls"] = [
+    def as_dict(self, fields=None):
+        data = {
+            c.name: getattr(self, c.name)
+            for c in self.__table__.columns
+            if fields_util.wants(fields, c.name)
+        }
+        data.update(
+            fields_util.select(
+                fields,
+                {
+                    "control_count": self.control_count,
+                    "controls": self.get_control_names,
+                    "has_file": self.has_file,
+                },
+            )
+        )
+        return data
+
+    def get_control_names(self):
+        if self.has_prefetched("controls"):
+            return self.get_prefetched("controls")
+        return [
             {"id": control.id, "name": control.subcontrol.name}
             for control in self.get_controls()
         ]
-        data["has_file"] = self.has_file()
-        return data
 
     def has_file(self):
         if self.file_name:
@@ -1434,7 +1959,10 @@ class ProjectEvidence(db.Model, QueryMixin):
             self.delete_file()
         except:
             pass
+        control_ids = self.get_control_ids()
         db.session.delete(self)
+        db.session.flush()
+        ProjectProgress.refresh_subcontrols(control_ids)
         db.session.commit()
         return True
 
@@ -1494,11 +2022,23 @@ class ProjectEvidence(db.Model, QueryMixin):
                 EvidenceAssociation.evidence_id == self.id
             ).filter(EvidenceAssociation.control_id.in_(control_ids)).delete()
         else:
+            control_ids = self.get_control_ids()
             EvidenceAssociation.query.filter(
                 EvidenceAssociation.evidence_id == self.id
             ).delete()
+        ProjectProgress.refresh_subcontrols(control_ids)
         db.session.commit()
 
+    def get_control_ids(self):
+        return [
+            record.control_id
+            for record in EvidenceAssociation.query.with_entities(
+                EvidenceAssociation.control_id
+            )
+            .filter(EvidenceAssociation.evidence_id == self.id)
+            .all()
+        ]
+
     def associate_with_controls(self, control_ids: List[int]):
         """
         Associate evidence with a list of control_ids. This will patch the existing association.
@@ -1513,6 +2053,66 @@ class ProjectEvidence(db.Model, QueryMixin):
         self.remove_controls()
         EvidenceAssociation.add(control_ids, self.id)
 
+    def get_mapped_subcontrols(self, project_ids=None):
+        """
+        Subcontrols of the other projects of the tenant that are mapped to the
+        subcontrols of the evidence (see ControlMapping)
+        """
+        sources = db.session.query(EvidenceAssociation.control_id).filter(
+            EvidenceAssociation.evidence_id == self.id
+        )
+        return ControlMapping.mapped_subcontrols(
+            self.tenant_id,
+            sources,
+            exclude_project_ids=[self.project_id],
+            project_ids=project_ids,
+        )
+
+    def propagate(self, project_ids):
+        """
+        Associate the evidence with the mapped subcontrols of other projects
+
+        Args:
+            project_ids: projects that receive the evidence
+
+        Returns:
+            number of new associations per project
+        """
+        if not project_ids:
+            return {}
+        existing = db.session.query(EvidenceAssociation.control_id).filter(
+            EvidenceAssociation.evidence_id == self.id
+        )
+        targets = (
+            self.get_mapped_subcontrols(project_ids=project_ids)
+            .filter(~ProjectSubControl.id.in_(existing))
+            .with_entities(ProjectSubControl.id, ProjectSubControl.project_id)
+            .distinct()
+            .all()
+        )
+        counts = {}
+        for _, project_id in targets:
+            counts[project_id] = counts.get(project_id, 0) + 1
+        if not targets:
+            return counts
+        bulk.insert_rows(
+            EvidenceAssociation,
+            [
+                bulk.with_defaults(
+                    EvidenceAssociation,
+                    {"control_id": subcontrol_id, "evidence_id": self.id},
+                )
+                for subcontrol_id, _ in targets
+            ],
+        )
+        ProjectProgress.refresh_subcontrols([subcontrol_id for subcontrol_id, _ in targets])
+        # the insert bypasses the flush listener
+        Project.bump_revision(list(counts))
+        for project_id in counts:
+            summary_cache.mark(db.session(), project_id)
+        db.session.commit()
+        return counts
+
     def get_controls(self):
         id_list = [
             x.control_id
@@ -1523,6 +2123,8 @@ class ProjectEvidence(db.Model, QueryMixin):
         return ProjectSubControl.query.filter(ProjectSubControl.id.in_(id_list)).all()
 
     def control_count(self):
+        if self.has_prefetched("control_count"):
+            return self.get_prefetched("control_count")
         return EvidenceAssociation.query.filter(
             EvidenceAssociation.evidence_id == self.id
         ).count()
@@ -1530,10 +2132,31 @@ class ProjectEvidence(db.Model, QueryMixin):
     def has_control(self, control_id):
         return EvidenceAssociation.exists(control_id, self.id)
 
+    def get_file_location(self):
+        """
+        Returns:
+            (provider, path of the file in the provider, ETag)
+        """
+        if not self.file_name:
+            abort(404, "Evidence does not contain a file")
+        if self.blob:
+            return self.blob.get_file_location()
+        storage_method = current_app.config["STORAGE_METHOD"]
+        if self.file_provider != storage_method:
+            abort(500, f"File storage backend: {self.file_provider} is not enabled.")
+        path = os.path.join(
+            self.project.get_evidence_folder(provider=self.file_provider),
+            self.file_name,
+        )
+        return self.file_provider, path, None
+
     def get_file(self, as_blob=False):
         if not self.file_name:
             return {}
 
+        if self.blob:
+            return self.blob.get_file(as_blob=as_blob)
+
         storage_method = current_app.config["STORAGE_METHOD"]
         if self.file_provider != storage_method:
             abort(500, f"File storage backend: {self.file_provider} is not enabled.")
@@ -1556,13 +2179,39 @@ class ProjectEvidence(db.Model, QueryMixin):
         if not self.file_name:
             abort(500, "Evidence does not contain a file")
         self.file_name = None
+        self.release_blob()
         db.session.commit()
         return True
 
+    def release_blob(self):
+        if self.blob_id:
+            StorageUsage.add(
+                *self.usage_scope(), -FileBlob.get_size(self.blob_id), files=-1
+            )
+            FileBlob.release(self.blob_id)
+            self.blob = None
+
+    def usage_scope(self, connection=None):
+        """
+        Returns:
+            (tenant_id, scope, scope_id) of the storage ledger
+        """
+        tenant_id = self.tenant_id or (connection or db.session).execute(
+            db.select([Project.tenant_id]).where(Project.id == self.project_id)
+        ).scalar()
+        return tenant_id, "project", self.project_id
+
     def delete_file(self, safe_delete=True):
+        """
+        Delete the file of the evidence. Content addressed files are shared
+        by reference and only deleted with the last reference
+        """
         if not self.file_name:
             abort(500, "Evidence does not contain a file")
 
+        if self.blob_id:
+            return self.remove_file()
+
         if safe_delete:
             file_assoc = ProjectEvidence.query.filter(
                 ProjectEvidence.file_name == self.file_name
@@ -1605,51 +2254,352 @@ class ProjectEvidence(db.Model, QueryMixin):
 
         file_name = secure_filename(file_name).lower()
 
+        # the content is stored once per tenant, see FileBlob
+        blob = FileBlob.store(file_object, self.project.tenant_id, provider)
+        return self.attach_blob(blob, file_name, provider)
+
+    def attach_blob(self, blob, file_name, provider):
+        """
+        Use stored content as the file of the evidence, the reference to the
+        blob is added by the caller (FileBlob.store or FileBlob.acquire)
+        """
+        previous = self.blob
+        self.blob = blob
+        StorageUsage.add(*self.usage_scope(), blob.size, files=1)
+        if previous:
+            StorageUsage.add(*self.usage_scope(), -(previous.size or 0), files=-1)
+            FileBlob.release(previous.id)
         self.file_name = file_name
         self.file_provider = provider
+        return True
 
-        if not self.project.tenant.can_save_file_in_folder(provider=provider):
-            abort(400, "Tenant has exceeded storage limits")
 
-        file_handler = FileStorageHandler(
+class EvidenceUpload(db.Model):
+    """
+    Upload of an evidence file straight to the storage provider. The file is
+    sent to a staging path (a presigned S3 PUT, a GCS resumable session or
+    the chunked endpoint for local storage), finalize() checks its size and
+    SHA-256 and moves it to the content addressed storage (see FileBlob).
+    The size is reserved in the quota of the tenant until the upload is
+    finalized or expires
+    """
+
+    __tablename__ = "evidence_uploads"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    name = db.Column(db.String(), nullable=False)
+    description = db.Column(db.String())
+    file_name = db.Column(db.String(), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    provider = db.Column(db.String(), nullable=False)
+    path = db.Column(db.String(), nullable=False)
+    # bytes received by the chunked endpoint (local storage)
+    received = db.Column(db.BigInteger, default=0, nullable=False)
+    # the content is already stored and readable by the user, nothing is sent
+    deduplicated = db.Column(db.Boolean, default=False, nullable=False)
+    # pending, complete or cancelled
+    status = db.Column(db.String(), default="pending", nullable=False)
+    date_expires = db.Column(db.DateTime, nullable=False)
+    evidence_id = db.Column(
+        db.String, db.ForeignKey("project_evidence.id", ondelete="SET NULL")
+    )
+    owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=True)
+    project_id = db.Column(
+        db.String, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False
+    )
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    def as_dict(self):
+        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data.pop("path")
+        return data
+
+    @staticmethod
+    def get_reserved_bytes(tenant_id):
+        return (
+            db.session.query(func.coalesce(func.sum(EvidenceUpload.size), 0))
+            .filter(EvidenceUpload.tenant_id == tenant_id)
+            .filter(EvidenceUpload.status == "pending")
+            .filter(EvidenceUpload.deduplicated == False)
+            .filter(EvidenceUpload.date_expires > datetime.utcnow())
+            .scalar()
+        )
+
+    @staticmethod
+    def get_readable_blob(user, tenant_id, provider, sha256):
+        """
+        Stored content with the SHA-256 that the user can already read
+        through an evidence item. A hash alone (it is the ETag of downloads)
+        does not give access to the content
+
+        Returns:
+            blob, None if there is none
+        """
+        blob = FileBlob.query.filter(
+            FileBlob.tenant_id == tenant_id,
+            FileBlob.provider == provider,
+            FileBlob.sha256 == sha256,
+            FileBlob.ref_count > 0,
+        ).first()
+        if not blob:
+            return None
+        authorizer = Authorizer(user, bubble_errors=True)
+        for evidence in ProjectEvidence.query.filter(ProjectEvidence.blob_id == blob.id):
+            if authorizer.can_user_read_evidence(evidence)["ok"]:
+                return blob
+        return None
+
+    @staticmethod
+    def create(
+        project,
+        user,
+        file_name,
+        size,
+        sha256,
+        name=None,
+        description=None,
+        evidence_id=None,
+    ):
+        """
+        Returns:
+            upload, instructions to send the file (see get_instructions)
+        """
+        provider = current_app.config["STORAGE_METHOD"]
+        file_name = secure_filename(file_name or "").lower()
+        if not file_name:
+            abort(422, "file_name is required")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            abort(422, "size must be an integer")
+        if size <= 0:
+            abort(422, "size must be greater than 0")
+        sha256 = str(sha256 or "").lower()
+        if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+            abort(422, "sha256 must be the hex digest of the file")
+        if evidence_id:
+            if not project.evidence.filter(ProjectEvidence.id == evidence_id).first():
+                abort(404, "Evidence not found")
+        else:
+            name = name or file_name
+            if project.evidence.filter(ProjectEvidence.name == name).first():
+                abort(422, f"Evidence already exists with name:{name}")
+
+        upload = EvidenceUpload(
+            id=str(shortuuid.ShortUUID().random(length=16)).lower(),
+            name=name or file_name,
+            description=description,
+            file_name=file_name,
+            size=size,
+            sha256=sha256,
             provider=provider,
+            evidence_id=evidence_id,
+            owner_id=user.id,
+            project_id=project.id,
+            tenant_id=project.tenant_id,
+            date_expires=datetime.utcnow()
+            + timedelta(seconds=int(current_app.config["UPLOAD_EXPIRATION"])),
+        )
+        upload.path = os.path.join(
+            "tenants", project.tenant_id.lower(), "uploads", upload.id
         )
-        # TODO - create does_file_exist method in FileStorageHandler class
+        # content the user can already read is not sent again
+        upload.deduplicated = bool(
+            EvidenceUpload.get_readable_blob(user, project.tenant_id, provider, sha256)
+        )
+        if not upload.deduplicated and not project.tenant.can_save_file_in_folder(
+            size=size
+        ):
+            abort(400, "Tenant has exceeded storage limits")
+        db.session.add(upload)
+        db.session.commit()
+        return upload, upload.get_instructions()
+
+    def get_location(self):
+        return FileBlob.location(self.provider, self.path)
+
+    def get_instructions(self):
+        """
+        Returns:
+            {"method": "none"} when the content is already stored, else the
+            request(s) that send the file:
+
+                s3      a single PUT of the file to "url"
+                gcs     PUTs to the resumable session "url"
+                local   PUTs of consecutive parts to "url", each with a
+                        Content-Range header (bytes start-end/size)
+        """
+        if self.deduplicated:
+            return {"method": "none"}
+        expiration = int(current_app.config["UPLOAD_EXPIRATION"])
+        file_handler = FileStorageHandler(provider=self.provider)
+        if self.provider == "s3":
+            url = file_handler.s3_client.generate_presigned_url(
+                "put_object",
+                Params={
+                    "Bucket": file_handler.s3_bucket_name,
+                    "Key": self.path,
+                    "ContentLength": self.size,
+                    "ChecksumSHA256": base64.b64encode(bytes.fromhex(self.sha256)).decode(),
+                },
+                ExpiresIn=expiration,
+            )
+            return {"method": "PUT", "url": url}
+        if self.provider == "gcs":
+            blob = file_handler.gcs_client.bucket(file_handler.gcs_bucket_name).blob(
+                self.path
+            )
+            url = blob.create_resumable_upload_session(
+                size=self.size, origin=request.headers.get("Origin")
+            )
+            return {"method": "PUT", "url": url, "resumable": True}
+        return {
+            "method": "PUT",
+            "url": url_for(
+                "api.upload_evidence_chunk", pid=self.project_id, uid=self.id
+            ),
+            "chunk_size": int(current_app.config["UPLOAD_CHUNK_SIZE"]),
+        }
+
+    def check_pending(self):
+        if self.status != "pending":
+            abort(409, f"Upload is {self.status}")
+        if self.date_expires < datetime.utcnow():
+            abort(410, "Upload expired")
+
+    def write_chunk(self, stream, start, end, total):
+        """
+        Append a part of the file to the staging file (local storage only),
+        parts are written in order
+
+        Returns:
+            number of bytes received
+        """
+        self.check_pending()
+        if self.provider != "local" or self.deduplicated:
+            abort(400, "Upload the file to the storage provider")
+        if total != self.size or end >= self.size or end < start:
+            abort(416, f"Range must be within bytes 0-{self.size - 1}/{self.size}")
+        if start != self.received:
+            abort(409, f"Expected the part starting at byte {self.received}")
+        location = self.get_location()
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        length = end - start + 1
+        written = 0
+        with open(location, "r+b" if start else "wb") as f:
+            f.seek(start)
+            while written < length:
+                chunk = stream.read(min(blobs.CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+            # an interrupted part is sent again from the same offset
+            f.truncate(start + written)
+        if written != length:
+            abort(400, f"Received {written} of {length} bytes")
+        self.received = start + written
+        db.session.commit()
+        return self.received
+
+    def delete_staged_file(self):
+        file_handler = FileStorageHandler(provider=self.provider)
         try:
-            does_file_exist = file_handler.get_file(
-                path=os.path.join(
-                    self.project.get_evidence_folder(provider=self.file_provider),
-                    file_name,
-                )
+            file_handler.delete_file(path=self.get_location())
+        except Exception as e:
+            logging.debug(f"Staged file of upload:{self.id} not deleted. Error:{e}")
+
+    def finalize(self, user):
+        """
+        Check the uploaded file and attach it to the evidence. Stored content
+        is only reused without the file when the user can read it
+
+        Returns:
+            evidence
+        """
+        self.check_pending()
+        file_handler = FileStorageHandler(provider=self.provider)
+        location = self.get_location()
+        if self.deduplicated:
+            if not EvidenceUpload.get_readable_blob(
+                user, self.tenant_id, self.provider, self.sha256
+            ):
+                abort(409, "The stored file is gone, create a new upload")
+        else:
+            try:
+                size = file_handler.get_file_size(location)
+            except FileDoesNotExist:
+                abort(400, "The file was not uploaded")
+            if size != self.size:
+                abort(400, f"Uploaded {size} bytes, expected {self.size}")
+            if file_handler.get_file_sha256(location) != self.sha256:
+                self.delete_staged_file()
+                abort(400, "SHA-256 of the uploaded file does not match")
+
+        # the content was proven above, it may have been stored meanwhile
+        blob = FileBlob.acquire(self.tenant_id, self.provider, self.sha256)
+        if not blob and self.deduplicated:
+            abort(409, "The stored file is gone, create a new upload")
+
+        if self.evidence_id:
+            if not (evidence := ProjectEvidence.query.get(self.evidence_id)):
+                abort(404, "Evidence not found")
+        else:
+            evidence = Project.query.get(self.project_id).create_evidence(
+                self.name, self.owner_id, description=self.description
             )
-        except FileDoesNotExist:
-            does_file_exist = False
 
-        if does_file_exist:
-            abort(
-                422,
-                f"File already exists with the name:{file_name} in {provider} storage.",
+        if blob:
+            self.delete_staged_file()
+        else:
+            blob = FileBlob.insert(
+                self.tenant_id,
+                self.provider,
+                self.sha256,
+                self.size,
+                lambda destination: file_handler.move_file(location, destination),
             )
+        evidence.attach_blob(blob, self.file_name, self.provider)
+        self.evidence_id = evidence.id
+        self.status = "complete"
+        db.session.commit()
+        return evidence
 
-        if provider == "local":
-            # TODO - push logic to FileStorageHandler
-            self.project.create_evidence_folder()
-
-        upload_params = {
-            "file": file_object,
-            "file_name": file_name,
-            "folder": self.project.tenant.get_evidence_folder(
-                project_id=self.project_id, provider=provider
-            ),
-        }
-        # TODO - fix the response, upload_file does not return false
-        result = file_handler.upload_file(**upload_params)
-        if result is False:
-            self.file_name = None
-            self.file_provider = None
-            db.session.commit()
-            abort(500, f"Unable to upload {file_name} to {provider}")
-        return True
+    @staticmethod
+    def purge(tenant_id=None):
+        """
+        Delete the uploads that were not finalized in time and their files
+
+        Returns:
+            number of deleted uploads
+        """
+        query = EvidenceUpload.query.filter(
+            or_(
+                EvidenceUpload.status == "cancelled",
+                and_(
+                    EvidenceUpload.status == "pending",
+                    EvidenceUpload.date_expires < datetime.utcnow(),
+                ),
+            )
+        )
+        if tenant_id:
+            query = query.filter(EvidenceUpload.tenant_id == tenant_id)
+        count = 0
+        for upload in query.all():
+            upload.delete_staged_file()
+            db.session.delete(upload)
+            count += 1
+        db.session.commit()
+        return count
 
 
 class EvidenceAssociation(db.Model):
@@ -1690,6 +2640,7 @@ class EvidenceAssociation(db.Model):
                     control_id=control_id, evidence_id=evidence_id
                 )
                 db.session.add(evidence)
+        ProjectProgress.refresh_subcontrols(control_ids)
         if commit:
             db.session.commit()
         return True
@@ -1703,6 +2654,7 @@ class EvidenceAssociation(db.Model):
             assoc = EvidenceAssociation.exists(control_id, evidence_id)
             if assoc:
                 db.session.delete(assoc)
+        ProjectProgress.refresh_subcontrols(control_ids)
         if commit:
             db.session.commit()
         return True
@@ -1741,15 +2693,46 @@ class Framework(db.Model):
 
     controls = db.relationship("Control", backref="framework", lazy="dynamic")
     projects = db.relationship("Project", backref="framework", lazy="dynamic")
+    """
+    catalog framework (tenant_id is null) holding the base controls shared by
+    every tenant, the tenant framework only stores its own controls
+    """
+    base_id = db.Column(db.String, db.ForeignKey("frameworks.id"), nullable=True)
     tenant_id = db.Column(db.String, db.ForeignKey("tenants.id"), nullable=True)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
     def as_dict(self):
         data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["controls"] = self.controls.count()
+        data["controls"] = self.query_controls().count()
         return data
 
+    @staticmethod
+    def load_catalog(name):
+        """
+        Load the base controls of a framework (see app.utils.catalog) into the
+        global catalog, once for every tenant
+
+        Returns:
+            import report, None if the catalog was already loaded
+        """
+        name = name.lower()
+        if (framework := Framework.find_by_name(name, None)) and framework.has_controls():
+            return None
+        if (controls := catalog.get_controls(name)) is None:
+            abort(422, f"Framework is not implemented:{name}")
+        return Control.bulk_create({"controls": controls, "framework": name}, None)
+
+    def is_catalog(self):
+        return self.tenant_id is None
+
+    @staticmethod
+    def get_catalog(name):
+        if not (framework := Framework.find_by_name(name, None)):
+            Framework.load_catalog(name)
+            framework = Framework.find_by_name(name, None)
+        return framework
+
     @staticmethod
     def create(name, tenant):
         data = {
@@ -1797,13 +2780,44 @@ class Framework(db.Model):
             return False
         return getattr(self, name)
 
+    def query_controls(self):
+        """
+        Controls of the framework, resolved tenant -> catalog: the controls
+        of the tenant (custom controls and edited copies) and the catalog
+        controls that the tenant did not override
+        """
+        own = Control.framework_id == self.id
+        if not self.base_id:
+            return Control.query.filter(own)
+        overridden = db.session.query(Control.abs_ref_code).filter(
+            own, Control.abs_ref_code != None
+        )
+        return Control.query.filter(
+            or_(
+                own,
+                and_(
+                    Control.framework_id == self.base_id,
+                    ~Control.abs_ref_code.in_(overridden),
+                ),
+            )
+        )
+
     def has_controls(self):
-        if self.controls.count():
+        if self.query_controls().first():
             return True
         return False
 
     def init_controls(self):
-        self.tenant.create_base_controls_for_framework(self.name)
+        """
+        Link the framework to the catalog of its base controls
+
+        Returns:
+            import report when the catalog had to be loaded, None otherwise
+        """
+        report = Framework.load_catalog(self.name)
+        self.base_id = Framework.find_by_name(self.name, None).id
+        db.session.commit()
+        return report
 
 
 class Policy(db.Model):
@@ -1906,6 +2920,8 @@ class Control(db.Model):
     dti = db.Column(db.String(), default="easy")
     dtc = db.Column(db.String(), default="easy")
     meta = db.Column(db.JSON(), default="{}")
+    # fingerprint of the content, see Control.fingerprint
+    content_hash = db.Column(db.String())
     subcontrols = db.relationship(
         "SubControl", backref="control", lazy="dynamic", cascade="all, delete"
     )
@@ -1932,13 +2948,69 @@ class Control(db.Model):
         return data
 
     @staticmethod
-    def find_by_abs_ref_code(framework, ref_code):
+    def find_by_abs_ref_code(framework, ref_code, tenant_id=None):
+        """
+        The control of the tenant (custom or edited copy) when there is one,
+        the control of the global catalog otherwise
+        """
         if not framework or not ref_code:
             raise ValueError("framework and ref_code is required")
         abs_ref_code = f"{framework.lower()}__{ref_code}"
-        return Control.query.filter(
+        query = Control.query.filter(
             func.lower(Control.abs_ref_code) == func.lower(abs_ref_code)
-        ).first()
+        )
+        if tenant_id:
+            if control := query.filter(Control.tenant_id == tenant_id).first():
+                return control
+        return query.filter(Control.tenant_id == None).first() or (
+            None if tenant_id else query.first()
+        )
+
+    def is_catalog(self):
+        return self.tenant_id is None
+
+    def get_or_create_override(self, tenant):
+        """
+        Copy on write: the catalog controls are read-only, the first edit of
+        a tenant copies the control and its subcontrols into the framework of
+        the tenant, where the copy shadows the catalog control
+
+        Returns:
+            the control to edit for the tenant
+        """
+        if not self.is_catalog():
+            return self
+        if not (framework := Framework.find_by_name(self.framework.name, tenant.id)):
+            abort(404, f"Framework:{self.framework.name} not found for the tenant")
+        if override := Control.query.filter(
+            Control.framework_id == framework.id,
+            Control.abs_ref_code == self.abs_ref_code,
+        ).first():
+            return override
+        skip = ("id", "framework_id", "tenant_id", "date_added", "date_updated")
+        override = Control(
+            framework_id=framework.id,
+            tenant_id=tenant.id,
+            **{
+                c.key: getattr(self, c.key)
+                for c in self.__table__.columns
+                if c.key not in skip
+            },
+        )
+        skip = ("id", "control_id", "date_added", "date_updated")
+        for sub in self.subcontrols.all():
+            override.subcontrols.append(
+                SubControl(
+                    **{
+                        c.key: getattr(sub, c.key)
+                        for c in sub.__table__.columns
+                        if c.key not in skip
+                    }
+                )
+            )
+        db.session.add(override)
+        db.session.flush()
+        return override
 
     def policies(self, as_id_list=False):
         policy_id_list = []
@@ -1953,6 +3025,141 @@ class Control(db.Model):
     def in_policy(self, policy_id):
         return policy_id in self.policies(as_id_list=True)
 
+    @staticmethod
+    def get_or_create_framework(data, tenant_id):
+        if not (framework := data.get("framework")):
+            abort(400, "Framework is required")
+        if not (f := Framework.find_by_name(framework, tenant_id)):
+            f = Framework(
+                name=framework,
+                description=data.get(
+                    "framework_description", f"Framework for {framework}"
+                ),
+                tenant_id=tenant_id,
+            )
+            db.session.add(f)
+            db.session.commit()
+        return f
+
+    @staticmethod
+    def control_values(control, framework, tenant_id):
+        """
+        column values of a control of the import format (see Control.create)
+        """
+        return {
+            "name": control.get("name"),
+            "description": control.get("description"),
+            "ref_code": control.get("ref_code"),
+            "abs_ref_code": f"{framework.lower()}__{control.get('ref_code')}",
+            "system_level": control.get("system_level"),
+            "category": control.get("category"),
+            "subcategory": control.get("subcategory"),
+            "references": control.get("references"),
+            "level": int(control.get("level", 1)),
+            "guidance": control.get("guidance"),
+            "mapping": control.get("mapping"),
+            "vendor_recommendations": control.get("vendor_recommendations"),
+            "dti": control.get("dti"),
+            "dtc": control.get("dtc"),
+            "meta": control.get("meta", {}),
+            "tenant_id": tenant_id,
+        }
+
+    """
+    columns compared by Control.fingerprint
+    """
+    CONTENT_COLUMNS = [
+        "name",
+        "description",
+        "ref_code",
+        "system_level",
+        "category",
+        "subcategory",
+        "references",
+        "level",
+        "guidance",
+        "mapping",
+        "vendor_recommendations",
+        "dti",
+        "dtc",
+        "meta",
+    ]
+    SUBCONTROL_CONTENT_COLUMNS = [
+        "name",
+        "description",
+        "ref_code",
+        "mitigation",
+        "guidance",
+        "implementation_group",
+        "meta",
+        "tasks",
+    ]
+
+    @staticmethod
+    def fingerprint(row, subcontrol_rows):
+        """
+        SHA-256 of the content of a control and its subcontrols. Accepts
+        stored rows and rows of the import format completed with the column
+        defaults (see bulk.with_defaults), so a control of a framework file
+        and the stored control have the same fingerprint when they match.
+        The order of the subcontrols is ignored
+        """
+        subcontrols = sorted(
+            json.dumps(
+                {key: sub.get(key) for key in Control.SUBCONTROL_CONTENT_COLUMNS},
+                sort_keys=True,
+                default=str,
+            )
+            for sub in subcontrol_rows
+        )
+        content = json.dumps(
+            {
+                "control": {key: row.get(key) for key in Control.CONTENT_COLUMNS},
+                "subcontrols": subcontrols,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    def subcontrol_values(control):
+        """
+        column values of the subcontrols of a control of the import format
+
+        if there are no subcontrols for the control, we are going to add the
+        top-level control itself as the first subcontrol
+        """
+        subcontrols = control.get("subcontrols", [])
+        if not subcontrols:
+            subcontrols = [
+                {
+                    "name": control.get("name"),
+                    "description": control.get("description"),
+                    "ref_code": control.get("ref_code"),
+                    "mitigation": control.get(
+                        "mitigation", "The mitigation has not been documented"
+                    ),
+                    "guidance": control.get("guidance"),
+                    "tasks": control.get("tasks"),
+                }
+            ]
+        return [
+            {
+                "name": sub.get("name"),
+                "description": sub.get(
+                    "description", "The description has not been documented"
+                ),
+                "ref_code": sub.get("ref_code", control.get("ref_code")),
+                "mitigation": sub.get("mitigation"),
+                "guidance": sub.get("guidance"),
+                "implementation_group": sub.get("implementation_group"),
+                "meta": sub.get("meta", {}),
+                "tasks": sub.get("tasks", []),
+            }
+            for sub in subcontrols
+        ]
+
     @staticmethod
     def create(data, tenant_id):
         """
@@ -1968,77 +3175,70 @@ class Control(db.Model):
         }
         """
         created_controls = []
-        if framework := data.get("framework"):
-            if not (f := Framework.find_by_name(framework, tenant_id)):
-                f = Framework(
-                    name=framework,
-                    description=data.get(
-                        "framework_description", f"Framework for {framework}"
-                    ),
-                    tenant_id=tenant_id,
-                )
-                db.session.add(f)
-                db.session.commit()
-        else:
-            abort(400, "Framework is required")
+        f = Control.get_or_create_framework(data, tenant_id)
 
         # create controls and subcontrols
         for control in data.get("controls", []):
-            c = Control(
-                name=control.get("name"),
-                description=control.get("description"),
-                ref_code=control.get("ref_code"),
-                abs_ref_code=f"{framework.lower()}__{control.get('ref_code')}",
-                system_level=control.get("system_level"),
-                category=control.get("category"),
-                subcategory=control.get("subcategory"),
-                references=control.get("references"),
-                level=int(control.get("level", 1)),
-                guidance=control.get("guidance"),
-                mapping=control.get("mapping"),
-                vendor_recommendations=control.get("vendor_recommendations"),
-                dti=control.get("dti"),
-                dtc=control.get("dtc"),
-                meta=control.get("meta", {}),
-                tenant_id=tenant_id,
-            )
-            """
-            if there are no subcontrols for the control, we are going to add the
-            top-level control itself as the first subcontrol
-            """
-            subcontrols = control.get("subcontrols", [])
-            if not subcontrols:
-                subcontrols = [
-                    {
-                        "name": c.name,
-                        "description": c.description,
-                        "ref_code": c.ref_code,
-                        "mitigation": control.get(
-                            "mitigation", "The mitigation has not been documented"
-                        ),
-                        "guidance": control.get("guidance"),
-                        "tasks": control.get("tasks"),
-                    }
-                ]
-            for sub in subcontrols:
-                fa = SubControl(
-                    name=sub.get("name"),
-                    description=sub.get(
-                        "description", "The description has not been documented"
-                    ),
-                    ref_code=sub.get("ref_code", c.ref_code),
-                    mitigation=sub.get("mitigation"),
-                    guidance=sub.get("guidance"),
-                    implementation_group=sub.get("implementation_group"),
-                    meta=sub.get("meta", {}),
-                    tasks=sub.get("tasks", []),
-                )
-                c.subcontrols.append(fa)
+            c = Control(**Control.control_values(control, f.name, tenant_id))
+            for sub in Control.subcontrol_values(control):
+                c.subcontrols.append(SubControl(**sub))
             f.controls.append(c)
             created_controls.append(c)
+        ControlMapping.add_from_controls(data.get("controls", []), f.name, tenant_id)
         db.session.commit()
         return created_controls
 
+    @staticmethod
+    def bulk_create(data, tenant_id, batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Same input and result in the database as Control.create, for large
+        frameworks. Ids are generated up front and the controls and
+        subcontrols are inserted in batches of multi-row INSERTs instead of
+        one ORM object per row
+
+        Returns:
+            import report with the number of rows and rows per second
+        """
+        f = Control.get_or_create_framework(data, tenant_id)
+        timer = bulk.ImportTimer(f.name)
+        controls, subcontrols = Control.insert_batch(
+            data.get("controls", []), f, tenant_id, batch_size=batch_size
+        )
+        timer.add(controls + subcontrols)
+        db.session.commit()
+        return timer.report(controls=controls, subcontrols=subcontrols)
+
+    @staticmethod
+    def insert_batch(controls, framework, tenant_id, batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Insert controls of the import format with their subcontrols, does
+        not commit
+
+        Returns:
+            (number of controls, number of subcontrols)
+        """
+        control_rows = []
+        subcontrol_rows = []
+        for control in controls:
+            row = bulk.with_defaults(
+                Control,
+                {
+                    **Control.control_values(control, framework.name, tenant_id),
+                    "framework_id": framework.id,
+                },
+            )
+            control_rows.append(row)
+            subcontrols = [
+                bulk.with_defaults(SubControl, {**sub, "control_id": row["id"]})
+                for sub in Control.subcontrol_values(control)
+            ]
+            row["content_hash"] = Control.fingerprint(row, subcontrols)
+            subcontrol_rows.extend(subcontrols)
+        bulk.insert_rows(Control, control_rows, batch_size=batch_size)
+        bulk.insert_rows(SubControl, subcontrol_rows, batch_size=batch_size)
+        ControlMapping.add_from_controls(controls, framework.name, tenant_id)
+        return len(control_rows), len(subcontrol_rows)
+
 
 
 class SubControl(db.Model):
@@ -2075,6 +3275,203 @@ class SubControl(db.Model):
         return data
 
 
+class ControlMapping(db.Model):
+    """
+    Edge between controls of different frameworks, built from Control.mapping
+    (see app.utils.mappings for the keys). Edges of the catalog have no
+    tenant, edges of custom controls belong to their tenant. Looked up in
+    both directions
+    """
+
+    __tablename__ = "control_mappings"
+    __table_args__ = (
+        db.UniqueConstraint("source_key", "target_key", "tenant_id"),
+        db.Index("ix_control_mappings_target_key", "target_key", "source_key"),
+    )
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    source_key = db.Column(db.String(), nullable=False)
+    target_key = db.Column(db.String(), nullable=False)
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=True
+    )
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def add_edges(edges, tenant_id=None, batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Insert the (source_key, target_key) edges that do not exist yet, does
+        not commit
+
+        Returns:
+            number of new edges
+        """
+        edges = set(edges)
+        if not edges:
+            return 0
+        sources = list({source for source, _ in edges})
+        for start in range(0, len(sources), batch_size):
+            existing = db.session.query(
+                ControlMapping.source_key, ControlMapping.target_key
+            ).filter(
+                ControlMapping.source_key.in_(sources[start : start + batch_size]),
+                ControlMapping.tenant_id == tenant_id,
+            )
+            edges.difference_update(existing)
+        rows = [
+            bulk.with_defaults(
+                ControlMapping,
+                {"source_key": source, "target_key": target, "tenant_id": tenant_id},
+            )
+            for source, target in sorted(edges)
+        ]
+        return bulk.insert_rows(ControlMapping, rows, batch_size=batch_size)
+
+    @staticmethod
+    def add_from_controls(controls, framework, tenant_id=None):
+        """
+        Edges of controls of the import format (see Control.create)
+        """
+        edges = set()
+        for control in controls:
+            if isinstance(control, dict) and control.get("mapping"):
+                source_key = mappings.control_key(framework, control.get("ref_code"))
+                edges.update(mappings.mapping_edges(source_key, control["mapping"]))
+        return ControlMapping.add_edges(edges, tenant_id)
+
+    @staticmethod
+    def rebuild(batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Rebuild the edges from the mapping of every control
+
+        Returns:
+            number of edges
+        """
+        ControlMapping.query.delete(synchronize_session=False)
+        edges = {}
+        query = (
+            db.session.query(Control.abs_ref_code, Control.mapping, Control.tenant_id)
+            .filter(Control.abs_ref_code != None)
+            .yield_per(batch_size)
+        )
+        for abs_ref_code, mapping, tenant_id in query:
+            edges.setdefault(tenant_id, set()).update(
+                mappings.mapping_edges(abs_ref_code.lower(), mapping)
+            )
+        count = 0
+        for tenant_id, tenant_edges in edges.items():
+            count += ControlMapping.add_edges(tenant_edges, tenant_id, batch_size)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def keys_of_subcontrols(subcontrol_ids):
+        """
+        Keys of project subcontrols (of their control and of the subcontrol
+        itself), subcontrol_ids is a list or a subquery of ids
+        """
+        query = (
+            db.session.query(ProjectSubControl.id)
+            .join(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .join(Control, Control.id == SubControl.control_id)
+            .join(Framework, Framework.id == Control.framework_id)
+            .filter(ProjectSubControl.id.in_(subcontrol_ids))
+        )
+        return query.with_entities(
+            func.lower(Control.abs_ref_code).label("key")
+        ).union(
+            query.with_entities(
+                func.lower(
+                    Framework.name.concat("__").concat(SubControl.ref_code)
+                ).label("key")
+            )
+        )
+
+    @staticmethod
+    def mapped_subcontrols(
+        tenant_id, subcontrol_ids, exclude_project_ids=None, project_ids=None
+    ):
+        """
+        Project subcontrols of the tenant mapped to the given project
+        subcontrols, in a single query
+
+        Args:
+            tenant_id: the lookup is limited to the projects of the tenant
+            subcontrol_ids: list or subquery of ProjectSubControl ids
+            exclude_project_ids: projects to leave out (e.g. the source project)
+            project_ids: only look in these projects
+
+        Returns:
+            query of (ProjectSubControl, project name, framework name, control
+            ref_code, subcontrol ref_code, subcontrol name)
+        """
+        keys = ControlMapping.keys_of_subcontrols(subcontrol_ids).subquery()
+        edges_of_tenant = or_(
+            ControlMapping.tenant_id == None, ControlMapping.tenant_id == tenant_id
+        )
+        neighbors = (
+            db.session.query(ControlMapping.target_key.label("key"))
+            .filter(ControlMapping.source_key.in_(db.select([keys.c.key])))
+            .filter(edges_of_tenant)
+            .union(
+                db.session.query(ControlMapping.source_key.label("key"))
+                .filter(ControlMapping.target_key.in_(db.select([keys.c.key])))
+                .filter(edges_of_tenant)
+            )
+            .subquery()
+        )
+        neighbor_keys = db.select([neighbors.c.key])
+        query = (
+            db.session.query(
+                ProjectSubControl,
+                Project.name,
+                Framework.name,
+                Control.ref_code,
+                SubControl.ref_code,
+                SubControl.name,
+            )
+            .join(Project, Project.id == ProjectSubControl.project_id)
+            .join(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .join(Control, Control.id == SubControl.control_id)
+            .join(Framework, Framework.id == Control.framework_id)
+            .filter(Project.tenant_id == tenant_id)
+            .filter(
+                or_(
+                    func.lower(Control.abs_ref_code).in_(neighbor_keys),
+                    func.lower(
+                        Framework.name.concat("__").concat(SubControl.ref_code)
+                    ).in_(neighbor_keys),
+                )
+            )
+        )
+        if exclude_project_ids:
+            query = query.filter(~ProjectSubControl.project_id.in_(exclude_project_ids))
+        if project_ids is not None:
+            query = query.filter(ProjectSubControl.project_id.in_(project_ids))
+        return query
+
+    @staticmethod
+    def results(query):
+        return [
+            {
+                "id": subcontrol.id,
+                "project_id": subcontrol.project_id,
+                "project": project,
+                "framework": framework,
+                "control_ref_code": control_ref_code,
+                "ref_code": ref_code,
+                "name": name,
+                "implemented": subcontrol.implemented,
+                "is_applicable": subcontrol.is_applicable,
+            }
+            for subcontrol, project, framework, control_ref_code, ref_code, name in query
+        ]
+
+
 class ProjectMember(db.Model):
     __tablename__ = "project_members"
     id = db.Column(
@@ -2109,6 +3506,364 @@ class CompletionHistory(db.Model):
     project_id = db.Column(db.String, db.ForeignKey("projects.id"), nullable=False)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @staticmethod
+    def snapshot(project_ids=None, force=False):
+        """
+        Record the completion of projects from their progress rollups
+
+        Args:
+            project_ids: defaults to all projects
+            force: ignore the once a day limit (Project.ready_for_completion_update)
+
+        Returns:
+            number of snapshots taken
+        """
+        now = datetime.utcnow()
+        query = db.session.query(Project.id)
+        if project_ids is not None:
+            if not project_ids:
+                return 0
+            query = query.filter(Project.id.in_(project_ids))
+        if not force:
+            query = query.filter(
+                db.or_(
+                    Project.last_completion_update == None,
+                    Project.last_completion_update
+                    <= arrow.get(now).shift(days=-1).naive,
+                )
+            )
+        project_ids = [project_id for project_id, in query.all()]
+        if not project_ids:
+            return 0
+
+        rollups = ProjectProgress.for_projects(project_ids)
+        db.session.bulk_insert_mappings(
+            CompletionHistory,
+            [
+                {
+                    "project_id": project_id,
+                    "value": rollups[project_id].summary()["completion_progress"],
+                    "date_added": now,
+                }
+                for project_id in project_ids
+            ],
+        )
+        db.session.execute(
+            Project.__table__.update()
+            .where(Project.id.in_(project_ids))
+            .values(last_completion_update=now)
+        )
+        db.session.commit()
+        summary_cache.invalidate(project_ids)
+        return len(project_ids)
+
+
+class ProjectProgress(db.Model):
+    """
+    Rollup of the progress counters of a project. There is one row for every
+    project control and one row for the project itself (project_control_id
+    is NULL) that holds the sum of the control rows.
+
+    The rows are kept up to date by ProjectProgress.refresh whenever
+    subcontrols, evidence associations or controls of a project change
+    """
+
+    __tablename__ = "project_progress"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    project_id = db.Column(
+        db.String,
+        db.ForeignKey("projects.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    project_control_id = db.Column(
+        db.String,
+        db.ForeignKey("project_controls.id", ondelete="CASCADE"),
+        index=True,
+    )
+    subcontrols = db.Column(db.Integer(), default=0)
+    applicable = db.Column(db.Integer(), default=0)
+    implemented = db.Column(db.Integer(), default=0)
+    with_evidence = db.Column(db.Integer(), default=0)
+    complete = db.Column(db.Integer(), default=0)
+    completion = db.Column(db.Float(), default=0)
+    controls = db.Column(db.Integer(), default=0)
+    applicable_controls = db.Column(db.Integer(), default=0)
+    progress_completed = db.Column(db.Float(), default=0)
+    progress_evidence = db.Column(db.Float(), default=0)
+    progress_implemented = db.Column(db.Float(), default=0)
+    review_summary = db.Column(db.JSON(), default={})
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    COUNTERS = list(progress.empty_totals().keys())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def totals(self):
+        return {key: getattr(self, key) or 0 for key in self.COUNTERS}
+
+    def summary(self, default=100):
+        data = progress.summarize_totals(self.totals(), default=default)
+        data["review_summary"] = self.review_summary or {"total": 0}
+        return data
+
+    @staticmethod
+    def for_project(project_id, create=True):
+        rollup = ProjectProgress.query.filter(
+            ProjectProgress.project_id == project_id,
+            ProjectProgress.project_control_id == None,
+        ).first()
+        if not rollup and create:
+            rollup = ProjectProgress.rebuild(project_id, commit=True)
+        return rollup
+
+    @staticmethod
+    def for_projects(project_ids):
+        """
+        project rollups keyed by project id, missing rollups are rebuilt
+        """
+        if not project_ids:
+            return {}
+        data = {
+            rollup.project_id: rollup
+            for rollup in ProjectProgress.query.filter(
+                ProjectProgress.project_id.in_(project_ids),
+                ProjectProgress.project_control_id == None,
+            ).all()
+        }
+        for project_id in project_ids:
+            if project_id not in data:
+                data[project_id] = ProjectProgress.rebuild(project_id, commit=True)
+        return data
+
+    @staticmethod
+    def _review_summary(project_id, project_control_ids=None):
+        """
+        review status histogram in the format of Project.review_summary
+        """
+        data = {"total": 0}
+        query = db.session.query(
+            ProjectControl.review_status, func.count(ProjectControl.id)
+        ).filter(ProjectControl.project_id == project_id)
+        if project_control_ids is not None:
+            query = query.filter(ProjectControl.id.in_(project_control_ids))
+        for status, count in query.group_by(ProjectControl.review_status).all():
+            data[status] = count
+            data["total"] += count
+        return data
+
+    @staticmethod
+    def rebuild(project_id, commit=False):
+        """
+        Drop and recompute all rollup rows of a project
+        """
+        ProjectProgress.query.filter(ProjectProgress.project_id == project_id).delete(
+            synchronize_session=False
+        )
+        reviews = dict(
+            db.session.query(ProjectControl.id, ProjectControl.review_status)
+            .filter(ProjectControl.project_id == project_id)
+            .all()
+        )
+        totals = progress.empty_totals()
+        rows = []
+        for project_control_id, stats in progress.control_stats(
+            project_id=project_id
+        ).items():
+            values = progress.control_totals(stats)
+            for key, value in values.items():
+                totals[key] += value
+            rows.append(
+                {
+                    "project_id": project_id,
+                    "project_control_id": project_control_id,
+                    "review_summary": {
+                        "total": 1,
+                        reviews.get(project_control_id): 1,
+                    },
+                    **values,
+                }
+            )
+        db.session.bulk_insert_mappings(ProjectProgress, rows)
+        rollup = ProjectProgress(
+            project_id=project_id,
+            review_summary=ProjectProgress._review_summary(project_id),
+            **totals,
+        )
+        db.session.add(rollup)
+        if commit:
+            db.session.commit()
+        return rollup
+
+    @staticmethod
+    def refresh(project_id, project_control_ids, removed=False):
+        """
+        Recompute the rollup rows of the given project controls and apply the
+        difference to the project rollup. Does not commit
+
+        Args:
+            project_id: ID of the project
+            project_control_ids: list of ProjectControl ids that changed
+            removed: the controls are about to be deleted from the project
+        """
+        project_control_ids = list(set(project_control_ids or []))
+        if not project_control_ids:
+            return None
+        rollup = ProjectProgress.for_project(project_id, create=False)
+        if not rollup:
+            return ProjectProgress.rebuild(project_id)
+
+        stats = {}
+        if not removed:
+            stats = progress.control_stats(
+                project_id=project_id, project_control_ids=project_control_ids
+            )
+        rows = {
+            row.project_control_id: row
+            for row in ProjectProgress.query.filter(
+                ProjectProgress.project_id == project_id,
+                ProjectProgress.project_control_id.in_(project_control_ids),
+            ).all()
+        }
+        reviews = dict(
+            db.session.query(ProjectControl.id, ProjectControl.review_status)
+            .filter(ProjectControl.id.in_(project_control_ids))
+            .all()
+        )
+        delta = progress.empty_totals()
+        for project_control_id in project_control_ids:
+            row = rows.get(project_control_id)
+            old = row.totals() if row else progress.empty_totals()
+            new = progress.empty_totals()
+            if project_control_id in stats:
+                new = progress.control_totals(stats[project_control_id])
+            for key in delta:
+                delta[key] += new[key] - old[key]
+
+            if project_control_id not in stats:
+                if row:
+                    db.session.delete(row)
+                continue
+            if not row:
+                row = ProjectProgress(
+                    project_id=project_id, project_control_id=project_control_id
+                )
+                db.session.add(row)
+            for key, value in new.items():
+                setattr(row, key, value)
+            row.review_summary = {"total": 1, reviews.get(project_control_id): 1}
+
+        # apply the difference in sql so concurrent refreshes do not overwrite each other
+        values = {
+            getattr(ProjectProgress, key): getattr(ProjectProgress, key) + value
+            for key, value in delta.items()
+            if value
+        }
+        review_summary = ProjectProgress._review_summary(project_id)
+        if removed:
+            for status, count in ProjectProgress._review_summary(
+                project_id, project_control_ids=project_control_ids
+            ).items():
+                review_summary[status] -= count
+                if not review_summary[status] and status != "total":
+                    review_summary.pop(status)
+        values[ProjectProgress.review_summary] = review_summary
+        ProjectProgress.query.filter(ProjectProgress.id == rollup.id).update(
+            values, synchronize_session=False
+        )
+        db.session.expire(rollup)
+        return rollup
+
+    @staticmethod
+    def refresh_subcontrols(subcontrol_ids):
+        """
+        Refresh the rollups of the controls that own the given subcontrols
+        """
+        if not subcontrol_ids:
+            return None
+        controls = {}
+        for project_id, project_control_id in (
+            db.session.query(
+                ProjectSubControl.project_id, ProjectSubControl.project_control_id
+            )
+            .filter(ProjectSubControl.id.in_(subcontrol_ids))
+            .distinct()
+            .all()
+        ):
+            controls.setdefault(project_id, []).append(project_control_id)
+        for project_id, project_control_ids in controls.items():
+            ProjectProgress.refresh(project_id, project_control_ids)
+        return True
+
+    @staticmethod
+    def check(project_id):
+        """
+        Compare the stored rollups with a full recompute
+
+        Returns:
+            list of differences, empty when the rollups are consistent
+        """
+        errors = []
+        stored = {
+            row.project_control_id: row
+            for row in ProjectProgress.query.filter(
+                ProjectProgress.project_id == project_id
+            ).all()
+        }
+        expected = {
+            project_control_id: progress.control_totals(stats)
+            for project_control_id, stats in progress.control_stats(
+                project_id=project_id
+            ).items()
+        }
+        totals = progress.empty_totals()
+        for values in expected.values():
+            for key, value in values.items():
+                totals[key] += value
+        expected[None] = totals
+
+        for project_control_id in set(stored) | set(expected):
+            row = stored.get(project_control_id)
+            if project_control_id not in expected:
+                errors.append(
+                    {"project_control_id": project_control_id, "field": "orphan"}
+                )
+                continue
+            if not row:
+                errors.append(
+                    {"project_control_id": project_control_id, "field": "missing"}
+                )
+                continue
+            for key, value in expected[project_control_id].items():
+                if (getattr(row, key) or 0) != value:
+                    errors.append(
+                        {
+                            "project_control_id": project_control_id,
+                            "field": key,
+                            "stored": getattr(row, key),
+                            "expected": value,
+                        }
+                    )
+        if None in stored:
+            review_summary = ProjectProgress._review_summary(project_id)
+            if stored[None].review_summary != review_summary:
+                errors.append(
+                    {
+                        "project_control_id": None,
+                        "field": "review_summary",
+                        "stored": stored[None].review_summary,
+                        "expected": review_summary,
+                    }
+                )
+        return errors
+
 
 class Project(db.Model, DateMixin):
     __tablename__ = "projects"
@@ -2121,6 +3876,8 @@ class Project(db.Model, DateMixin):
     name = db.Column(db.String(), nullable=False)
     description = db.Column(db.String())
     last_completion_update = db.Column(db.DateTime)
+    # bumped on every change to the project content, see bump_revision
+    revision = db.Column(db.Integer, default=1, nullable=False)
     controls = db.relationship(
         "ProjectControl",
         backref="project",
@@ -2173,6 +3930,12 @@ class Project(db.Model, DateMixin):
         lazy="dynamic",
         cascade="all, delete-orphan",
     )
+    progress_rollup = db.relationship(
+        "ProjectProgress",
+        backref="project",
+        lazy="dynamic",
+        cascade="all, delete-orphan",
+    )
     notes = db.Column(db.String())
     members = db.relationship(
         "ProjectMember", backref="project", lazy="dynamic", cascade="all, delete-orphan"
@@ -2189,9 +3952,53 @@ class Project(db.Model, DateMixin):
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
-    def as_dict(self, with_summary=False, with_controls=False, exclude_timely=False):
+    """
+    summary fields skipped with exclude_timely
+    """
+    TIMELY_FIELDS = ["implemented_progress", "evidence_progress", "review_summary"]
+
+    """
+    columns left out of the project endpoints: they change without a new
+    revision (see Project.REVISION_IGNORED), so they can not be served
+    under the ETag. The revision itself is sent as the ETag
+    """
+    HIDDEN_COLUMNS = ["revision", "last_completion_update"]
+
+    def as_dict(
+        self, with_summary=False, with_controls=False, exclude_timely=False, rollup=None
+    ):
+        """
+        The summary is served from the project summary cache (see app.utils.cache)
+        """
+        if not with_summary or with_controls:
+            return self._as_dict(
+                with_summary=with_summary,
+                with_controls=with_controls,
+                exclude_timely=exclude_timely,
+                rollup=rollup,
+            )
+        data = summary_cache.get(self)
+        if data is None:
+            data = self._as_dict(with_summary=True, rollup=rollup)
+            summary_cache.set(self, data)
+        data = dict(data)
+        # entries cached before the columns were hidden
+        for key in Project.HIDDEN_COLUMNS:
+            data.pop(key, None)
+        if exclude_timely:
+            for key in Project.TIMELY_FIELDS:
+                data.pop(key, None)
+        return data
+
+    def _as_dict(
+        self, with_summary=False, with_controls=False, exclude_timely=False, rollup=None
+    ):
         # TODO - refactor
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data = {
+            c.name: getattr(self, c.name)
+            for c in self.__table__.columns
+            if c.name not in Project.HIDDEN_COLUMNS
+        }
         data["owner"] = self.user.email
         data["tenant"] = self.tenant.name
         data["auditors"] = [
@@ -2205,12 +4012,14 @@ class Project(db.Model, DateMixin):
             data["framework"] = self.framework.name
 
         if with_summary:
-            controls = self.controls.all()
-            data["completion_progress"] = self.completion_progress(controls=controls)
-            data["total_controls"] = len(controls)
+            if rollup is None:
+                rollup = ProjectProgress.for_project(self.id)
+            summary = rollup.summary()
+            data["completion_progress"] = summary["completion_progress"]
+            data["total_controls"] = summary["controls"]
             data["total_policies"] = self.policies.count()
             if with_controls:
-                data["controls"] = [control.as_dict() for control in controls]
+                data["controls"] = [control.as_dict() for control in self.controls.all()]
             data["status"] = "not started"
             if data["completion_progress"] > 0 and data["completion_progress"] < 100:
                 data["status"] = "in progress"
@@ -2218,11 +4027,9 @@ class Project(db.Model, DateMixin):
                 data["status"] = "complete"
 
             if not exclude_timely:
-                data["implemented_progress"] = self.implemented_progress(
-                    controls=controls
-                )
-                data["evidence_progress"] = self.evidence_progress(controls=controls)
-                data["review_summary"] = self.review_summary()
+                data["implemented_progress"] = summary["implemented_progress"]
+                data["evidence_progress"] = summary["evidence_progress"]
+                data["review_summary"] = summary["review_summary"]
 
         return data
 
@@ -2286,6 +4093,34 @@ class Project(db.Model, DateMixin):
         project_control = self.add_control(control[0])
         return project_control
 
+    """
+    attributes that do not change what the project endpoints return
+    """
+    REVISION_IGNORED = [
+        "revision",
+        "last_completion_update",
+        "completion_history",
+        "progress_rollup",
+    ]
+
+    @staticmethod
+    def bump_revision(project_ids):
+        """
+        Increment the revision of projects, used as the ETag of the
+        project read endpoints (see app.utils.etag)
+
+        Changes made through the session are picked up by the flush listener,
+        call this after UPDATE/DELETE queries that bypass the session
+        """
+        project_ids = [project_id for project_id in set(project_ids) if project_id]
+        if not project_ids:
+            return
+        db.session.execute(
+            Project.__table__.update()
+            .where(Project.id.in_(project_ids))
+            .values(revision=func.coalesce(Project.revision, 0) + 1)
+        )
+
     def ready_for_completion_update(self):
         if not self.last_completion_update:
             return True
@@ -2452,26 +4287,17 @@ class Project(db.Model, DateMixin):
         return False
 
     def get_applicable_control_count(self):
-        applicable_controls_count = (
-            db.session.query(func.count(distinct(ProjectControl.id)))
-            .join(
-                ProjectSubControl,
-                ProjectControl.id == ProjectSubControl.project_control_id,
-            )
+        """
+        number of controls with at least one applicable subcontrol
+        """
+        return (
+            db.session.query(func.count(distinct(ProjectSubControl.project_control_id)))
             .filter(
-                ProjectControl.project_id == self.id,
+                ProjectSubControl.project_id == self.id,
                 ProjectSubControl.is_applicable == True,
             )
-            .group_by(ProjectControl.id)
-            .having(
-                func.count(ProjectSubControl.id)
-                == func.sum(
-                    case([(ProjectSubControl.is_applicable == True, 1)], else_=0)
-                )
-            )
-            .count()
+            .scalar()
         )
-        return applicable_controls_count
 
     def evidence_groupings(self):
         data = {}
@@ -2487,37 +4313,173 @@ class Project(db.Model, DateMixin):
                     data[evidence.id]["count"] += 1
         return data
 
+    def get_evidence_archive(self):
+        """
+        Returns:
+            (list of archive.ArchiveItem, manifest) of the evidence files,
+            see archive.stream_archive
+        """
+        subcontrols = {}
+        query = (
+            db.session.query(
+                EvidenceAssociation.evidence_id,
+                ProjectSubControl.id,
+                Framework.name,
+                Control.ref_code,
+                SubControl.ref_code,
+                SubControl.name,
+            )
+            .join(ProjectSubControl, ProjectSubControl.id == EvidenceAssociation.control_id)
+            .join(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .join(Control, Control.id == SubControl.control_id)
+            .join(Framework, Framework.id == Control.framework_id)
+            .filter(ProjectSubControl.project_id == self.id)
+        )
+        for evidence_id, subcontrol_id, framework, control, ref_code, name in query:
+            subcontrols.setdefault(evidence_id, []).append(
+                {
+                    "id": subcontrol_id,
+                    "framework": framework,
+                    "control": control,
+                    "ref_code": ref_code,
+                    "name": name,
+                }
+            )
+
+        items = []
+        records = []
+        folders = set()
+        for evidence in self.evidence.order_by(ProjectEvidence.name):
+            record = {
+                "id": evidence.id,
+                "name": evidence.name,
+                "description": evidence.description,
+                "collected_on": evidence.collected_on,
+                "file": None,
+                "subcontrols": subcontrols.get(evidence.id, []),
+            }
+            records.append(record)
+            if not evidence.file_name:
+                record["status"] = "no file"
+                continue
+            try:
+                provider, path, _ = evidence.get_file_location()
+            except HTTPException as e:
+                record["status"] = f"error: {e.description}"
+                continue
+            # one folder per evidence, the names are unique in a project
+            folder = secure_filename(evidence.name) or evidence.id
+            if folder in folders:
+                folder = f"{folder}-{evidence.id}"
+            folders.add(folder)
+            record["file"] = f"evidence/{folder}/{evidence.file_name}"
+            items.append(archive.ArchiveItem(record["file"], provider, path, record))
+        manifest = {
+            "project": {"id": self.id, "name": self.name},
+            "tenant_id": self.tenant_id,
+            "evidence": records,
+        }
+        return items, manifest
+
+    def get_progress(self, controls=None, default=100):
+        """
+        completion, evidence and implemented progress for the project,
+        computed with a single aggregate query (see app.utils.progress)
+        """
+        project_control_ids = None
+        if controls is not None:
+            project_control_ids = [control.id for control in controls]
+        stats = progress.control_stats(
+            project_id=self.id, project_control_ids=project_control_ids
+        )
+        return progress.summarize(stats.values(), default=default)
+
     def completion_progress(self, controls=None, default=100):
-        total = 0
-        total_applicable_controls = self.get_applicable_control_count()
-        if not total_applicable_controls:
-            return default
-        if controls is None:
-            controls = self.controls.all()
-        for control in controls:
-            total += control.completed_progress()
-        return round((total / total_applicable_controls), 0)
+        return self.get_progress(controls=controls, default=default)[
+            "completion_progress"
+        ]
 
     def evidence_progress(self, controls=None):
-        total = 0
-        if controls is None:
-            controls = self.controls.all()
-        if not controls:
-            return total
-        for control in controls:
-            total += control.progress("with_evidence")
-        return round((total / len(controls)), 0)
+        return self.get_progress(controls=controls)["evidence_progress"]
 
     def implemented_progress(self, controls=None):
-        total = 0
         if not controls:
-            controls = self.controls.all()
-        if not controls:
-            return total
-        for control in controls:
-            if control.is_applicable():
-                total += control.implemented_progress()
-        return round((total / len(controls)), 0)
+            controls = None
+        return self.get_progress(controls=controls)["implemented_progress"]
+
+    CONTROL_VIEWS = [
+        "with-evidence",
+        "missing-evidence",
+        "not-implemented",
+        "implemented",
+        "applicable",
+        "not-applicable",
+        "complete",
+        "not-complete",
+    ]
+    CONTROL_SORT_KEYS = ["ref_code", "progress", "owner"]
+
+    def query_controls(self, view=None, sort=None):
+        """
+        Query the controls of the project. The view filters are evaluated in sql
+        against the project_progress rollup and match the fields of
+        ProjectControl.as_dict (progress_evidence, progress_implemented,
+        is_applicable and is_complete)
+
+        Args:
+            view: one of CONTROL_VIEWS, None or "all" for every control
+            sort: one of CONTROL_SORT_KEYS
+
+        Returns:
+            (query, sort_columns), sort_columns is a stable ordering for keyset pagination
+        """
+        ProjectProgress.for_project(self.id)
+        query = self.controls.join(
+            ProjectProgress, ProjectProgress.project_control_id == ProjectControl.id
+        )
+        if view and view != "all":
+            filters = {
+                "with-evidence": ProjectProgress.progress_evidence > 0,
+                "missing-evidence": ProjectProgress.progress_evidence == 0,
+                "not-implemented": ProjectProgress.progress_implemented == 0,
+                "implemented": ProjectProgress.progress_implemented == 100,
+                "applicable": ProjectProgress.applicable > 0,
+                "not-applicable": ProjectProgress.applicable == 0,
+                "complete": ProjectProgress.complete == ProjectProgress.applicable,
+                "not-complete": ProjectProgress.complete != ProjectProgress.applicable,
+            }
+            if view not in filters:
+                abort(422, f"Invalid view:{view}. Valid views:{self.CONTROL_VIEWS}")
+            query = query.filter(filters[view])
+
+        sort_column = None
+        if sort == "ref_code":
+            query = query.join(Control, Control.id == ProjectControl.control_id)
+            sort_column = func.coalesce(Control.ref_code, "")
+        elif sort == "progress":
+            sort_column = func.coalesce(ProjectProgress.progress_completed, 0)
+        elif sort == "owner":
+            owners = (
+                db.session.query(
+                    ProjectSubControl.project_control_id.label("project_control_id"),
+                    func.min(User.email).label("email"),
+                )
+                .join(User, User.id == ProjectSubControl.owner_id)
+                .filter(ProjectSubControl.project_id == self.id)
+                .group_by(ProjectSubControl.project_control_id)
+                .subquery()
+            )
+            query = query.outerjoin(
+                owners, owners.c.project_control_id == ProjectControl.id
+            )
+            sort_column = func.coalesce(owners.c.email, "")
+        elif sort:
+            abort(422, f"Invalid sort:{sort}. Valid sort keys:{self.CONTROL_SORT_KEYS}")
+
+        sort_columns = [ProjectControl.id]
+        if sort_column is not None:
+            sort_columns.insert(0, sort_column)
+        return query, sort_columns
 
     def has_control(self, control_id):
         return self.controls.filter(ProjectControl.control_id == control_id).first()
@@ -2530,25 +4492,85 @@ class Project(db.Model, DateMixin):
             return False
         if self.has_control(control.id):
             return control
-        project_control = ProjectControl(control_id=control.id)
-        for sub in control.subcontrols.all():
-            control_sub = ProjectSubControl(subcontrol_id=sub.id, project_id=self.id)
-            project_control.subcontrols.append(control_sub)
-            # Add tasks (e.g. AuditorFeedback)
-            if sub.tasks:
-                for task in sub.tasks:
-                    control_sub.feedback.append(
-                        AuditorFeedback(
-                            title=task.get("title"),
-                            description=task.get("description"),
-                            owner_id=self.owner_id,
+        project_control_ids = self.add_controls([control.id])
+        if commit:
+            ProjectProgress.refresh(self.id, project_control_ids)
+            db.session.commit()
+        return ProjectControl.query.get(project_control_ids[0])
+
+    def add_controls(self, control_ids, batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Add controls with their subcontrols to the project without building
+        ORM objects: the subcontrols of the controls are read with one SELECT
+        per batch and the project controls, project subcontrols and the
+        auditor feedback of the subcontrol tasks are written with multi-row
+        INSERTs. Controls already in the project are skipped. The caller
+        refreshes the progress rollup and commits
+
+        Returns:
+            ids of the new project controls
+        """
+        existing = {
+            control_id
+            for (control_id,) in db.session.query(ProjectControl.control_id).filter(
+                ProjectControl.project_id == self.id
+            )
+        }
+        # keep the order of the controls and drop duplicates
+        control_ids = [
+            control_id
+            for control_id in dict.fromkeys(control_ids)
+            if control_id not in existing
+        ]
+        if not control_ids:
+            return []
+
+        project_controls = {
+            control_id: bulk.with_defaults(
+                ProjectControl, {"project_id": self.id, "control_id": control_id}
+            )
+            for control_id in control_ids
+        }
+        subcontrols = []
+        feedback = []
+        for start in range(0, len(control_ids), batch_size):
+            query = db.session.query(
+                SubControl.id, SubControl.control_id, SubControl.tasks
+            ).filter(SubControl.control_id.in_(control_ids[start : start + batch_size]))
+            for subcontrol_id, control_id, tasks in query:
+                project_control_id = project_controls[control_id]["id"]
+                row = bulk.with_defaults(
+                    ProjectSubControl,
+                    {
+                        "subcontrol_id": subcontrol_id,
+                        "project_control_id": project_control_id,
+                        "project_id": self.id,
+                    },
+                )
+                subcontrols.append(row)
+                # Add tasks (e.g. AuditorFeedback)
+                for task in tasks if isinstance(tasks, list) else []:
+                    feedback.append(
+                        bulk.with_defaults(
+                            AuditorFeedback,
+                            {
+                                "title": task.get("title"),
+                                "description": task.get("description"),
+                                "owner_id": self.owner_id,
+                                "control_id": project_control_id,
+                                "relates_to": row["id"],
+                            },
                         )
                     )
 
-        self.controls.append(project_control)
-        if commit:
-            db.session.commit()
-        return project_control
+        bulk.insert_rows(ProjectControl, list(project_controls.values()), batch_size)
+        bulk.insert_rows(ProjectSubControl, subcontrols, batch_size)
+        bulk.insert_rows(AuditorFeedback, feedback, batch_size)
+        # the rows bypass the session, so the flush listeners do not see them
+        Project.bump_revision([self.id])
+        db.session.expire(self, ["revision"])
+        summary_cache.mark(db.session(), self.id)
+        return [row["id"] for row in project_controls.values()]
 
     def create_policy(self, name, description, template=None):
         policy = ProjectPolicy(name=name, description=description)
@@ -2574,10 +4596,204 @@ class Project(db.Model, DateMixin):
 
     def remove_control(self, id):
         if control := self.controls.filter(ProjectControl.id == id).first():
+            ProjectProgress.refresh(self.id, [control.id], removed=True)
             db.session.delete(control)
             db.session.commit()
         return True
 
+    MAX_BULK_SUBCONTROLS = 1000
+
+    @staticmethod
+    def _parse_subcontrol_change(change):
+        """
+        Validate one item of bulk_update_subcontrols
+
+        Returns:
+            (values, evidence_ids, error)
+        """
+        if not isinstance(change, dict) or not change.get("id"):
+            return None, None, "id is required"
+        if not isinstance(change["id"], str):
+            return None, None, "id must be a string"
+        values = {}
+        if change.get("implemented") is not None:
+            implemented = change["implemented"]
+            if (
+                isinstance(implemented, bool)
+                or not isinstance(implemented, int)
+                or not 0 <= implemented <= 100
+            ):
+                return None, None, "implemented must be an integer between 0 and 100"
+            values["implemented"] = implemented
+        if change.get("applicable") is not None:
+            if not isinstance(change["applicable"], bool):
+                return None, None, "applicable must be a boolean"
+            values["is_applicable"] = change["applicable"]
+        for key in ["notes", "context"]:
+            if change.get(key) is not None:
+                if not isinstance(change[key], str):
+                    return None, None, f"{key} must be a string"
+                values[key] = change[key]
+        owner_id = change.get("owner_id", change.get("owner-id"))
+        if owner_id:
+            if not isinstance(owner_id, str):
+                return None, None, "owner_id must be a string"
+            values["owner_id"] = owner_id
+        evidence = change.get("evidence") or []
+        if isinstance(evidence, str):
+            evidence = [evidence]
+        if not isinstance(evidence, list) or not all(
+            isinstance(evidence_id, str) for evidence_id in evidence
+        ):
+            return None, None, "evidence must be a list of ids"
+        return values, evidence, None
+
+    def bulk_update_subcontrols(self, changes, owner_id=None):
+        """
+        Apply a list of subcontrol changes in a single transaction
+
+        Rows that receive the same values are updated with one UPDATE
+        statement, evidence associations are inserted in bulk and the
+        progress rollups are refreshed once for all affected controls
+
+        Args:
+            changes: list of {id, implemented, applicable, notes, owner_id, evidence}
+            owner_id: only update subcontrols owned or operated by this user
+                (see Authorizer.can_user_manage_project_subcontrols)
+
+        Returns:
+            list of {id, ok, error} in the order of changes
+        """
+        if not isinstance(changes, list):
+            abort(422, "Expected a list of changes")
+        if len(changes) > Project.MAX_BULK_SUBCONTROLS:
+            abort(422, f"At most {Project.MAX_BULK_SUBCONTROLS} changes per request")
+
+        results = []
+        parsed = {}
+        for change in changes:
+            values, evidence, error = Project._parse_subcontrol_change(change)
+            subcontrol_id = change.get("id") if isinstance(change, dict) else None
+            if not error and subcontrol_id in parsed:
+                error = "duplicate id"
+            if not error:
+                parsed[subcontrol_id] = (values, evidence)
+            results.append({"id": subcontrol_id, "ok": not error, "error": error})
+
+        # load and authorize every referenced row in one query each
+        rows = {}
+        if parsed:
+            query = db.session.query(
+                ProjectSubControl.id,
+                ProjectSubControl.project_control_id,
+                ProjectSubControl.owner_id,
+                ProjectSubControl.operator_id,
+            ).filter(
+                ProjectSubControl.project_id == self.id,
+                ProjectSubControl.id.in_(list(parsed.keys())),
+            )
+            rows = {row.id: row for row in query.all()}
+        owners = {
+            value.get("owner_id") for value, evidence in parsed.values()
+        } - {None}
+        if owners:
+            owners = {
+                user_id
+                for user_id, in db.session.query(User.id)
+                .filter(User.id.in_(owners))
+                .all()
+            }
+        evidence_ids = {
+            evidence_id
+            for value, evidence in parsed.values()
+            for evidence_id in evidence
+        }
+        if evidence_ids:
+            evidence_ids = {
+                evidence_id
+                for evidence_id, in db.session.query(ProjectEvidence.id)
+                .filter(
+                    ProjectEvidence.project_id == self.id,
+                    ProjectEvidence.id.in_(evidence_ids),
+                )
+                .all()
+            }
+
+        for result in results:
+            if not result["ok"]:
+                continue
+            values, evidence = parsed[result["id"]]
+            row = rows.get(result["id"])
+            if not row:
+                error = "subcontrol not found"
+            elif owner_id and owner_id not in [row.owner_id, row.operator_id]:
+                error = "forbidden"
+            elif values.get("owner_id") and values["owner_id"] not in owners:
+                error = "owner not found"
+            elif set(evidence) - evidence_ids:
+                error = "evidence not found"
+            else:
+                error = None
+            if error:
+                result.update({"ok": False, "error": error})
+                parsed.pop(result["id"])
+
+        if not parsed:
+            return results
+
+        # group the rows by the values they receive, one UPDATE per group
+        groups = {}
+        for subcontrol_id, (values, evidence) in parsed.items():
+            if values:
+                groups.setdefault(tuple(sorted(values.items())), []).append(
+                    subcontrol_id
+                )
+        now = datetime.utcnow()
+        for values, subcontrol_ids in groups.items():
+            db.session.execute(
+                ProjectSubControl.__table__.update()
+                .where(ProjectSubControl.id.in_(subcontrol_ids))
+                .values(date_updated=now, **dict(values))
+            )
+
+        pairs = {
+            (subcontrol_id, evidence_id)
+            for subcontrol_id, (values, evidence) in parsed.items()
+            for evidence_id in evidence
+        }
+        if pairs:
+            pairs -= set(
+                db.session.query(
+                    EvidenceAssociation.control_id, EvidenceAssociation.evidence_id
+                )
+                .filter(
+                    EvidenceAssociation.control_id.in_(
+                        {subcontrol_id for subcontrol_id, evidence_id in pairs}
+                    )
+                )
+                .all()
+            )
+            db.session.bulk_insert_mappings(
+                EvidenceAssociation,
+                [
+                    {"control_id": subcontrol_id, "evidence_id": evidence_id}
+                    for subcontrol_id, evidence_id in pairs
+                ],
+            )
+
+        ProjectProgress.refresh(
+            self.id, [rows[subcontrol_id].project_control_id for subcontrol_id in parsed]
+        )
+        # the statements above bypass the session and its listeners
+        Project.bump_revision([self.id])
+        if any(
+            "implemented" in values or "is_applicable" in values
+            for values, evidence in parsed.values()
+        ):
+            completion_queue.defer(db.session(), self.id)
+        db.session.commit()
+        return results
+
 
 class ProjectPolicyAssociation(db.Model):
     __tablename__ = "project_policy_associations"
@@ -2623,35 +4839,52 @@ class ProjectPolicy(db.Model):
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
-    def as_dict(self, include=[]):
+    def as_dict(self, include=[], fields=None):
         data = {}
         for c in self.__table__.columns:
-            if c.name in include or not include:
+            if (c.name in include or not include) and fields_util.wants(
+                fields, c.name
+            ):
                 data[c.name] = getattr(self, c.name)
-        data["owner"] = self.owner_email()
-        data["reviewer"] = self.reviewer_email()
-        data["version_id"] = 1
+        data.update(
+            fields_util.select(
+                fields,
+                {"owner": self.owner_email, "reviewer": self.reviewer_email},
+            )
+        )
 
-        """
-        By default, load the published version and then the 
-        latest version (if there is not a published version)
-        """
-        if not (version := self.get_published_version()):
-            version = self.get_latest_version()
+        if any(
+            fields_util.wants(fields, name)
+            for name in ["version_id", "content", "version"]
+        ):
+            data["version_id"] = 1
+            """
+            By default, load the published version and then the 
+            latest version (if there is not a published version)
+            """
+            if not (version := self.get_published_version()):
+                version = self.get_latest_version()
 
-        if version:
-            data["version_id"] = version.id
-            data["content"] = version.content
-            data["version"] = version.version
+            if version:
+                data["version_id"] = version.id
+                data["content"] = version.content
+                data["version"] = version.version
 
-        versions = self.get_versions()
-        data["versions"] = versions
-        data["is_published"] = False
-        for record in versions:
-            if record["published"]:
-                data["is_published"] = True
-                break
-        return data
+        if fields_util.wants(fields, "versions") or fields_util.wants(
+            fields, "is_published"
+        ):
+            versions = self.get_versions()
+            data["versions"] = versions
+            data["is_published"] = False
+            for record in versions:
+                if record["published"]:
+                    data["is_published"] = True
+                    break
+        return {
+            name: value
+            for name, value in data.items()
+            if fields_util.wants(fields, name)
+        }
 
     def get_published_version(self):
         return self.versions.filter(PolicyVersion.published == True).first()
@@ -2893,6 +5126,11 @@ class ProjectControl(db.Model, ControlMixin):
         lazy="dynamic",
         cascade="all, delete-orphan",
     )
+    progress_rollup = db.relationship(
+        "ProjectProgress",
+        lazy="dynamic",
+        cascade="all, delete-orphan",
+    )
     project_id = db.Column(db.String, db.ForeignKey("projects.id"), nullable=False)
     control_id = db.Column(db.String, db.ForeignKey("controls.id"), nullable=False)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
@@ -2903,11 +5141,13 @@ class ProjectControl(db.Model, ControlMixin):
     def set_as_applicable(self):
         for subcontrol in self.subcontrols.all():
             subcontrol.is_applicable = True
+        ProjectProgress.refresh(self.project_id, [self.id])
         db.session.commit()
 
     def set_as_not_applicable(self):
         for subcontrol in self.subcontrols.all():
             subcontrol.is_applicable = False
+        ProjectProgress.refresh(self.project_id, [self.id])
         db.session.commit()
 
     def set_assignee(self, assignee_id):
@@ -2941,6 +5181,7 @@ class ProjectControl(db.Model, ControlMixin):
 
     def set_tags(self, tag_names):
         ControlTags.query.filter(ControlTags.control_id == self.id).delete()
+        Project.bump_revision([self.project_id])
         db.session.commit()
         # Add new tags
         for tag_name in tag_names:
@@ -3309,6 +5550,19 @@ class ProjectSubControl(db.Model, SubControlMixin):
             EvidenceAssociation.add(self.id, record)
         return True
 
+    def get_mapped_subcontrols(self, project_ids=None):
+        """
+        Subcontrols of the other projects of the tenant that are mapped to
+        this subcontrol (see ControlMapping)
+        """
+        project = self.project
+        return ControlMapping.mapped_subcontrols(
+            project.tenant_id,
+            [self.id],
+            exclude_project_ids=[project.id],
+            project_ids=project_ids,
+        )
+
     def disassociate_with_evidence(self, evidence_id):
         if isinstance(evidence_id, str):
             evidence_id = [evidence_id]
@@ -3348,6 +5602,7 @@ class ProjectSubControl(db.Model, SubControlMixin):
         if owner_id:
             self.owner_id = owner_id
 
+        ProjectProgress.refresh(self.project_id, [self.project_control_id])
         db.session.commit()
         return self
 
@@ -4813,6 +7068,100 @@ class ConfigStore(db.Model):
         return True
 
 
+class Job(db.Model):
+    """
+    Background job (see app.utils.jobs)
+    """
+
+    __tablename__ = "jobs"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    name = db.Column(db.String(), nullable=False)
+    key = db.Column(db.String(), nullable=False)
+    """
+    set to the key while the job is queued or running, the unique constraint
+    guarantees a single active job per key across processes
+    """
+    lock_key = db.Column(db.String(), unique=True)
+    status = db.Column(db.String(), nullable=False, default="queued")
+    step = db.Column(db.String())
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    params = db.Column(db.JSON(), default={})
+    result = db.Column(db.JSON(), default={})
+    error = db.Column(db.String())
+    user_id = db.Column(db.String(), db.ForeignKey("users.id"), nullable=True)
+    tenant_id = db.Column(
+        db.String(), db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=True
+    )
+    date_started = db.Column(db.DateTime)
+    date_finished = db.Column(db.DateTime)
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    VALID_STATUS = ["queued", "running", "complete", "failed"]
+    ACTIVE_STATUS = ["queued", "running"]
+
+    def as_dict(self):
+        data = {
+            c.name: getattr(self, c.name)
+            for c in self.__table__.columns
+            if c.name != "lock_key"
+        }
+        data["active"] = self.is_active()
+        return data
+
+    @staticmethod
+    def find_active(key):
+        return Job.query.filter(
+            Job.key == key, Job.status.in_(Job.ACTIVE_STATUS)
+        ).first()
+
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUS
+
+    def is_stale(self, seconds):
+        """
+        a worker that died leaves its job active, it is considered stale
+        when it did not report progress for the given number of seconds
+        """
+        if not self.is_active():
+            return False
+        last_seen = self.date_updated or self.date_started or self.date_added
+        return (datetime.utcnow() - last_seen).total_seconds() > seconds
+
+    def start(self):
+        self.status = "running"
+        self.date_started = datetime.utcnow()
+        db.session.commit()
+
+    def update(self, step=None, progress=None):
+        if step is not None:
+            self.step = step
+        if progress is not None:
+            self.progress = max(0, min(int(progress), 100))
+        self.date_updated = datetime.utcnow()
+        db.session.commit()
+
+    def finish(self, result=None):
+        self.status = "complete"
+        self.progress = 100
+        self.result = result or {}
+        self.lock_key = None
+        self.date_finished = datetime.utcnow()
+        db.session.commit()
+
+    def fail(self, error):
+        self.status = "failed"
+        self.error = str(error)
+        self.lock_key = None
+        self.date_finished = datetime.utcnow()
+        db.session.commit()
+
+
 class Logs(db.Model):
     __tablename__ = "logs"
     id = db.Column(
@@ -4995,9 +7344,206 @@ def after_update_project_sub_control_implementation_listener(
 ):
     """
     When the implementation of a subcontrol is updated, we are going to calculate the project
-    completion so that we can show a progress chart overtime
+    completion so that we can show a progress chart overtime. The snapshot is taken
+    by a background worker once the session commits (see app.utils.completion)
+    """
+    if value == old_value:
+        return
+    completion_queue.defer(db.session(), target.project_id)
+
+
+@listens_for(db.session, "after_commit")
+def after_commit_completion_listener(session):
+    completion_queue.submit(session)
+
+
+@listens_for(db.session, "after_rollback")
+def after_rollback_completion_listener(session):
+    completion_queue.discard(session)
+
+
+def _project_ids_for_flush(session):
+    """
+    Projects whose controls, subcontrols, evidence, policies or comments
+    are changed by the current flush
+    """
+    project_ids = set()
+    parents = {
+        ProjectControl: set(),
+        ProjectSubControl: set(),
+        ProjectEvidence: set(),
+        ProjectPolicy: set(),
+    }
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        # read the loaded values only, lazy loading is not allowed during a flush
+        values = sqlalchemy_inspect(obj).dict
+        if isinstance(obj, Project):
+            if obj in session.new:
+                continue
+            for attr in sqlalchemy_inspect(obj).attrs:
+                if attr.key in Project.REVISION_IGNORED:
+                    continue
+                if attr.history.has_changes():
+                    project_ids.add(obj.id)
+                    break
+        elif isinstance(
+            obj,
+            (
+                ProjectControl,
+                ProjectSubControl,
+                ProjectEvidence,
+                ProjectPolicy,
+                ProjectComment,
+                ProjectMember,
+                ProjectTags,
+                Finding,
+                RiskRegister,
+            ),
+        ):
+            project_ids.add(values.get("project_id"))
+        elif isinstance(
+            obj, (ControlComment, AuditorFeedback, ControlTags, ProjectPolicyAssociation)
+        ):
+            parents[ProjectControl].add(values.get("control_id"))
+        elif isinstance(obj, SubControlComment):
+            parents[ProjectSubControl].add(values.get("subcontrol_id"))
+        elif isinstance(obj, EvidenceAssociation):
+            parents[ProjectEvidence].add(values.get("evidence_id"))
+        elif isinstance(obj, (PolicyVersion, PolicyTags)):
+            parents[ProjectPolicy].add(values.get("policy_id"))
+
+    with session.no_autoflush:
+        for model, ids in parents.items():
+            ids.discard(None)
+            if ids:
+                project_ids.update(
+                    project_id
+                    for project_id, in session.query(model.project_id)
+                    .filter(model.id.in_(ids))
+                    .all()
+                )
+    project_ids.discard(None)
+    return project_ids
+
+
+@listens_for(db.session, "after_flush")
+def after_flush_project_revision_listener(session, flush_context):
+    """
+    Bump Project.revision of every project touched by the flush. The foreign
+    keys of new objects are only populated once they are flushed, so this
+    runs after the flush (new/dirty/deleted still hold the pre-flush state)
+    """
+    project_ids = _project_ids_for_flush(session)
+    if project_ids:
+        Project.bump_revision(project_ids)
+        session.info.setdefault("bumped_projects", set()).update(project_ids)
+
+
+@listens_for(db.session, "after_flush_postexec")
+def after_flush_postexec_project_revision_listener(session, flush_context):
+    """
+    Expire the stale revision of the bumped projects held by the session
+    """
+    for project_id in session.info.pop("bumped_projects", []):
+        project = session.identity_map.get(session.identity_key(Project, project_id))
+        if project is not None:
+            session.expire(project, ["revision"])
+
+
+@listens_for(ProjectSubControl, "after_insert")
+@listens_for(ProjectSubControl, "after_update")
+@listens_for(ProjectSubControl, "after_delete")
+@listens_for(ProjectControl, "after_insert")
+@listens_for(ProjectControl, "after_update")
+@listens_for(ProjectControl, "after_delete")
+@listens_for(ProjectMember, "after_insert")
+@listens_for(ProjectMember, "after_update")
+@listens_for(ProjectMember, "after_delete")
+def after_change_project_summary_listener(mapper, connection, target):
+    """
+    Drop the cached summary of the project once the session commits
+    """
+    summary_cache.mark(object_session(target), target.project_id)
+
+
+@listens_for(EvidenceAssociation, "after_insert")
+@listens_for(EvidenceAssociation, "after_delete")
+def after_change_evidence_association_summary_listener(mapper, connection, target):
+    if not target.evidence_id:
+        return
+    session = object_session(target)
+    evidence = session.identity_map.get(
+        session.identity_key(ProjectEvidence, target.evidence_id)
+    )
+    if evidence is not None:
+        project_id = evidence.project_id
+    else:
+        project_id = connection.execute(
+            db.select([ProjectEvidence.project_id]).where(
+                ProjectEvidence.id == target.evidence_id
+            )
+        ).scalar()
+    summary_cache.mark(session, project_id)
+
+
+@listens_for(db.session, "after_commit")
+def after_commit_summary_cache_listener(session):
+    summary_cache.commit(session)
+
+
+@listens_for(db.session, "after_rollback")
+def after_rollback_summary_cache_listener(session):
+    summary_cache.discard(session)
+
+
+@listens_for(Control, "before_update")
+def before_update_control_content_hash_listener(mapper, connection, target):
+    """
+    The fingerprint of a control edited through the session is unknown, the
+    next framework upgrade compares the full row (see app.utils.framework_upgrade)
+    """
+    state = sqlalchemy_inspect(target)
+    if any(
+        state.attrs[key].history.has_changes() for key in Control.CONTENT_COLUMNS
+    ):
+        target.content_hash = None
+
+
+@listens_for(SubControl, "after_insert")
+@listens_for(SubControl, "after_update")
+@listens_for(SubControl, "after_delete")
+def after_change_subcontrol_content_hash_listener(mapper, connection, target):
+    if target.control_id:
+        connection.execute(
+            Control.__table__.update()
+            .where(Control.id == target.control_id)
+            .values(content_hash=None)
+        )
+
+
+@listens_for(ProjectEvidence, "after_delete")
+@listens_for(VendorFile, "after_delete")
+def after_delete_file_blob_listener(mapper, connection, target):
     """
-    project = target.project
-    if project.ready_for_completion_update():
-        completion = project.completion_progress()
-        project.add_completion_metric(completion=completion)
+    Release the stored content of deleted evidence and vendor files
+    """
+    if target.blob_id:
+        StorageUsage.add(
+            *target.usage_scope(connection),
+            -FileBlob.get_size(target.blob_id, connection),
+            files=-1,
+            connection=connection,
+        )
+        FileBlob.release(target.blob_id, connection, object_session(target))
+
+
+@listens_for(db.session, "after_commit")
+def after_commit_file_blob_listener(session):
+    blobs.delete_scheduled(session)
+
+
+@listens_for(db.session, "after_rollback")
+def after_rollback_file_blob_listener(session):
+    blobs.discard_scheduled(session)
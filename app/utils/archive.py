@@ -0,0 +1,240 @@
+"""
+Streamed ZIP archive of the evidence files of a project
+
+The archive is written to the response as it is built, nothing is stored in
+a temporary file. The entries use zip64 and data descriptors, so neither the
+size of the files nor of the archive is limited and the output never needs
+to be rewound
+
+The files are read from the storage provider by ARCHIVE_PREFETCH_WORKERS
+threads, ahead of the file being compressed, so the fetches from S3/GCS
+overlap with the compression. A fetched file waits in a queue of at most
+ARCHIVE_PREFETCH_CHUNKS chunks, memory stays below
+
+    workers * (chunks + 1) * CHUNK_SIZE
+
+whatever the size of the files. A file that can not be read is left out and
+reported in manifest.json, the last entry of the archive
+
+    items = [ArchiveItem("evidence/report.pdf", "local", path, {...}), ...]
+    return Response(stream_archive(items, manifest), mimetype="application/zip")
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.utils.file_handler import FileStorageHandler, CHUNK_SIZE
+from app.utils.exceptions import FileDoesNotExist
+from datetime import datetime
+import itertools
+import threading
+import zipfile
+import hashlib
+import logging
+import queue
+import json
+import io
+import os
+
+
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNKS = 4
+# seconds without a chunk before a file is given up
+DEFAULT_TIMEOUT = 60
+# earliest date of a ZIP entry
+ZIP_EPOCH = datetime(1980, 1, 1)
+# already compressed content is stored as it is
+STORED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".heic",
+    ".mp3", ".mp4", ".mov", ".avi", ".mkv", ".webm",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods",
+}
+END = object()
+
+
+class ArchiveItem:
+    def __init__(self, name, provider, path, record):
+        """
+        Args:
+            name: path of the file in the archive
+            provider: storage provider of the file
+            path: path of the file in the provider
+            record: entry of the file in the manifest, updated with the
+                size, sha256 and status of the file
+        """
+        self.name = name
+        self.provider = provider
+        self.path = path
+        self.record = record
+        self.chunks = None
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stop the fetch of an item left out of the archive and empty its
+        queue, so the prefetch thread is not blocked on it
+        """
+        self.cancelled.set()
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                return
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Unseekable output of the ZipFile, pop() returns what was written since
+    the last call
+    """
+
+    def __init__(self):
+        self.data = []
+        self.offset = 0
+        self.sent = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def pop(self):
+        data = b"".join(self.data)
+        self.data = []
+        self.sent = self.offset
+        return data
+
+
+class Prefetcher:
+    def __init__(self, app, workers):
+        self.app = app
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archive")
+        self.cancelled = threading.Event()
+
+    def put(self, item, value):
+        # gives up when the archive is closed (e.g. the client disconnected)
+        # or the item is left out
+        while not (self.cancelled.is_set() or item.cancelled.is_set()):
+            try:
+                item.chunks.put(value, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(self, item):
+        try:
+            with self.app.app_context():
+                handler = FileStorageHandler(provider=item.provider)
+                for chunk in handler.stream_file(item.path):
+                    if not self.put(item, chunk):
+                        return
+        except Exception as e:
+            self.put(item, e)
+            return
+        self.put(item, END)
+
+    def submit(self, item):
+        self.pool.submit(self.fetch, item)
+
+    def close(self):
+        self.cancelled.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_chunks(item, timeout=DEFAULT_TIMEOUT):
+    """
+    Yields the fetched chunks of an item, raised when the fetch failed or
+    no chunk arrived for `timeout` seconds
+    """
+    while True:
+        try:
+            chunk = item.chunks.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No data received for {timeout} seconds")
+        if chunk is END:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def get_zip_info(name, date):
+    # ZIP dates start in 1980
+    date = max(date or datetime.utcnow(), ZIP_EPOCH)
+    info = zipfile.ZipInfo(name, date_time=date.timetuple()[:6])
+    info.external_attr = 0o644 << 16
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def stream_archive(items, manifest, workers=None, chunks=None):
+    """
+    Args:
+        items: list of ArchiveItem
+        manifest: content of manifest.json, the records of the items are
+            updated while the archive is written
+
+    Returns:
+        iterator of the bytes of the archive
+    """
+    config = current_app.config
+    workers = workers or int(config.get("ARCHIVE_PREFETCH_WORKERS") or DEFAULT_WORKERS)
+    chunks = chunks or int(config.get("ARCHIVE_PREFETCH_CHUNKS") or DEFAULT_CHUNKS)
+    timeout = int(config.get("ARCHIVE_FETCH_TIMEOUT") or DEFAULT_TIMEOUT)
+    for item in items:
+        item.chunks = queue.Queue(maxsize=chunks)
+    prefetcher = Prefetcher(current_app._get_current_object(), workers)
+    buffer = StreamBuffer()
+
+    try:
+        # the files are fetched in order, at most `workers` ahead
+        for item in items[:workers]:
+            prefetcher.submit(item)
+        with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+            for position, item in enumerate(items):
+                if position + workers < len(items):
+                    prefetcher.submit(items[position + workers])
+                fetched = get_chunks(item, timeout=timeout)
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    # a missing file does not leave an empty entry
+                    first = next(fetched, b"")
+                    info = get_zip_info(item.name, item.record.get("collected_on"))
+                    with archive.open(info, "w", force_zip64=True) as entry:
+                        for chunk in itertools.chain([first], fetched):
+                            digest.update(chunk)
+                            size += len(chunk)
+                            entry.write(chunk)
+                            if buffer.offset - buffer.sent >= CHUNK_SIZE:
+                                yield buffer.pop()
+                    item.record.update(
+                        {"size": size, "sha256": digest.hexdigest(), "status": "ok"}
+                    )
+                except Exception as e:
+                    logging.warning(f"Failed to add {item.name} to the archive. Error:{e}")
+                    item.cancel()
+                    # the error may contain the paths of the storage
+                    status = "missing" if isinstance(e, FileDoesNotExist) else "error"
+                    item.record.update(
+                        {"file": None if not size else item.name, "status": status}
+                    )
+                yield buffer.pop()
+
+            manifest["generated_on"] = datetime.utcnow().isoformat()
+            archive.writestr(
+                get_zip_info("manifest.json", None),
+                json.dumps(manifest, indent=2, default=str),
+            )
+        yield buffer.pop()
+    finally:
+        prefetcher.close()
@@ -228,17 +228,30 @@ class Authorizer:
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
     # tenant controls
-    def can_user_manage_control(self, control):
+    def can_user_manage_control(self, control, tenant=None):
+        """
+        controls of the global catalog are read-only, they are edited through
+        the copy of the tenant: the caller edits
+        control.get_or_create_override(tenant)
+        """
         if not (control := self.id_to_obj("Control", control)):
             return self.return_response(False, "control not found", 404)
-        if self._can_user_manage_tenant(control.tenant):
-            return self.return_response(True, AUTHORIZED_MSG, 200, control=control)
+        if not control.is_catalog():
+            tenant = control.tenant
+        elif not tenant or not (tenant := self.id_to_obj("Tenant", tenant)):
+            return self.return_response(
+                False, "tenant is required to edit a catalog control", 422
+            )
+        if self._can_user_manage_tenant(tenant):
+            return self.return_response(
+                True, AUTHORIZED_MSG, 200, control=control, tenant=tenant
+            )
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
     def can_user_read_control(self, control):
         if not (control := self.id_to_obj("Control", control)):
             return self.return_response(False, "control not found", 404)
-        if self._can_user_read_tenant(control.tenant):
+        if control.is_catalog() or self._can_user_read_tenant(control.tenant):
             return self.return_response(True, AUTHORIZED_MSG, 200, control=control)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
@@ -261,7 +274,7 @@ class Authorizer:
     def can_user_read_framework(self, framework):
         if not (framework := self.id_to_obj("Framework", framework)):
             return self.return_response(False, "framework not found", 404)
-        if self._can_user_read_tenant(framework.tenant):
+        if framework.is_catalog() or self._can_user_read_tenant(framework.tenant):
             return self.return_response(True, AUTHORIZED_MSG, 200, framework=framework)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
@@ -364,6 +377,24 @@ class Authorizer:
             return self.return_response(True, AUTHORIZED_MSG, 200, project=project)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
+    def can_user_manage_project_subcontrols(self, project):
+        """
+        bulk variant of can_user_manage_project_subcontrol. Editors may
+        update every subcontrol, other members only the subcontrols they own
+        or operate (owner_id is returned so the caller can filter on it)
+        """
+        if not (project := self._does_project_exist(project)):
+            return self.return_response(False, "project not found", 404)
+        if self._can_user_edit_project(project):
+            return self.return_response(
+                True, AUTHORIZED_MSG, 200, project=project, owner_id=None
+            )
+        if self._can_user_access_project(project):
+            return self.return_response(
+                True, AUTHORIZED_MSG, 200, project=project, owner_id=self.user.id
+            )
+        return self.return_response(False, UNAUTHORIZED_MSG, 403)
+
     # project comments
     def can_user_delete_project_comment(self, comment):
         if not (comment := self.id_to_obj("ProjectComment", comment)):
@@ -571,7 +602,9 @@ class Authorizer:
             return self.return_response(False, "control not found", 404)
         if not (project := self.id_to_obj("Project", project)):
             return self.return_response(False, "project not found", 404)
-        if self._can_user_edit_project(project) and control.tenant == project.tenant:
+        if self._can_user_edit_project(project) and (
+            control.is_catalog() or control.tenant == project.tenant
+        ):
             return self.return_response(
                 True, AUTHORIZED_MSG, 200, control=control, project=project
             )
@@ -595,6 +628,17 @@ class Authorizer:
             return self.return_response(True, AUTHORIZED_MSG, 200, user=user)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
+    # jobs
+    def can_user_read_job(self, job):
+        if not (job := self.id_to_obj("Job", job)):
+            return self.return_response(False, "job not found", 404)
+        if self.user.super or self.user.id == job.user_id:
+            return self.return_response(True, AUTHORIZED_MSG, 200, job=job)
+        if job.tenant_id and (tenant := self.id_to_obj("Tenant", job.tenant_id)):
+            if self._can_user_read_tenant(tenant):
+                return self.return_response(True, AUTHORIZED_MSG, 200, job=job)
+        return self.return_response(False, UNAUTHORIZED_MSG, 403)
+
     def can_user_manage_user_roles_in_tenant(self, user, tenant):
         if not (user := self.id_to_obj("User", user)):
             return self.return_response(False, "user not found", 404)
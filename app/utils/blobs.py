@@ -0,0 +1,81 @@
+"""
+Content addressed storage of uploaded files (models.FileBlob)
+
+An upload is hashed while it is copied to a temporary file, so its SHA-256
+is known before anything is written to the storage provider. A file is
+stored once per tenant, under tenants/<tenant>/blobs/<sha256[:2]>/<sha256>-<id>,
+and shared by every ProjectEvidence and VendorFile with the same content.
+FileBlob.ref_count counts them: uploading content that is already stored
+only adds a reference, and the stored file is deleted once the last
+reference is released and the session commits
+
+    blob = FileBlob.store(request.files["file"], tenant.id, "local")
+    FileBlob.release(blob.id)
+"""
+from app.utils.file_handler import FileStorageHandler
+import tempfile
+import hashlib
+import logging
+import os
+
+
+CHUNK_SIZE = 1024 * 1024
+SESSION_KEY = "released_blobs"
+
+
+def blob_key(tenant_id, sha256, blob_id):
+    """
+    The id of the row is part of the key: content stored again while its
+    last reference is released gets a new row, and the deletion scheduled
+    for the old row can not remove the new file
+    """
+    return os.path.join(
+        "tenants", tenant_id.lower(), "blobs", sha256[:2], f"{sha256}-{blob_id}"
+    )
+
+
+def spool(file_object, folder=None):
+    """
+    Copy an upload to a temporary file and hash it on the way
+
+    Args:
+        file_object: FileStorage or binary file object
+        folder: folder of the temporary file, on the same filesystem as the
+            destination a local upload is a rename
+
+    Returns:
+        (sha256, size, path of the temporary file)
+    """
+    stream = getattr(file_object, "stream", file_object)
+    digest = hashlib.sha256()
+    size = 0
+    handle, path = tempfile.mkstemp(prefix=".upload-", dir=folder)
+    try:
+        with os.fdopen(handle, "wb") as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return digest.hexdigest(), size, path
+
+
+def schedule_delete(session, provider, location):
+    """
+    Delete a stored file once the session commits
+    """
+    session.info.setdefault(SESSION_KEY, []).append((provider, location))
+
+
+def delete_scheduled(session):
+    for provider, location in session.info.pop(SESSION_KEY, []):
+        try:
+            FileStorageHandler(provider=provider).delete_file(path=location)
+        except Exception as e:
+            logging.warning(f"Failed to delete the blob:{location}. Error:{e}")
+
+
+def discard_scheduled(session):
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,110 @@
+"""
+Set-based inserts that bypass the ORM unit of work
+
+The rows are plain dicts. Column defaults (ids, dates, JSON defaults) are
+filled in Python, the same way the ORM does when a value is None, so every
+row has the same keys and ids are known before the insert (children can
+reference their parents without a flush)
+"""
+from sqlalchemy import bindparam
+from app import db
+import logging
+import time
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def with_defaults(model, values):
+    """
+    Complete a row with the defaults of the model columns. Like the ORM,
+    None is replaced by the column default when the column has one, except
+    for types that store None as a value (JSON null)
+    """
+    row = {}
+    for column in model.__table__.columns:
+        value = values.get(column.key)
+        keep_none = column.key in values and column.type.should_evaluate_none
+        if value is None and column.default is not None and not keep_none:
+            default = column.default
+            if default.is_callable:
+                value = default.arg(None)
+            elif default.is_scalar:
+                value = default.arg
+        row[column.key] = value
+    return row
+
+
+def insert_rows(model, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert rows in batches. Postgres gets one multi-row INSERT per batch,
+    other databases an executemany (SQLite limits the number of parameters
+    of a single statement)
+
+    Returns:
+        number of rows inserted
+    """
+    table = model.__table__
+    multi_row = db.engine.dialect.name == "postgresql"
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        if multi_row:
+            db.session.execute(table.insert().values(batch))
+        else:
+            db.session.execute(table.insert(), batch)
+    return len(rows)
+
+
+def update_rows(model, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Update rows by id with one executemany per batch. Every row has the same
+    keys: "id" and the columns to set
+
+    Returns:
+        number of rows updated
+    """
+    table = model.__table__
+    statement = table.update().where(table.c.id == bindparam("_id"))
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(
+            statement,
+            [
+                {"_id": row["id"], **{k: v for k, v in row.items() if k != "id"}}
+                for row in rows[start : start + batch_size]
+            ],
+        )
+    return len(rows)
+
+
+class ImportTimer:
+    """
+    Rows per second of an import
+
+    timer = ImportTimer("nist_800_53_v4")
+    timer.add(insert_rows(Control, rows))
+    timer.report()
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def add(self, count):
+        self.rows += count
+        return count
+
+    def report(self, **extra):
+        seconds = max(time.monotonic() - self.started, 1e-6)
+        data = {
+            "name": self.name,
+            "rows": self.rows,
+            "seconds": round(seconds, 3),
+            "rows_per_second": int(self.rows / seconds),
+            **extra,
+        }
+        logging.info(
+            f"Imported {data['rows']} rows for {self.name} in {data['seconds']}s "
+            f"({data['rows_per_second']} rows/s)"
+        )
+        return data
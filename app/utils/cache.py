@@ -0,0 +1,242 @@
+"""
+Cache for the project summaries (Project.as_dict(with_summary=True))
+
+Entries are keyed by (project_id, revision). A change to the project bumps
+Project.revision so stale entries are never read, and the model listeners in
+app.models drop the entries of a project when its subcontrols, controls,
+members or evidence associations change. The backend is selected with
+PROJECT_CACHE_BACKEND:
+
+    local   bounded LRU with a TTL, per process (default)
+    shared  shared between processes through CACHE_URL (redis), falls back to
+            an in-process stand-in when redis is not installed or configured
+    none    disabled
+"""
+from collections import OrderedDict
+from flask import current_app
+import threading
+import logging
+import pickle
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class LocalCache:
+    """
+    Thread safe LRU cache with a time to live
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self.lock:
+            record = self.data.get(key)
+            if record is None:
+                self.counters["misses"] += 1
+                return None
+            expires, value = record
+            if expires < time.monotonic():
+                del self.data[key]
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.data.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.data if key.startswith(prefix)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": "local",
+                "size": len(self.data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                **self.counters,
+            }
+
+
+class SharedStandIn:
+    """
+    In-process replacement for the shared store, with the same semantics as
+    the redis client subset used by SharedCache (values are stored as bytes)
+    """
+
+    store = {}
+    lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            record = self.store.get(key)
+            if record is None:
+                return None
+            expires, value = record
+            if expires < time.monotonic():
+                del self.store[key]
+                return None
+            return value
+
+    def setex(self, key, ttl, value):
+        with self.lock:
+            self.store[key] = (time.monotonic() + ttl, value)
+
+    def scan_iter(self, match):
+        prefix = match.rstrip("*")
+        with self.lock:
+            return [key for key in self.store if key.startswith(prefix)]
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.store.pop(key, None)
+
+
+class SharedCache:
+    """
+    Cache shared by every process, eviction is left to the store (TTL and
+    its own memory policy)
+    """
+
+    def __init__(self, url=None, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+        if redis is not None and url:
+            self.client = redis.Redis.from_url(url)
+            self.backend = "redis"
+        else:
+            logging.warning(
+                "Shared cache requested without redis or CACHE_URL, using the in-process stand-in"
+            )
+            self.client = SharedStandIn()
+            self.backend = "stand-in"
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            logging.warning(f"Shared cache read failed: {e}")
+            self.count("errors")
+            value = None
+        if value is None:
+            self.count("misses")
+            return None
+        self.count("hits")
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        try:
+            self.client.setex(key, self.ttl, pickle.dumps(value))
+        except Exception as e:
+            logging.warning(f"Shared cache write failed: {e}")
+            self.count("errors")
+
+    def delete_prefix(self, prefix):
+        try:
+            keys = list(self.client.scan_iter(match=f"{prefix}*"))
+            if keys:
+                self.client.delete(*keys)
+        except Exception as e:
+            logging.warning(f"Shared cache delete failed: {e}")
+            self.count("errors")
+
+    def clear(self):
+        self.delete_prefix(ProjectSummaryCache.PREFIX)
+
+    def stats(self):
+        with self.lock:
+            return {"backend": self.backend, "ttl": self.ttl, **self.counters}
+
+
+class ProjectSummaryCache:
+    PREFIX = "project-summary:"
+    SESSION_KEY = "invalidate_projects"
+
+    def __init__(self):
+        self.backend = None
+        self.configured = False
+        self.lock = threading.Lock()
+
+    def get_backend(self):
+        with self.lock:
+            if not self.configured:
+                config = current_app.config
+                name = config.get("PROJECT_CACHE_BACKEND", "local")
+                ttl = int(config.get("PROJECT_CACHE_TTL", 300))
+                if name == "local":
+                    self.backend = LocalCache(
+                        maxsize=int(config.get("PROJECT_CACHE_SIZE", 1024)), ttl=ttl
+                    )
+                elif name == "shared":
+                    self.backend = SharedCache(url=config.get("CACHE_URL"), ttl=ttl)
+                self.configured = True
+            return self.backend
+
+    def key(self, project_id, revision):
+        return f"{self.PREFIX}{project_id}:{revision or 0}"
+
+    def get(self, project):
+        if not (backend := self.get_backend()):
+            return None
+        return backend.get(self.key(project.id, project.revision))
+
+    def set(self, project, data):
+        if backend := self.get_backend():
+            backend.set(self.key(project.id, project.revision), data)
+
+    def invalidate(self, project_ids):
+        if not (backend := self.get_backend()):
+            return
+        for project_id in project_ids:
+            backend.delete_prefix(f"{self.PREFIX}{project_id}:")
+
+    def mark(self, session, project_id):
+        """
+        Invalidate the project once the session commits
+        """
+        if project_id:
+            session.info.setdefault(self.SESSION_KEY, set()).add(project_id)
+
+    def commit(self, session):
+        if project_ids := session.info.pop(self.SESSION_KEY, None):
+            self.invalidate(project_ids)
+
+    def discard(self, session):
+        session.info.pop(self.SESSION_KEY, None)
+
+    def stats(self):
+        if not (backend := self.get_backend()):
+            return {"backend": "none"}
+        return backend.stats()
+
+
+summary_cache = ProjectSummaryCache()
@@ -0,0 +1,201 @@
+"""
+Compiled catalog of the base frameworks (FRAMEWORK_FOLDER) and base policies
+(POLICY_FOLDER)
+
+The JSON and HTML files are parsed once into a pickle snapshot (CATALOG_CACHE).
+A snapshot is used when it was built from the same files: the size and mtime
+of every file must match, and a file whose mtime changed is accepted when its
+SHA-256 is unchanged. Otherwise the snapshot is rebuilt from the files
+
+The catalog is loaded by create_app, so with "gunicorn --preload" it is read
+once in the master process and shared by the workers after the fork. Rebuild
+it ahead of time with "python3 manage.py build_catalog"
+
+    from app.utils.catalog import catalog
+
+    catalog.framework_names()
+    catalog.get_controls("soc2")
+    catalog.find_control("soc2__cc1.1")
+"""
+from flask import current_app
+import threading
+import hashlib
+import logging
+import pickle
+import json
+import os
+
+
+VERSION = 1
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_sources(framework_folder, policy_folder):
+    """
+    Returns:
+        {path: (kind, name)} of the files of the catalog
+    """
+    sources = {}
+    for folder, kind, extension in (
+        (framework_folder, "framework", ".json"),
+        (policy_folder, "policy", ".html"),
+    ):
+        if not folder or not os.path.isdir(folder):
+            logging.warning(f"Catalog folder does not exist: {folder}")
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(extension):
+                name = filename[: -len(extension)].lower()
+                sources[os.path.join(folder, filename)] = (kind, name)
+    return sources
+
+
+class FrameworkCatalog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+
+    def build(self, framework_folder, policy_folder):
+        """
+        Parse the source files
+
+        Returns:
+            snapshot data
+        """
+        data = {"version": VERSION, "files": {}, "frameworks": {}, "policies": {}}
+        for path, (kind, name) in list_sources(framework_folder, policy_folder).items():
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                content = f.read()
+            data["files"][path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": hashlib.sha256(content).hexdigest(),
+            }
+            if kind == "framework":
+                controls = json.loads(content)
+                data["frameworks"][name] = {
+                    "controls": controls,
+                    "index": {
+                        f"{name}__{control.get('ref_code')}".lower(): position
+                        for position, control in enumerate(controls)
+                    },
+                }
+            else:
+                data["policies"][name] = content.decode()
+        return data
+
+    def is_valid(self, data, framework_folder, policy_folder):
+        if not isinstance(data, dict) or data.get("version") != VERSION:
+            return False
+        sources = list_sources(framework_folder, policy_folder)
+        if set(sources) != set(data["files"]):
+            return False
+        for path, record in data["files"].items():
+            stat = os.stat(path)
+            if stat.st_size != record["size"]:
+                return False
+            if stat.st_mtime_ns != record["mtime"]:
+                if file_digest(path) != record["sha256"]:
+                    return False
+                # same content (e.g. a fresh checkout), keep the snapshot
+                record["mtime"] = stat.st_mtime_ns
+        return True
+
+    def read_snapshot(self, path):
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Failed to read the catalog snapshot:{path}. Error:{e}")
+            return None
+
+    def write_snapshot(self, path, data):
+        if not path:
+            return False
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # readers never see a partial snapshot
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to write the catalog snapshot:{path}. Error:{e}")
+            return False
+        return True
+
+    def load(self, app=None, rebuild=False):
+        """
+        Load the snapshot of the app, rebuild and save it when it is missing
+        or stale
+
+        Returns:
+            True if the snapshot was rebuilt
+        """
+        config = (app or current_app).config
+        framework_folder = config["FRAMEWORK_FOLDER"]
+        policy_folder = config["POLICY_FOLDER"]
+        path = config.get("CATALOG_CACHE")
+        with self.lock:
+            data = None if rebuild else self.read_snapshot(path)
+            if data is not None and self.is_valid(data, framework_folder, policy_folder):
+                self.data = data
+                return False
+            data = self.build(framework_folder, policy_folder)
+            self.write_snapshot(path, data)
+            self.data = data
+            logging.info(
+                f"Built the catalog: {len(data['frameworks'])} frameworks and "
+                f"{len(data['policies'])} policies"
+            )
+            return True
+
+    def get_data(self):
+        if self.data is None:
+            self.load()
+        return self.data
+
+    def framework_names(self):
+        return list(self.get_data()["frameworks"])
+
+    def has_framework(self, name):
+        return name.lower() in self.get_data()["frameworks"]
+
+    def get_controls(self, name):
+        """
+        Controls of a framework in the import format (see Control.create),
+        shared by every caller so they must not be modified
+
+        Returns:
+            list of controls, None if the framework is not in the catalog
+        """
+        if framework := self.get_data()["frameworks"].get(name.lower()):
+            return framework["controls"]
+        return None
+
+    def find_control(self, abs_ref_code):
+        framework, _, _ = abs_ref_code.lower().partition("__")
+        if not (data := self.get_data()["frameworks"].get(framework)):
+            return None
+        position = data["index"].get(abs_ref_code.lower())
+        if position is None:
+            return None
+        return data["controls"][position]
+
+    def policy_names(self):
+        return list(self.get_data()["policies"])
+
+    def get_policy(self, name):
+        return self.get_data()["policies"].get(name.lower())
+
+
+catalog = FrameworkCatalog()
@@ -0,0 +1,89 @@
+"""
+Deferred completion history snapshots
+
+Changing the implementation of a subcontrol used to compute the project
+completion and commit a CompletionHistory row from inside the attribute
+event, in the middle of the caller's unit of work. Now the listener only
+marks the project on the session (defer), and once the session commits the
+marked projects are handed to a small thread pool (submit). A project that
+is already waiting in the pool is not queued twice, so a burst of edits
+results in a single snapshot
+
+    COMPLETION_WORKERS=0 disables the automatic snapshots, in that case run
+    "python3 manage.py snapshot_completion" periodically
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import threading
+import logging
+import os
+
+
+SESSION_KEY = "completion_projects"
+
+
+class CompletionQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.executor = None
+        self.pid = None
+
+    def defer(self, session, project_id):
+        """
+        Mark a project for a snapshot once the session commits
+        """
+        if project_id:
+            session.info.setdefault(SESSION_KEY, set()).add(project_id)
+
+    def discard(self, session):
+        session.info.pop(SESSION_KEY, None)
+
+    def submit(self, session):
+        """
+        Queue the snapshots of the projects marked on a committed session
+        """
+        project_ids = session.info.pop(SESSION_KEY, None)
+        if not project_ids:
+            return
+        app = current_app._get_current_object()
+        executor = self.get_executor(app)
+        if executor is None:
+            return
+        with self.lock:
+            project_ids = project_ids - self.pending
+            self.pending.update(project_ids)
+        for project_id in project_ids:
+            executor.submit(self.run, app, project_id)
+
+    def get_executor(self, app):
+        workers = int(app.config.get("COMPLETION_WORKERS", 2))
+        if workers < 1:
+            return None
+        with self.lock:
+            # threads do not survive a fork, start a new pool in the child
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="completion"
+                )
+                self.pending = set()
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, app, project_id):
+        # a change committed while the snapshot runs queues a new one
+        with self.lock:
+            self.pending.discard(project_id)
+        with app.app_context():
+            try:
+                app.models["CompletionHistory"].snapshot(project_ids=[project_id])
+            except Exception as e:
+                logging.error(
+                    f"Failed to snapshot completion for project:{project_id}. Error:{e}"
+                )
+                app.db.session.rollback()
+            finally:
+                app.db.session.remove()
+
+
+completion_queue = CompletionQueue()
@@ -0,0 +1,386 @@
+"""
+Streaming import of large custom frameworks
+
+The upload is read in chunks and the controls are parsed one at a time, so
+memory depends on the size of the largest control and on the batch size,
+not on the size of the file. Every control is validated, invalid rows are
+reported and skipped, and the valid controls are inserted and committed in
+batches (see Control.insert_batch)
+
+Formats:
+
+    json    {"framework": "name", "controls": [{...}, ...]} or [{...}, ...]
+            (the controls use the format of Control.create)
+    csv     one row per subcontrol, consecutive rows with the same ref_code
+            belong to the same control. Control columns: ref_code, name,
+            description, category, subcategory, guidance, references, level,
+            system_level, dti, dtc, mapping, meta, vendor_recommendations.
+            Subcontrol columns use the "subcontrol_" prefix (subcontrol_name,
+            subcontrol_ref_code, subcontrol_description, subcontrol_mitigation,
+            subcontrol_guidance, subcontrol_implementation_group,
+            subcontrol_tasks). JSON columns (mapping, meta, tasks, ...) hold
+            JSON text
+
+    importer = ControlImporter(tenant_id, framework="my_framework")
+    report = importer.run(reader_for(stream, "json"))
+"""
+from flask import current_app
+from app.utils import bulk
+import codecs
+import json
+import csv
+import io
+
+
+CHUNK_SIZE = 64 * 1024
+# a single control larger than this is rejected instead of buffered
+MAX_ITEM_SIZE = 8 * 1024 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+JSON_COLUMNS = ["mapping", "meta", "vendor_recommendations", "tasks"]
+INTEGER_COLUMNS = ["level", "implementation_group"]
+BOOLEAN_COLUMNS = ["system_level"]
+
+
+class ImportFormatError(ValueError):
+    """
+    The document can not be parsed, the import stops
+    """
+
+
+class JSONControlReader:
+    """
+    Incremental reader of the controls of a JSON document
+
+    Keys that come before "controls" in the document are available in
+    .metadata once the first control is read
+    """
+
+    WHITESPACE = " \t\r\n"
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.consumed = 0
+        self.eof = False
+        self.metadata = {}
+
+    def read_more(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buffer += self.decoder.decode(b"", final=True)
+            return False
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # drop what was already parsed
+        self.consumed += self.position
+        self.buffer = self.buffer[self.position :] + self.decoder.decode(chunk)
+        self.position = 0
+        if len(self.buffer) > MAX_ITEM_SIZE:
+            raise ImportFormatError(
+                f"Item larger than {MAX_ITEM_SIZE} bytes at offset {self.consumed}"
+            )
+        return True
+
+    def peek(self):
+        """
+        Next non whitespace character, None at the end of the document
+        """
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in self.WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ImportFormatError(
+                f"Expected one of {characters!r} at offset {self.consumed + self.position}"
+            )
+        self.position += 1
+        return character
+
+    def value(self):
+        """
+        Decode the next value, reading more of the stream until it is complete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if self.read_more():
+                    continue
+                raise ImportFormatError(
+                    f"Invalid JSON at offset {self.consumed + e.pos}: {e.msg}"
+                )
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.read_more():
+                continue
+            self.position = end
+            return value
+
+    def items(self):
+        """
+        Yields the elements of the array at the current position
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def __iter__(self):
+        """
+        Yields (row, control), row starts at 1
+        """
+        row = 0
+        if self.peek() == "[":
+            for row, control in enumerate(self.items(), start=1):
+                yield row, control
+            return
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if key == "controls":
+                for row, control in enumerate(self.items(), start=row + 1):
+                    yield row, control
+            else:
+                self.metadata[key] = self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+class CSVControlReader:
+    """
+    Reader of the controls of a CSV document, see the module docstring for
+    the columns
+    """
+
+    def __init__(self, stream):
+        if not isinstance(stream, io.TextIOBase):
+            stream = codecs.getreader("utf-8-sig")(stream)
+        self.reader = csv.DictReader(stream)
+        self.metadata = {}
+
+    @staticmethod
+    def parse_value(key, value):
+        """
+        invalid values are returned as they are and rejected by validate_control
+        """
+        value = (value or "").strip()
+        if not value:
+            return None
+        try:
+            if key in JSON_COLUMNS:
+                return json.loads(value)
+            if key in INTEGER_COLUMNS:
+                return int(value)
+        except ValueError:
+            return value
+        if key in BOOLEAN_COLUMNS:
+            return value.lower() in ["true", "yes", "1"]
+        return value
+
+    def __iter__(self):
+        """
+        Yields (line, control), the line of the first row of the control
+        """
+        control = None
+        first_line = None
+        for record in self.reader:
+            line = self.reader.line_num
+            values = {}
+            subcontrol = {}
+            for key, value in record.items():
+                if key is None:
+                    continue
+                key = key.strip().lower()
+                value = self.parse_value(key.replace("subcontrol_", ""), value)
+                if value is None:
+                    continue
+                if key.startswith("subcontrol_"):
+                    subcontrol[key[len("subcontrol_") :]] = value
+                else:
+                    values[key] = value
+            if control is not None and values.get("ref_code") == control.get(
+                "ref_code"
+            ):
+                if subcontrol:
+                    control.setdefault("subcontrols", []).append(subcontrol)
+                continue
+            if control is not None:
+                yield first_line, control
+            control = values
+            first_line = line
+            if subcontrol:
+                control["subcontrols"] = [subcontrol]
+        if control is not None:
+            yield first_line, control
+
+
+def reader_for(stream, format):
+    if format == "json":
+        return JSONControlReader(stream)
+    if format == "csv":
+        return CSVControlReader(stream)
+    raise ValueError(f"Unsupported format:{format}")
+
+
+def validate_control(control):
+    """
+    Returns:
+        list of errors, empty when the control can be imported
+    """
+    if not isinstance(control, dict):
+        return ["control must be an object"]
+    errors = []
+    for key in ["name", "ref_code"]:
+        value = control.get(key)
+        if value is None or not str(value).strip():
+            errors.append(f"{key} is required")
+        elif not isinstance(value, (str, int)):
+            errors.append(f"{key} must be a string")
+    try:
+        int(control.get("level", 1))
+    except (TypeError, ValueError):
+        errors.append("level must be an integer")
+    for key in ["mapping", "meta", "vendor_recommendations"]:
+        if control.get(key) is not None and not isinstance(control[key], dict):
+            errors.append(f"{key} must be an object")
+    subcontrols = control.get("subcontrols", [])
+    if not isinstance(subcontrols, list):
+        return errors + ["subcontrols must be a list"]
+    for position, sub in enumerate(subcontrols):
+        if not isinstance(sub, dict):
+            errors.append(f"subcontrols[{position}] must be an object")
+            continue
+        if not sub.get("name"):
+            errors.append(f"subcontrols[{position}].name is required")
+        if sub.get("tasks") is not None and not isinstance(sub["tasks"], list):
+            errors.append(f"subcontrols[{position}].tasks must be a list")
+        if sub.get("implementation_group") is not None:
+            try:
+                int(sub["implementation_group"])
+            except (TypeError, ValueError):
+                errors.append(
+                    f"subcontrols[{position}].implementation_group must be an integer"
+                )
+    return errors
+
+
+class ControlImporter:
+    def __init__(
+        self,
+        tenant_id,
+        framework=None,
+        batch_size=bulk.DEFAULT_BATCH_SIZE,
+        max_errors=MAX_REPORTED_ERRORS,
+    ):
+        self.tenant_id = tenant_id
+        self.framework_name = framework
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.framework = None
+        self.existing = set()
+        self.counts = {"parsed": 0, "controls": 0, "subcontrols": 0, "failed": 0}
+        self.errors = []
+
+    def add_error(self, row, control, errors):
+        self.counts["failed"] += 1
+        if len(self.errors) < self.max_errors:
+            ref_code = control.get("ref_code") if isinstance(control, dict) else None
+            self.errors.append({"row": row, "ref_code": ref_code, "errors": errors})
+
+    def get_framework(self, metadata):
+        models = current_app.models
+        name = self.framework_name or metadata.get("framework")
+        if not name or not isinstance(name, str):
+            raise ImportFormatError(
+                "The framework name is required (before the controls in the document)"
+            )
+        framework = models["Control"].get_or_create_framework(
+            {
+                "framework": name.lower(),
+                "framework_description": metadata.get("framework_description")
+                or f"Framework for {name}",
+            },
+            self.tenant_id,
+        )
+        Control = models["Control"]
+        # existing controls of the framework are not imported twice
+        self.existing = {
+            abs_ref_code.lower()
+            for (abs_ref_code,) in current_app.db.session.query(
+                Control.abs_ref_code
+            ).filter(Control.framework_id == framework.id)
+            if abs_ref_code
+        }
+        return framework
+
+    def flush(self, batch):
+        if not batch:
+            return
+        controls, subcontrols = current_app.models["Control"].insert_batch(
+            batch, self.framework, self.tenant_id, batch_size=self.batch_size
+        )
+        current_app.db.session.commit()
+        self.counts["controls"] += controls
+        self.counts["subcontrols"] += subcontrols
+        self.timer.add(controls + subcontrols)
+
+    def run(self, reader):
+        """
+        Returns:
+            report with the number of imported rows and the rejected rows
+        """
+        self.timer = bulk.ImportTimer(self.framework_name or "import")
+        batch = []
+        fatal = None
+        try:
+            for row, control in reader:
+                self.counts["parsed"] += 1
+                if self.framework is None:
+                    self.framework = self.get_framework(reader.metadata)
+                    self.timer.name = self.framework.name
+                if errors := validate_control(control):
+                    self.add_error(row, control, errors)
+                    continue
+                abs_ref_code = f"{self.framework.name}__{control['ref_code']}".lower()
+                if abs_ref_code in self.existing:
+                    self.add_error(row, control, ["ref_code already exists"])
+                    continue
+                self.existing.add(abs_ref_code)
+                batch.append(control)
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+        except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+            fatal = str(e)
+        # controls parsed before a format error are kept
+        self.flush(batch)
+        return self.timer.report(
+            framework=self.framework.name if self.framework else self.framework_name,
+            error=fatal,
+            errors=self.errors,
+            **self.counts,
+        )
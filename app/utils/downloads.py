@@ -0,0 +1,125 @@
+"""
+Streamed file downloads with HTTP Range support
+
+The file is sent as an iterator of chunks read from the storage provider
+(FileStorageHandler.stream_file), so memory does not depend on the size of
+the file. A single byte range ("Range: bytes=0-1023") is answered with 206,
+an unsatisfiable range with 416; several ranges get the full file
+
+With STORAGE_OFFLOAD the web server sends local files instead of the worker:
+
+    nginx   X-Accel-Redirect to STORAGE_OFFLOAD_PREFIX + the path in
+            EVIDENCE_FOLDER, served by an internal location:
+
+                location /protected-evidence/ {
+                    internal;
+                    alias /path/to/EVIDENCE_FOLDER/;
+                }
+
+    apache  X-Sendfile with the absolute path (mod_xsendfile)
+"""
+from flask import request, current_app, Response, stream_with_context, abort
+from app.utils.file_handler import FileStorageHandler
+from app.utils.exceptions import FileDoesNotExist
+from urllib.parse import quote
+import mimetypes
+import os
+
+
+def offload_headers(handler, path):
+    """
+    Returns:
+        headers that hand the file over to the web server, None to stream it
+    """
+    offload = (current_app.config.get("STORAGE_OFFLOAD") or "").lower()
+    if handler.provider != "local" or not offload:
+        return None
+    path = handler.get_local_path(path)
+    if offload == "nginx":
+        relative = os.path.relpath(path, current_app.config["EVIDENCE_FOLDER"])
+        prefix = current_app.config["STORAGE_OFFLOAD_PREFIX"].rstrip("/")
+        return {"X-Accel-Redirect": quote(f"{prefix}/{relative}")}
+    if offload == "apache":
+        return {"X-Sendfile": path}
+    return None
+
+
+def get_range(size, etag):
+    """
+    Returns:
+        (first byte, last byte) of the requested part, None for the full file
+        and False when the range can not be satisfied
+    """
+    if not request.range or len(request.range.ranges) != 1:
+        return None
+    # If-Range: only send a part of the same content, with a strong comparison
+    # (the ETags of the legacy files are unknown, they are always sent in full)
+    header = request.headers.get("If-Range")
+    if header and (
+        etag is None or header.startswith("W/") or request.if_range.etag != etag
+    ):
+        return None
+    if not (part := request.range.range_for_length(size)):
+        return False
+    return part[0], part[1] - 1
+
+
+def file_response(provider, path, download_name, etag=None, mimetype=None):
+    """
+    Args:
+        provider: storage provider of the file
+        path: path of the file in the provider
+        download_name: file name of the attachment
+        etag: strong validator of the content (e.g. its SHA-256)
+    """
+    handler = FileStorageHandler(provider=provider)
+    mimetype = (
+        mimetype or mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    )
+    headers = {
+        "Accept-Ranges": "bytes",
+        # the files are only sent to authenticated users, shared caches must
+        # not store them and the ETag is revalidated on every request
+        "Cache-Control": "private, no-cache",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag:
+        headers["ETag"] = f'"{etag}"'
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+    try:
+        if offloaded := offload_headers(handler, path):
+            response = Response(mimetype=mimetype, headers={**headers, **offloaded})
+            response.headers.set("Content-Disposition", "attachment", filename=download_name)
+            return response
+        size = handler.get_file_size(path)
+    except FileDoesNotExist:
+        abort(404, "File not found")
+
+    status = 200
+    start, end = 0, size - 1
+    if (part := get_range(size, etag)) is False:
+        return Response(
+            status=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+        )
+    if part:
+        start, end = part
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    # HEAD only needs the headers, the file is not read
+    if request.method == "HEAD" or not size:
+        chunks = iter(())
+    else:
+        chunks = stream_with_context(handler.stream_file(path, start=start, end=end))
+    response = Response(
+        chunks,
+        status=status,
+        mimetype=mimetype,
+        headers=headers,
+        direct_passthrough=True,
+    )
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
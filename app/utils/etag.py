@@ -0,0 +1,50 @@
+"""
+Weak ETags for the project read endpoints
+
+The ETag is derived from Project.revision, which is bumped by every change to
+the project content, so a request with a matching If-None-Match header is
+answered with a 304 before anything is loaded or serialized
+
+    project = result["extra"]["project"]
+    if response := not_modified(project):
+        return response
+    ...
+    return with_etag(jsonify(data), project)
+"""
+from flask import request, current_app
+from flask_login import current_user
+import hashlib
+
+
+def project_etag(project):
+    """
+    The same revision serializes differently depending on the url (fields,
+    filters, pagination), the Accept header (see app.utils.streaming) and
+    the permissions of the user, so they are part of the tag
+    """
+    variant = "|".join(
+        [
+            request.full_path,
+            request.headers.get("Accept", ""),
+            str(getattr(current_user, "id", "")),
+        ]
+    )
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:16]
+    return f"{project.id}-{project.revision or 0}-{digest}"
+
+
+def not_modified(project):
+    """
+    Returns a 304 response when the client already has the current revision
+    """
+    etag = project_etag(project)
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def with_etag(response, project):
+    response.set_etag(project_etag(project), weak=True)
+    return response
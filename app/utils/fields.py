@@ -0,0 +1,123 @@
+"""
+Sparse fieldsets for the control, subcontrol, evidence and policy serializers
+
+    ?fields=id,name,implemented          only these fields
+    ?fields=summary                      the summary profile of the resource
+    ?fields=summary&include=owner,notes  a profile plus extra fields
+    ?fields=id,subcontrols.summary       nested fields (controls only)
+
+The serializers receive the selected field names and skip the computation
+of every field that was not requested
+"""
+
+PROFILES = {
+    "control": {
+        "summary": [
+            "id",
+            "ref_code",
+            "name",
+            "status",
+            "review_status",
+            "is_applicable",
+            "is_complete",
+            "progress_completed",
+            "progress_implemented",
+            "progress_evidence",
+            "subcontrols",
+            "subcontrols.summary",
+        ],
+    },
+    "subcontrol": {
+        "summary": [
+            "id",
+            "ref_code",
+            "name",
+            "implemented",
+            "is_applicable",
+            "has_evidence",
+        ],
+    },
+    "evidence": {
+        "summary": [
+            "id",
+            "name",
+            "description",
+            "group",
+            "collected_on",
+            "control_count",
+            "has_file",
+        ],
+    },
+    "policy": {
+        "summary": [
+            "id",
+            "name",
+            "description",
+            "owner",
+            "reviewer",
+            "version",
+            "is_published",
+        ],
+    },
+}
+
+
+def split(value):
+    if not value:
+        return []
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def expand(kind, names):
+    """
+    Replace profile names with their fields, returns None for "all"
+    """
+    selected = set()
+    for name in names:
+        if name == "all":
+            return None
+        selected.update(PROFILES.get(kind, {}).get(name, [name]))
+    selected.add("id")
+    return selected
+
+
+def get_fields(kind, args):
+    """
+    Read the fields/include query params of a request
+
+    Args:
+        kind: control, subcontrol, evidence or policy
+        args: request.args
+
+    Returns:
+        set of field names, or None when every field is requested
+    """
+    fields = split(args.get("fields"))
+    if not fields:
+        return None
+    return expand(kind, fields + split(args.get("include")))
+
+
+def nested_fields(fields, name, kind):
+    """
+    Fields of a nested resource, e.g. nested_fields(fields, "subcontrols", "subcontrol")
+    for "subcontrols.id,subcontrols.name"
+    """
+    if fields is None:
+        return None
+    prefix = f"{name}."
+    names = [field[len(prefix) :] for field in fields if field.startswith(prefix)]
+    if not names:
+        return None
+    return expand(kind, names)
+
+
+def wants(fields, name):
+    return fields is None or name in fields
+
+
+def select(fields, values):
+    """
+    Evaluate only the requested entries of a {name: callable} map
+    """
+    return {name: value() for name, value in values.items() if wants(fields, name)}
@@ -1,12 +1,18 @@
 from flask import current_app
+import hashlib
+import base64
 import os
-import boto3
-from google.cloud import storage
 from botocore.exceptions import NoCredentialsError, ClientError
 import shutil
 import glob
 from datetime import timedelta
 from app.utils.exceptions import FileDoesNotExist
+from app.utils.storage_clients import storage_clients
+from app.utils import multipart
+
+
+# size of the chunks of a streamed read
+CHUNK_SIZE = 1024 * 1024
 
 
 class FileStorageHandler:
@@ -72,21 +78,17 @@ class FileStorageHandler:
                 "AWS_REGION is not configured, boto3 will try to use ADC"
             )
 
-        if access_key and secret_key:
-            self.s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                region_name=region_name,
-            )
-        else:
-            self.s3_client = boto3.client("s3", region_name=region_name)
+        if not (access_key and secret_key):
+            access_key = secret_key = None
+        self.s3_client = storage_clients.s3(
+            self.s3_bucket_name, access_key, secret_key, region_name
+        )
 
     def _initialize_gcs(self, gcs_bucket_name):
         self.gcs_bucket_name = gcs_bucket_name or current_app.config.get("GCS_BUCKET")
         if not self.gcs_bucket_name:
             raise ValueError("gcs_bucket_name is required for GCS storage")
-        self.gcs_client = storage.Client()
+        self.gcs_client = storage_clients.gcs(self.gcs_bucket_name)
 
     def _check_provider(self, required_provider):
         if self.provider != required_provider:
@@ -94,6 +96,20 @@ class FileStorageHandler:
                 f"This instance is not configured for {required_provider} storage"
             )
 
+    def get_multipart_options(self):
+        config = current_app.config
+        return {
+            "part_size": int(config.get("STORAGE_PART_SIZE") or multipart.DEFAULT_PART_SIZE),
+            "workers": int(config.get("STORAGE_UPLOAD_WORKERS") or multipart.DEFAULT_WORKERS),
+            "attempts": int(config.get("STORAGE_UPLOAD_ATTEMPTS") or multipart.DEFAULT_ATTEMPTS),
+        }
+
+    def use_multipart(self, path):
+        """
+        Files larger than a part are uploaded in parallel parts
+        """
+        return os.path.getsize(path) > self.get_multipart_options()["part_size"]
+
     # Generic Methods
     def upload_file(self, file, file_name=None, folder=None, abs_path=None):
         """
@@ -137,6 +153,34 @@ class FileStorageHandler:
         elif self.provider == "gcs":
             return self.get_gcs_file(path=path, as_blob=as_blob)
 
+    def stream_file(self, path, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """
+        Read a file as an iterator of chunks instead of loading it in memory
+
+        Parameters:
+            path (str): path of the file
+            start (int): first byte
+            end (int): last byte (inclusive), None reads to the end of the file
+            chunk_size (int): maximum size of the chunks
+
+        Returns:
+            iterator of bytes
+        """
+        if self.provider == "local":
+            return self.stream_local_file(path, start, end, chunk_size)
+        elif self.provider == "s3":
+            return self.stream_s3_file(path, start, end, chunk_size)
+        elif self.provider == "gcs":
+            return self.stream_gcs_file(path, start, end, chunk_size)
+
+    def get_file_size(self, path):
+        if self.provider == "local":
+            return self.get_local_file_size(path)
+        elif self.provider == "s3":
+            return self.get_s3_file_size(path)
+        elif self.provider == "gcs":
+            return self.get_gcs_file_size(path)
+
     def delete_file(self, path):
         if self.provider == "local":
             return self.delete_local_file(path=path)
@@ -145,9 +189,13 @@ class FileStorageHandler:
         elif self.provider == "gcs":
             return self.delete_gcs_file(path=path)
 
-    def get_size(self, folder):
+    def get_size(self, folder, recursive=False):
+        """
+        Size of the files in a folder. S3 and GCS always include the sub
+        folders (prefix listing)
+        """
         if self.provider == "local":
-            return self.get_local_size(folder=folder)
+            return self.get_local_size(folder=folder, recursive=recursive)
         elif self.provider == "s3":
             return self.get_s3_size(folder=folder)
         elif self.provider == "gcs":
@@ -182,11 +230,17 @@ class FileStorageHandler:
             return True
         return False
 
-    def get_local_size(self, folder):
+    def get_local_size(self, folder, recursive=False):
         """
-        Does not calculate sub folders
+        Does not calculate sub folders unless recursive
         """
         folder = folder.rstrip(os.sep)
+        if recursive:
+            return sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, names in os.walk(folder)
+                for name in names
+            )
         return sum(
             os.path.getsize(f) for f in glob.glob(f"{folder}/*") if os.path.isfile(f)
         )
@@ -226,7 +280,56 @@ class FileStorageHandler:
         return self.s3_client.delete_object(Bucket=self.s3_bucket_name, Key=path)
 
     def delete_gcs_file(self, path):
-        raise ValueError("Not Implemented")
+        self._check_provider("gcs")
+        return self.gcs_client.bucket(self.gcs_bucket_name).blob(path).delete()
+
+    def move_file(self, source, destination):
+        """
+        Move a stored file inside the provider, without downloading it
+        """
+        if self.provider == "local":
+            source = self.get_local_path(source)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(source, destination)
+        elif self.provider == "s3":
+            # managed copy, in parts for files larger than 5 GB
+            self.s3_client.copy(
+                {"Bucket": self.s3_bucket_name, "Key": source},
+                self.s3_bucket_name,
+                destination,
+            )
+            self.s3_client.delete_object(Bucket=self.s3_bucket_name, Key=source)
+        elif self.provider == "gcs":
+            bucket = self.gcs_client.bucket(self.gcs_bucket_name)
+            source_blob = bucket.blob(source)
+            token, _, _ = bucket.blob(destination).rewrite(source_blob)
+            while token:
+                token, _, _ = bucket.blob(destination).rewrite(source_blob, token=token)
+            source_blob.delete()
+        return destination
+
+    def get_file_sha256(self, path):
+        """
+        SHA-256 of a stored file, read from the checksum stored by S3 when
+        there is one, otherwise computed from the content
+        """
+        if self.provider == "s3":
+            try:
+                head = self.s3_client.head_object(
+                    Bucket=self.s3_bucket_name, Key=path, ChecksumMode="ENABLED"
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "404":
+                    raise FileDoesNotExist(f"File:{path} does not exist in S3")
+                raise
+            checksum = head.get("ChecksumSHA256")
+            # checksums of multipart uploads are checksums of the parts
+            if checksum and "-" not in checksum:
+                return base64.b64decode(checksum).hex()
+        digest = hashlib.sha256()
+        for chunk in self.stream_file(path):
+            digest.update(chunk)
+        return digest.hexdigest()
 
     # Local Storage Methods
     def upload_to_local(self, file, file_name=None, folder=None, abs_path=None):
@@ -254,6 +357,36 @@ class FileStorageHandler:
             raise ValueError(f"Path is required: {path}")
         return os.listdir(path)
 
+    def get_local_path(self, path):
+        if not path.startswith(current_app.config["EVIDENCE_FOLDER"]):
+            path = os.path.join(current_app.config["EVIDENCE_FOLDER"], path)
+        if not os.path.isfile(path):
+            raise FileDoesNotExist(f"File:{path} does not exist in local")
+        return path
+
+    def get_local_file_size(self, path):
+        self._check_provider("local")
+        return os.path.getsize(self.get_local_path(path))
+
+    def stream_local_file(self, path, start=0, end=None, chunk_size=CHUNK_SIZE):
+        self._check_provider("local")
+        path = self.get_local_path(path)
+
+        def generate():
+            with open(path, "rb") as file:
+                file.seek(start)
+                remaining = None if end is None else end - start + 1
+                while remaining is None or remaining > 0:
+                    size = chunk_size if remaining is None else min(chunk_size, remaining)
+                    chunk = file.read(size)
+                    if not chunk:
+                        return
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+
+        return generate()
+
     def get_local_file(self, path, as_blob=False):
         self._check_provider("local")
 
@@ -285,9 +418,18 @@ class FileStorageHandler:
 
         try:
             if isinstance(file, str):
-                if not os.path.isfile(abs_path):
-                    raise ValueError(f"File not found:{abs_path}")
-                self.s3_client.upload_file(file, self.s3_bucket_name, abs_path)
+                if not os.path.isfile(file):
+                    raise ValueError(f"File not found:{file}")
+                if self.use_multipart(file):
+                    multipart.upload_s3(
+                        self.s3_client,
+                        self.s3_bucket_name,
+                        abs_path,
+                        file,
+                        **self.get_multipart_options(),
+                    )
+                else:
+                    self.s3_client.upload_file(file, self.s3_bucket_name, abs_path)
             else:
                 self.s3_client.upload_fileobj(file, self.s3_bucket_name, abs_path)
             current_app.logger.debug(
@@ -300,6 +442,9 @@ class FileStorageHandler:
         except NoCredentialsError:
             current_app.logger.error("AWS credentials not available.")
             return False
+        except multipart.UploadError as e:
+            current_app.logger.error(f"An error occurred: {e}")
+            return False
         except ClientError as e:
             current_app.logger.error(f"An error occurred: {e}")
             return False
@@ -327,6 +472,36 @@ class FileStorageHandler:
 
         return self.s3_client.head_object(Bucket=self.s3_bucket_name, Key=path)
 
+    def get_s3_file_size(self, path):
+        self._check_provider("s3")
+        try:
+            head = self.s3_client.head_object(Bucket=self.s3_bucket_name, Key=path)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "404":
+                raise FileDoesNotExist(f"File:{path} does not exist in S3")
+            raise
+        return head["ContentLength"]
+
+    def stream_s3_file(self, path, start=0, end=None, chunk_size=CHUNK_SIZE):
+        self._check_provider("s3")
+        params = {"Bucket": self.s3_bucket_name, "Key": path}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            body = self.s3_client.get_object(**params)["Body"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                raise FileDoesNotExist(f"File:{path} does not exist in S3")
+            raise
+
+        def generate():
+            try:
+                yield from body.iter_chunks(chunk_size)
+            finally:
+                body.close()
+
+        return generate()
+
     def list_s3_files(self, path=""):
         self._check_provider("s3")
 
@@ -388,7 +563,12 @@ class FileStorageHandler:
         if isinstance(file, str):
             if not os.path.isfile(file):
                 raise ValueError(f"File not found: {file}")
-            blob.upload_from_filename(file)
+            if self.use_multipart(file):
+                options = self.get_multipart_options()
+                options.pop("attempts")
+                multipart.upload_gcs(blob, file, **options)
+            else:
+                blob.upload_from_filename(file, checksum="md5")
         else:
             blob.upload_from_file(file)
 
@@ -420,3 +600,34 @@ class FileStorageHandler:
         elif as_presign:
             return blob.generate_signed_url(expiration=timedelta(minutes=60))
         return blob
+
+    def get_gcs_file_size(self, path):
+        self._check_provider("gcs")
+        blob = self.gcs_client.bucket(self.gcs_bucket_name).get_blob(path)
+        if blob is None:
+            raise FileDoesNotExist(f"File:{path} does not exist in GCS")
+        return blob.size
+
+    def stream_gcs_file(self, path, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """
+        One ranged request per chunk, all of the same generation: a file
+        replaced while it is sent fails instead of mixing both contents
+        """
+        self._check_provider("gcs")
+        bucket = self.gcs_client.bucket(self.gcs_bucket_name)
+        if (current := bucket.get_blob(path)) is None:
+            raise FileDoesNotExist(f"File:{path} does not exist in GCS")
+        if end is None:
+            end = current.size - 1
+        blob = bucket.blob(path, generation=current.generation)
+
+        def generate():
+            position = start
+            while position <= end:
+                last = min(position + chunk_size - 1, end)
+                yield blob.download_as_bytes(
+                    client=self.gcs_client, start=position, end=last
+                )
+                position = last + 1
+
+        return generate()
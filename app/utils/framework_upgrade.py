@@ -0,0 +1,529 @@
+"""
+Upgrade of a base framework to a new version of its file
+
+The controls of the file are compared with the stored controls by
+abs_ref_code and only the difference is written: new controls are inserted,
+changed controls and subcontrols are updated in place (their ids, and so the
+projects using them, are kept) and controls that are no longer in the file
+are deleted. The upgrade covers the global catalog (see
+Framework.load_catalog), shared by every tenant, and the copies of the
+framework made for tenants before the catalog existed. Tenant overrides are
+customizations and are only reported
+
+Every stored control carries a fingerprint of its content (Control.fingerprint),
+so the comparison reads the ids and fingerprints of the framework and loads
+the full rows only for the controls that differ. Controls without a
+fingerprint (edited through the session or imported before it existed) are
+compared in full once and get their fingerprint back
+
+Controls and subcontrols removed from the file that are still used by a
+project are kept and reported as retained
+
+    upgrade = FrameworkUpgrade("soc2", catalog.get_controls("soc2"))
+    report = upgrade.run(dry_run=True)
+"""
+from flask import current_app
+from sqlalchemy import func, or_, and_
+from app.utils import bulk
+from app.utils.mappings import control_key, abs_ref_code_key
+from app.utils.cache import summary_cache
+from collections import Counter
+from datetime import datetime
+import json
+
+
+def same_value(first, second):
+    return json.dumps(first, sort_keys=True, default=str) == json.dumps(
+        second, sort_keys=True, default=str
+    )
+
+
+def subcontrol_keys(subcontrols):
+    """
+    Key the subcontrols of a control by ref_code, the n-th subcontrol with
+    the same ref_code gets the key (ref_code, n)
+    """
+    seen = Counter()
+    keyed = {}
+    for sub in subcontrols:
+        ref_code = str(sub.get("ref_code") or "").lower()
+        keyed[(ref_code, seen[ref_code])] = sub
+        seen[ref_code] += 1
+    return keyed
+
+
+class FrameworkUpgrade:
+    def __init__(self, name, controls, propagate=False, batch_size=bulk.DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            name: name of the framework
+            controls: controls of the new version, in the import format
+            propagate: add the new subcontrols of existing controls to the
+                projects that use the controls
+        """
+        self.name = name.lower()
+        self.controls = controls
+        self.propagate = propagate
+        self.batch_size = batch_size
+        self.models = current_app.models
+        self.db = current_app.db
+        self.new = self.index_controls()
+
+    def index_controls(self):
+        Control = self.models["Control"]
+        SubControl = self.models["SubControl"]
+        index = {}
+        for control in self.controls:
+            row = bulk.with_defaults(
+                Control, Control.control_values(control, self.name, None)
+            )
+            subcontrols = [
+                bulk.with_defaults(SubControl, sub)
+                for sub in Control.subcontrol_values(control)
+            ]
+            index[control_key(self.name, control.get("ref_code"))] = {
+                "control": control,
+                "row": row,
+                "subcontrols": subcontrols,
+                "hash": Control.fingerprint(row, subcontrols),
+            }
+        return index
+
+    def get_targets(self):
+        """
+        The catalog framework and the tenant copies that hold their own
+        controls (tenant frameworks linked to the catalog are not copies)
+        """
+        Framework = self.models["Framework"]
+        Control = self.models["Control"]
+        has_controls = (
+            self.db.session.query(Control.id)
+            .filter(Control.framework_id == Framework.id)
+            .exists()
+        )
+        return (
+            Framework.query.filter(func.lower(Framework.name) == self.name)
+            .filter(
+                or_(
+                    Framework.tenant_id == None,
+                    and_(Framework.base_id == None, has_controls),
+                )
+            )
+            .order_by(Framework.tenant_id.isnot(None), Framework.date_added)
+            .all()
+        )
+
+    def diff(self, framework):
+        """
+        Returns:
+            plan of the changes of a framework
+        """
+        Control = self.models["Control"]
+        SubControl = self.models["SubControl"]
+        session = self.db.session
+        stored = {
+            abs_ref_code_key(abs_ref_code): (control_id, content_hash)
+            for control_id, abs_ref_code, content_hash in session.query(
+                Control.id, Control.abs_ref_code, Control.content_hash
+            ).filter(Control.framework_id == framework.id)
+            if abs_ref_code
+        }
+        plan = {
+            "framework": framework,
+            "added": [key for key in self.new if key not in stored],
+            "removed": {
+                key: control_id
+                for key, (control_id, _) in stored.items()
+                if key not in self.new
+            },
+            "changed": [],
+            "unchanged": [],
+        }
+        candidates = [
+            (control_id, key)
+            for key, (control_id, content_hash) in stored.items()
+            if key in self.new and content_hash != self.new[key]["hash"]
+        ]
+        control_table = Control.__table__
+        subcontrol_table = SubControl.__table__
+        for start in range(0, len(candidates), self.batch_size):
+            batch = dict(candidates[start : start + self.batch_size])
+            rows = {
+                row["id"]: dict(row)
+                for row in session.execute(
+                    control_table.select().where(control_table.c.id.in_(list(batch)))
+                )
+            }
+            subcontrols = {}
+            for row in session.execute(
+                subcontrol_table.select()
+                .where(subcontrol_table.c.control_id.in_(list(batch)))
+                .order_by(subcontrol_table.c.date_added, subcontrol_table.c.id)
+            ):
+                subcontrols.setdefault(row["control_id"], []).append(dict(row))
+            for control_id, key in batch.items():
+                new = self.new[key]
+                stored_subcontrols = subcontrols.get(control_id, [])
+                if (
+                    Control.fingerprint(rows[control_id], stored_subcontrols)
+                    == new["hash"]
+                ):
+                    plan["unchanged"].append(
+                        {"id": control_id, "content_hash": new["hash"]}
+                    )
+                    continue
+                plan["changed"].append(
+                    self.compare(control_id, key, rows[control_id], stored_subcontrols)
+                )
+        return plan
+
+    def compare(self, control_id, key, row, stored_subcontrols):
+        Control = self.models["Control"]
+        new = self.new[key]
+        stored = subcontrol_keys(stored_subcontrols)
+        incoming = subcontrol_keys(new["subcontrols"])
+        return {
+            "id": control_id,
+            "key": key,
+            "fields": [
+                column
+                for column in Control.CONTENT_COLUMNS
+                if not same_value(row.get(column), new["row"].get(column))
+            ],
+            "added": [sub for sub_key, sub in incoming.items() if sub_key not in stored],
+            "changed": [
+                (stored[sub_key]["id"], sub)
+                for sub_key, sub in incoming.items()
+                if sub_key in stored
+                and not all(
+                    same_value(stored[sub_key].get(column), sub.get(column))
+                    for column in Control.SUBCONTROL_CONTENT_COLUMNS
+                )
+            ],
+            "removed": [
+                sub["id"] for sub_key, sub in stored.items() if sub_key not in incoming
+            ],
+        }
+
+    def used_ids(self, model, column, ids):
+        used = set()
+        ids = list(ids)
+        for start in range(0, len(ids), self.batch_size):
+            used.update(
+                value
+                for (value,) in self.db.session.query(column)
+                .filter(column.in_(ids[start : start + self.batch_size]))
+                .distinct()
+            )
+        return used
+
+    def get_overrides(self, framework, keys):
+        """
+        Tenant overrides of the catalog controls that change, by tenant
+        """
+        if framework.tenant_id is not None or not keys:
+            return {}
+        Control = self.models["Control"]
+        Framework = self.models["Framework"]
+        keys = set(keys)
+        overrides = {}
+        # the overrides are few, their keys are normalized here
+        for tenant_id, ref_code, abs_ref_code in (
+            self.db.session.query(Control.tenant_id, Control.ref_code, Control.abs_ref_code)
+            .join(Framework, Framework.id == Control.framework_id)
+            .filter(Framework.base_id == framework.id)
+        ):
+            if abs_ref_code and abs_ref_code_key(abs_ref_code) in keys:
+                overrides.setdefault(tenant_id, []).append(ref_code)
+        return overrides
+
+    def ref_code(self, key):
+        if key in self.new:
+            return self.new[key]["row"]["ref_code"]
+        return key.partition("__")[2]
+
+    def report(self, plan):
+        ProjectControl = self.models["ProjectControl"]
+        ProjectSubControl = self.models["ProjectSubControl"]
+        framework = plan["framework"]
+        used_controls = self.used_ids(
+            ProjectControl, ProjectControl.control_id, plan["removed"].values()
+        )
+        used_subcontrols = self.used_ids(
+            ProjectSubControl,
+            ProjectSubControl.subcontrol_id,
+            [sub_id for change in plan["changed"] for sub_id in change["removed"]],
+        )
+        plan["used_controls"] = used_controls
+        plan["used_subcontrols"] = used_subcontrols
+        return {
+            "framework_id": framework.id,
+            "tenant_id": framework.tenant_id,
+            "added": [self.ref_code(key) for key in plan["added"]],
+            "removed": [
+                self.ref_code(key)
+                for key, control_id in plan["removed"].items()
+                if control_id not in used_controls
+            ],
+            "retained": [
+                self.ref_code(key)
+                for key, control_id in plan["removed"].items()
+                if control_id in used_controls
+            ],
+            "changed": [
+                {
+                    "ref_code": self.ref_code(change["key"]),
+                    "fields": change["fields"],
+                    "subcontrols": {
+                        "added": len(change["added"]),
+                        "changed": len(change["changed"]),
+                        "removed": len(
+                            [i for i in change["removed"] if i not in used_subcontrols]
+                        ),
+                        "retained": len(
+                            [i for i in change["removed"] if i in used_subcontrols]
+                        ),
+                    },
+                }
+                for change in plan["changed"]
+            ],
+            "unchanged": len(self.new) - len(plan["added"]) - len(plan["changed"]),
+            "overrides": self.get_overrides(
+                framework,
+                [change["key"] for change in plan["changed"]] + list(plan["removed"]),
+            ),
+        }
+
+    def apply(self, plan):
+        """
+        Write the changes of a framework, does not commit
+
+        Returns:
+            number of project subcontrols added to projects
+        """
+        models = self.models
+        Control = models["Control"]
+        SubControl = models["SubControl"]
+        ControlMapping = models["ControlMapping"]
+        PolicyAssociation = models["PolicyAssociation"]
+        framework = plan["framework"]
+        tenant_id = framework.tenant_id
+        now = datetime.utcnow()
+
+        if plan["added"]:
+            Control.insert_batch(
+                [self.new[key]["control"] for key in plan["added"]],
+                framework,
+                tenant_id,
+                batch_size=self.batch_size,
+            )
+
+        control_rows = []
+        subcontrol_updates = []
+        subcontrol_rows = []
+        removed_subcontrols = []
+        remapped = []
+        for change in plan["changed"]:
+            new = self.new[change["key"]]
+            retained = any(
+                sub_id in plan["used_subcontrols"] for sub_id in change["removed"]
+            )
+            control_rows.append(
+                {
+                    "id": change["id"],
+                    **{column: new["row"][column] for column in Control.CONTENT_COLUMNS},
+                    # retained subcontrols keep the control different from the file
+                    "content_hash": None if retained else new["hash"],
+                    "date_updated": now,
+                }
+            )
+            for sub_id, sub in change["changed"]:
+                subcontrol_updates.append(
+                    {
+                        "id": sub_id,
+                        **{
+                            column: sub.get(column)
+                            for column in Control.SUBCONTROL_CONTENT_COLUMNS
+                        },
+                        "date_updated": now,
+                    }
+                )
+            for sub in change["added"]:
+                subcontrol_rows.append(
+                    bulk.with_defaults(
+                        SubControl,
+                        {
+                            **{
+                                column: sub.get(column)
+                                for column in Control.SUBCONTROL_CONTENT_COLUMNS
+                            },
+                            "control_id": change["id"],
+                        },
+                    )
+                )
+            removed_subcontrols.extend(
+                sub_id
+                for sub_id in change["removed"]
+                if sub_id not in plan["used_subcontrols"]
+            )
+            if "mapping" in change["fields"]:
+                remapped.append(change["key"])
+
+        project_ids = self.get_projects(
+            [change["id"] for change in plan["changed"]] + list(plan["removed"].values()),
+            [row["id"] for row in subcontrol_updates],
+        )
+        bulk.update_rows(Control, control_rows, self.batch_size)
+        bulk.update_rows(SubControl, subcontrol_updates, self.batch_size)
+        bulk.insert_rows(SubControl, subcontrol_rows, self.batch_size)
+        bulk.update_rows(Control, plan["unchanged"], self.batch_size)
+        self.delete(SubControl, SubControl.id, removed_subcontrols)
+
+        removed_controls = [
+            control_id
+            for control_id in plan["removed"].values()
+            if control_id not in plan["used_controls"]
+        ]
+        self.delete(SubControl, SubControl.control_id, removed_controls)
+        self.delete(PolicyAssociation, PolicyAssociation.control_id, removed_controls)
+        self.delete(Control, Control.id, removed_controls)
+
+        # the edges of changed mappings and removed controls are rebuilt
+        stale_keys = remapped + [
+            key
+            for key, control_id in plan["removed"].items()
+            if control_id not in plan["used_controls"]
+        ]
+        for start in range(0, len(stale_keys), self.batch_size):
+            ControlMapping.query.filter(
+                ControlMapping.source_key.in_(stale_keys[start : start + self.batch_size]),
+                ControlMapping.tenant_id == tenant_id,
+            ).delete(synchronize_session=False)
+        ControlMapping.add_from_controls(
+            [self.new[key]["control"] for key in remapped], framework.name, tenant_id
+        )
+
+        propagated = 0
+        if self.propagate and subcontrol_rows:
+            propagated = self.add_to_projects(subcontrol_rows)
+
+        # the rows bypass the session, so the flush listeners do not see them
+        session = self.db.session()
+        project_ids = list(project_ids)
+        for start in range(0, len(project_ids), self.batch_size):
+            models["Project"].bump_revision(project_ids[start : start + self.batch_size])
+        for project_id in project_ids:
+            summary_cache.mark(session, project_id)
+        return propagated
+
+    def get_projects(self, control_ids, subcontrol_ids):
+        """
+        Projects that use the given controls or subcontrols
+        """
+        ProjectControl = self.models["ProjectControl"]
+        ProjectSubControl = self.models["ProjectSubControl"]
+        project_ids = set()
+        for model, column, ids in (
+            (ProjectControl, ProjectControl.control_id, control_ids),
+            (ProjectSubControl, ProjectSubControl.subcontrol_id, subcontrol_ids),
+        ):
+            for start in range(0, len(ids), self.batch_size):
+                project_ids.update(
+                    project_id
+                    for (project_id,) in self.db.session.query(model.project_id)
+                    .filter(column.in_(ids[start : start + self.batch_size]))
+                    .distinct()
+                )
+        return project_ids
+
+    def delete(self, model, column, ids):
+        for start in range(0, len(ids), self.batch_size):
+            model.query.filter(column.in_(ids[start : start + self.batch_size])).delete(
+                synchronize_session=False
+            )
+
+    def add_to_projects(self, subcontrol_rows):
+        """
+        Add new subcontrols to the project controls of their control, the
+        revision of the projects is bumped by apply
+        """
+        models = self.models
+        Project = models["Project"]
+        ProjectControl = models["ProjectControl"]
+        ProjectSubControl = models["ProjectSubControl"]
+        ProjectProgress = models["ProjectProgress"]
+        AuditorFeedback = models["AuditorFeedback"]
+        session = self.db.session
+        by_control = {}
+        for row in subcontrol_rows:
+            by_control.setdefault(row["control_id"], []).append(row)
+
+        project_subcontrols = []
+        feedback = []
+        project_controls = {}
+        control_ids = list(by_control)
+        for start in range(0, len(control_ids), self.batch_size):
+            query = (
+                session.query(
+                    ProjectControl.id,
+                    ProjectControl.control_id,
+                    ProjectControl.project_id,
+                    Project.owner_id,
+                )
+                .join(Project, Project.id == ProjectControl.project_id)
+                .filter(
+                    ProjectControl.control_id.in_(
+                        control_ids[start : start + self.batch_size]
+                    )
+                )
+            )
+            for project_control_id, control_id, project_id, owner_id in query:
+                project_controls.setdefault(project_id, []).append(project_control_id)
+                for sub in by_control[control_id]:
+                    row = bulk.with_defaults(
+                        ProjectSubControl,
+                        {
+                            "subcontrol_id": sub["id"],
+                            "project_control_id": project_control_id,
+                            "project_id": project_id,
+                        },
+                    )
+                    project_subcontrols.append(row)
+                    for task in sub["tasks"] if isinstance(sub["tasks"], list) else []:
+                        feedback.append(
+                            bulk.with_defaults(
+                                AuditorFeedback,
+                                {
+                                    "title": task.get("title"),
+                                    "description": task.get("description"),
+                                    "owner_id": owner_id,
+                                    "control_id": project_control_id,
+                                    "relates_to": row["id"],
+                                },
+                            )
+                        )
+        bulk.insert_rows(ProjectSubControl, project_subcontrols, self.batch_size)
+        bulk.insert_rows(AuditorFeedback, feedback, self.batch_size)
+        for project_id, project_control_ids in project_controls.items():
+            ProjectProgress.refresh(project_id, project_control_ids)
+        return len(project_subcontrols)
+
+    def run(self, dry_run=False):
+        """
+        Returns:
+            report of the changes of every framework, the changes are only
+            computed with dry_run
+        """
+        timer = bulk.ImportTimer(self.name)
+        frameworks = []
+        for framework in self.get_targets():
+            plan = self.diff(framework)
+            report = self.report(plan)
+            if not dry_run:
+                report["propagated"] = self.apply(plan)
+                self.db.session.commit()
+            frameworks.append(report)
+            timer.add(
+                len(plan["added"]) + len(plan["changed"]) + len(plan["removed"])
+            )
+        return timer.report(dry_run=dry_run, frameworks=frameworks)
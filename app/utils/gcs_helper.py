@@ -1,5 +1,5 @@
 from flask import current_app
-from google.cloud import storage
+from app.utils.storage_clients import storage_clients
 import os
 
 
@@ -13,14 +13,12 @@ class GCS:
         if not self.bucket_name:
             raise ValueError("GCS_BUCKET is not set")
 
-        # use svc account creds
-        if credentials_path or current_app.config["GOOGLE_APPLICATION_CREDENTIALS"]:
-            self.client = storage.Client.from_service_account_json(
-                credentials_path or current_app.config["GOOGLE_APPLICATION_CREDENTIALS"]
-            )
-        else:
-            # use ADC
-            self.client = storage.Client()
+        # svc account creds, ADC when not set
+        self.client = storage_clients.gcs(
+            self.bucket_name,
+            credentials_path=credentials_path
+            or current_app.config["GOOGLE_APPLICATION_CREDENTIALS"],
+        )
 
     def get_root_path(self, blob_name):
         if self.root_path and self.root_path not in blob_name:
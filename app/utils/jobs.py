@@ -0,0 +1,179 @@
+"""
+Background jobs with a persisted record (models.Job)
+
+Work that does not fit in a request (loading the base frameworks and
+policies of a tenant) is recorded as a Job and run by a small thread pool.
+The record carries the current step and the progress percentage and is
+returned by GET /jobs/<id>
+
+Jobs are idempotent by key: submitting a job while another job with the same
+key is queued or running returns the running job instead of starting a new
+one (Job.lock_key is unique, so this also holds across processes)
+
+    job = job_runner.submit(
+        "tenant_bootstrap",
+        key=f"tenant_bootstrap:{tenant.id}",
+        tenant_id=tenant.id,
+        params={"steps": ["frameworks", "policies"]},
+    )
+
+    JOB_WORKERS=0 runs the jobs inside the request that submits them
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import exc
+from app.utils.catalog import catalog
+import threading
+import logging
+import os
+
+
+def tenant_bootstrap(job, params):
+    """
+    Load the base frameworks and/or policies of a tenant
+
+    params = {"steps": ["frameworks", "policies"], "init_controls": False}
+    """
+    tenant = current_app.models["Tenant"].query.get(job.tenant_id)
+    if not tenant:
+        raise ValueError(f"Tenant not found:{job.tenant_id}")
+    steps = params.get("steps") or ["frameworks", "policies"]
+    names = catalog.framework_names() if "frameworks" in steps else []
+    total = len(names) + (1 if "policies" in steps else 0)
+    done = 0
+
+    def framework_done(name):
+        nonlocal done
+        done += 1
+        job.update(step=f"framework:{name}", progress=done * 100 / total)
+
+    result = {}
+    if "frameworks" in steps:
+        job.update(step="frameworks")
+        tenant.create_base_frameworks(
+            init_controls=params.get("init_controls", False), progress=framework_done
+        )
+        result["frameworks"] = len(names)
+    if "policies" in steps:
+        job.update(step="policies")
+        tenant.create_base_policies()
+        result["policies"] = len(catalog.policy_names())
+    return result
+
+
+def storage_reconcile(job, params):
+    """
+    Correct the storage ledger of a tenant against the storage provider
+    """
+    tenant = current_app.models["Tenant"].query.get(job.tenant_id)
+    if not tenant:
+        raise ValueError(f"Tenant not found:{job.tenant_id}")
+    job.update(step="reconcile")
+    return {"drift": current_app.models["StorageUsage"].reconcile(tenant)}
+
+
+HANDLERS = {
+    "tenant_bootstrap": tenant_bootstrap,
+    "storage_reconcile": storage_reconcile,
+}
+
+
+class JobRunner:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def submit(self, name, key, params=None, tenant_id=None, user_id=None):
+        """
+        Start a job, or return the active job with the same key
+        """
+        if name not in HANDLERS:
+            raise ValueError(f"Unknown job:{name}")
+        app = current_app._get_current_object()
+        Job = app.models["Job"]
+        db = app.db
+        if job := Job.find_active(key):
+            if not job.is_stale(int(app.config.get("JOB_STALE_SECONDS", 900))):
+                return job
+            job.fail("The job stopped reporting progress")
+        job = Job(
+            name=name,
+            key=key,
+            lock_key=key,
+            params=params or {},
+            tenant_id=tenant_id,
+            user_id=user_id,
+        )
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except exc.IntegrityError:
+            # submitted at the same time by another request
+            db.session.rollback()
+            if job := Job.find_active(key):
+                return job
+            raise
+
+        executor = self.get_executor(app)
+        if executor is None:
+            self.execute(job.id)
+        else:
+            executor.submit(self.run, app, job.id)
+        return job
+
+    def submit_detached(self, name, key, **kwargs):
+        """
+        Submit a job from a thread with its own session, for callers that
+        must not commit their session (see Tenant.submit_storage_reconcile)
+        """
+        app = current_app._get_current_object()
+
+        def submit():
+            with app.app_context():
+                try:
+                    self.submit(name, key, **kwargs)
+                except Exception as e:
+                    logging.error(f"Failed to submit the job:{key}. Error:{e}")
+                finally:
+                    app.db.session.remove()
+
+        threading.Thread(target=submit, name=f"submit-{name}", daemon=True).start()
+
+    def get_executor(self, app):
+        workers = int(app.config.get("JOB_WORKERS", 2))
+        if workers < 1:
+            return None
+        with self.lock:
+            # threads do not survive a fork, start a new pool in the child
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="jobs"
+                )
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, app, job_id):
+        with app.app_context():
+            try:
+                self.execute(job_id)
+            finally:
+                app.db.session.remove()
+
+    def execute(self, job_id):
+        Job = current_app.models["Job"]
+        db = current_app.db
+        job = Job.query.get(job_id)
+        job.start()
+        try:
+            result = HANDLERS[job.name](job, job.params or {})
+        except Exception as e:
+            error = getattr(e, "description", None) or str(e)
+            logging.error(f"Job:{job_id} ({job.name}) failed. Error:{error}")
+            db.session.rollback()
+            Job.query.get(job_id).fail(error)
+            return
+        job.finish(result)
+
+
+job_runner = JobRunner()
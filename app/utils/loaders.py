@@ -0,0 +1,234 @@
+"""
+Batch loaders that fetch an object graph in a fixed number of queries
+
+ProjectControl.as_dict walks a lot of dynamic relationships (subcontrols,
+evidence, feedback, comments, tags) and issues several queries for every
+subcontrol. The loaders below fetch the whole graph up front and attach the
+collections to the objects (see PrefetchMixin) so the regular as_dict methods
+build the same JSON without going back to the database. Many-to-one
+relationships (control, subcontrol, project, framework, users) are served from
+the session identity map once the rows are loaded
+"""
+from app import db
+from flask import current_app
+from app.utils.fields import wants, nested_fields
+
+
+class ProjectControlLoader:
+    """
+    Load the controls of a project with everything ProjectControl.as_dict needs
+
+    loader = ProjectControlLoader(project)
+    data = [control.as_dict() for control in loader.load()]
+
+    The number of queries does not depend on the number of controls. When
+    fields is given (see app.utils.fields) collections that are not needed
+    for those fields are not loaded
+    """
+
+    def __init__(self, project, fields=None):
+        self.project = project
+        self.fields = fields
+        self.models = current_app.models
+        # the identity map only holds weak references, keep the rows
+        # around so many-to-one lookups do not go back to the database
+        self.loaded = []
+
+    def load(self, query=None):
+        """
+        Args:
+            query: optional ProjectControl query (e.g. filtered or paginated) or
+                list of ProjectControl objects, defaults to all controls of the project
+
+        Returns:
+            list of ProjectControl objects with their collections prefetched
+        """
+        ProjectControl = self.models["ProjectControl"]
+        if query is None:
+            controls = self.project.controls.all()
+            control_query = db.session.query(ProjectControl.id).filter(
+                ProjectControl.project_id == self.project.id
+            )
+        else:
+            controls = query.all() if hasattr(query, "all") else list(query)
+            control_query = [control.id for control in controls]
+        if not controls:
+            return []
+
+        fields = self.fields
+        subcontrol_fields = nested_fields(fields, "subcontrols", "subcontrol")
+        evidence_fields = nested_fields(subcontrol_fields, "evidence", "evidence")
+        feedback, comments, tags = {}, {}, {}
+
+        self._load_parents(control_query)
+        subcontrols = self._load_subcontrols(
+            control_query,
+            evidence_controls=wants(fields, "subcontrols")
+            and wants(subcontrol_fields, "evidence")
+            and (
+                wants(evidence_fields, "controls")
+                or wants(evidence_fields, "control_count")
+            ),
+        )
+        if wants(fields, "feedback") or wants(fields, "stats"):
+            feedback = self._load_children(
+                self.models["AuditorFeedback"], control_query
+            )
+        if wants(fields, "comments"):
+            comments = self._load_children(self.models["ControlComment"], control_query)
+        if wants(fields, "tags"):
+            tags = self._load_tags(control_query)
+        self._load_users(subcontrols, feedback, comments)
+
+        for control in controls:
+            control.set_prefetched("subcontrols", subcontrols.get(control.id, []))
+            control.set_prefetched("feedback", feedback.get(control.id, []))
+            control.set_prefetched("comments", comments.get(control.id, []))
+            control.set_prefetched("tags", tags.get(control.id, []))
+            # ties the lifetime of the loaded rows to the returned controls
+            control.set_prefetched("loaded", self.loaded)
+        return controls
+
+    def _load_parents(self, control_query):
+        """
+        framework controls and frameworks, so control.control and
+        control.control.framework resolve from the identity map
+        """
+        Control = self.models["Control"]
+        Framework = self.models["Framework"]
+        ProjectControl = self.models["ProjectControl"]
+        parents = Control.query.filter(
+            Control.id.in_(
+                db.session.query(ProjectControl.control_id).filter(
+                    ProjectControl.id.in_(control_query)
+                )
+            )
+        ).all()
+        self.loaded.extend(parents)
+        framework_ids = {control.framework_id for control in parents}
+        if framework_ids:
+            self.loaded.extend(
+                Framework.query.filter(Framework.id.in_(framework_ids)).all()
+            )
+        return parents
+
+    def _load_subcontrols(self, control_query, evidence_controls=True):
+        ProjectSubControl = self.models["ProjectSubControl"]
+        SubControl = self.models["SubControl"]
+        EvidenceAssociation = self.models["EvidenceAssociation"]
+        ProjectEvidence = self.models["ProjectEvidence"]
+
+        subcontrol_query = db.session.query(ProjectSubControl.id).filter(
+            ProjectSubControl.project_control_id.in_(control_query)
+        )
+        subcontrols = (
+            ProjectSubControl.query.filter(
+                ProjectSubControl.project_control_id.in_(control_query)
+            )
+            .order_by(ProjectSubControl.date_added.desc())
+            .all()
+        )
+        self.loaded.extend(
+            SubControl.query.filter(
+                SubControl.id.in_(
+                    db.session.query(ProjectSubControl.subcontrol_id).filter(
+                        ProjectSubControl.project_control_id.in_(control_query)
+                    )
+                )
+            ).all()
+        )
+
+        evidence = {}
+        evidence_objects = {}
+        for subcontrol_id, record in (
+            db.session.query(EvidenceAssociation.control_id, ProjectEvidence)
+            .join(ProjectEvidence, ProjectEvidence.id == EvidenceAssociation.evidence_id)
+            .filter(EvidenceAssociation.control_id.in_(subcontrol_query))
+            .all()
+        ):
+            evidence.setdefault(subcontrol_id, []).append(record)
+            evidence_objects[record.id] = record
+        if evidence_controls:
+            self._load_evidence_controls(evidence_objects, subcontrol_query)
+
+        data = {}
+        for subcontrol in subcontrols:
+            subcontrol.set_prefetched("evidence", evidence.get(subcontrol.id, []))
+            data.setdefault(subcontrol.project_control_id, []).append(subcontrol)
+        return data
+
+    def _load_evidence_controls(self, evidence_objects, subcontrol_query):
+        """
+        control_count and controls of every evidence item (ProjectEvidence.as_dict)
+        """
+        if not evidence_objects:
+            return
+        ProjectSubControl = self.models["ProjectSubControl"]
+        SubControl = self.models["SubControl"]
+        EvidenceAssociation = self.models["EvidenceAssociation"]
+
+        counts = {}
+        controls = {}
+        for evidence_id, subcontrol_id, name in (
+            db.session.query(
+                EvidenceAssociation.evidence_id, ProjectSubControl.id, SubControl.name
+            )
+            .outerjoin(
+                ProjectSubControl, ProjectSubControl.id == EvidenceAssociation.control_id
+            )
+            .outerjoin(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .filter(
+                EvidenceAssociation.evidence_id.in_(
+                    db.session.query(EvidenceAssociation.evidence_id).filter(
+                        EvidenceAssociation.control_id.in_(subcontrol_query)
+                    )
+                )
+            )
+            .all()
+        ):
+            counts[evidence_id] = counts.get(evidence_id, 0) + 1
+            if subcontrol_id is None:
+                continue
+            records = controls.setdefault(evidence_id, {})
+            records.setdefault(subcontrol_id, {"id": subcontrol_id, "name": name})
+
+        for evidence_id, evidence in evidence_objects.items():
+            evidence.set_prefetched("control_count", counts.get(evidence_id, 0))
+            evidence.set_prefetched(
+                "controls", list(controls.get(evidence_id, {}).values())
+            )
+
+    def _load_children(self, model, control_query):
+        data = {}
+        for record in model.query.filter(model.control_id.in_(control_query)).all():
+            data.setdefault(record.control_id, []).append(record)
+        return data
+
+    def _load_tags(self, control_query):
+        ControlTags = self.models["ControlTags"]
+        Tag = self.models["Tag"]
+        data = {}
+        for control_id, tag in (
+            db.session.query(ControlTags.control_id, Tag)
+            .join(Tag, Tag.id == ControlTags.tag_id)
+            .filter(ControlTags.control_id.in_(control_query))
+            .all()
+        ):
+            data.setdefault(control_id, []).append(tag)
+        return data
+
+    def _load_users(self, subcontrols, feedback, comments):
+        """
+        owners, operators and authors, so User.query.get hits the identity map
+        """
+        User = self.models["User"]
+        user_ids = set()
+        for records in subcontrols.values():
+            for subcontrol in records:
+                user_ids.update([subcontrol.owner_id, subcontrol.operator_id])
+        for group in (feedback, comments):
+            for records in group.values():
+                user_ids.update(record.owner_id for record in records)
+        user_ids.discard(None)
+        if user_ids:
+            self.loaded.extend(User.query.filter(User.id.in_(user_ids)).all())
@@ -0,0 +1,71 @@
+"""
+Keys of the cross-framework control mappings (models.ControlMapping)
+
+Control.mapping holds the references of a control in other frameworks:
+
+    {"nist_csf": ["pr.ac-1", "pr.ac-3"], "cis_v8.0": ["12.7"]}
+
+Each reference becomes an edge between two keys in the abs_ref_code format
+("<framework>__<ref_code>", lower case). A key matches a control through its
+abs_ref_code or a subcontrol through "<framework>__<subcontrol ref_code>",
+so a reference may point at a whole control or a single subcontrol
+
+The names used in the mapping data do not always match the names of the
+frameworks in FRAMEWORK_FOLDER, ALIASES translates them. Unknown names are
+used as they are, so mappings between custom frameworks work by name
+"""
+
+
+"""
+mapping name -> (framework, prefix of the ref codes, "-" written as ".")
+"""
+ALIASES = {
+    "nist_csf": ("nist_csf_v1.1", "", True),
+    "cis_v8.0": ("cisv8", "", False),
+    "iso_27002:2022": ("iso_27001_2022", "a.", False),
+}
+
+
+def control_key(framework, ref_code):
+    # the stored ref codes may keep the spaces of the framework files
+    return f"{str(framework).strip()}__{str(ref_code).strip()}".lower()
+
+
+def abs_ref_code_key(abs_ref_code):
+    """
+    Key of a stored Control.abs_ref_code ("soc2__cc6.1  " -> "soc2__cc6.1")
+    """
+    framework, _, ref_code = abs_ref_code.partition("__")
+    return control_key(framework, ref_code)
+
+
+def mapping_key(name, ref_code):
+    framework, prefix, dots = ALIASES.get(name.lower(), (name, "", False))
+    ref_code = str(ref_code).strip().lower()
+    if dots:
+        ref_code = ref_code.replace("-", ".")
+    if prefix and not ref_code.startswith(prefix):
+        ref_code = f"{prefix}{ref_code}"
+    return control_key(framework, ref_code)
+
+
+def mapping_edges(source_key, mapping):
+    """
+    Returns:
+        set of (source_key, target_key) for the references of a control
+    """
+    edges = set()
+    if not isinstance(mapping, dict):
+        return edges
+    for name, ref_codes in mapping.items():
+        if isinstance(ref_codes, (str, int)):
+            ref_codes = [ref_codes]
+        if not isinstance(ref_codes, list):
+            continue
+        for ref_code in ref_codes:
+            if ref_code is None or not str(ref_code).strip():
+                continue
+            target_key = mapping_key(name, ref_code)
+            if target_key != source_key:
+                edges.add((source_key, target_key))
+    return edges
@@ -110,11 +110,10 @@ def project_creation(tenant, payload, user):
         filter_list = []
         for category in category_list:
             filter_list.append(models.Control.category == category)
-        controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
+        query = (
+            framework.query_controls()
+            .filter(or_(*filter_list))
             .filter(models.Control.is_custom == False)
-            .all()
         )
     elif fw_name == "cmmc":
         level_list = []
@@ -133,11 +132,7 @@ def project_creation(tenant, payload, user):
         filter_list = []
         for level in level_list:
             filter_list.append(models.Control.level == level)
-        controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
-            .all()
-        )
+        query = framework.query_controls().filter(or_(*filter_list))
     elif fw_name == "cmmc_v2":
         level_list = []
         if payload.get("level-1"):
@@ -151,18 +146,12 @@ def project_creation(tenant, payload, user):
         filter_list = []
         for level in level_list:
             filter_list.append(models.Control.level == level)
-        controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
-            .all()
-        )
+        query = framework.query_controls().filter(or_(*filter_list))
     else:
-        controls = (
-            models.Control.query.filter(models.Control.framework_id == framework.id)
-            .order_by(models.Control.id.asc())
-            .all()
-        )
+        query = framework.query_controls().order_by(models.Control.id.asc())
 
+    # only the ids are needed, the rows are copied with INSERTs (see Project.add_controls)
+    controls = [control_id for (control_id,) in query.with_entities(models.Control.id)]
     tenant.create_project(
         name, user.id, framework.id, description=description, controls=controls
     )
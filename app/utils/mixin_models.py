@@ -3,11 +3,32 @@ from flask import current_app
 from sqlalchemy.ext.declarative import declared_attr
 from functools import partial
 from app.utils.authorizer import Authorizer
+from app.utils.fields import wants, select, nested_fields
 from sqlalchemy import func
 import arrow
 
 
-class ControlMixin(object):
+class PrefetchMixin(object):
+    """
+    Lets a batch loader (see app.utils.loaders) attach collections that were
+    already loaded for many objects at once. Methods that would otherwise
+    query a dynamic relationship check get_prefetched first
+    """
+
+    def set_prefetched(self, name, value):
+        self.__dict__.setdefault("_prefetched", {})[name] = value
+
+    def get_prefetched(self, name, default=None):
+        return self.__dict__.get("_prefetched", {}).get(name, default)
+
+    def has_prefetched(self, name):
+        return name in self.__dict__.get("_prefetched", {})
+
+    def clear_prefetched(self):
+        self.__dict__.pop("_prefetched", None)
+
+
+class ControlMixin(PrefetchMixin):
     __table_args__ = {"extend_existing": True}
     """
     mixin model should only be attached to
@@ -18,7 +39,11 @@ class ControlMixin(object):
     def __tablename__(cls):
         return cls.__name__.lower()
 
-    def as_dict(self):
+    def as_dict(self, fields=None):
+        """
+        fields: optional set of field names (see app.utils.fields), fields that
+        are not requested are not computed
+        """
         parent_fields = [
             "name",
             "ref_code",
@@ -27,11 +52,16 @@ class ControlMixin(object):
             "subcategory",
             "is_custom",
         ]
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data = {
+            c.name: getattr(self, c.name)
+            for c in self.__table__.columns
+            if wants(fields, c.name)
+        }
         for field in parent_fields:
-            data[field] = getattr(self.control, field)
+            if wants(fields, field):
+                data[field] = getattr(self.control, field)
 
-        return {**self.generate_stats(), **data}
+        return {**self.generate_stats(fields=fields), **data}
 
     def review_complete(self):
         if self.review_status in ["complete"]:
@@ -49,7 +79,10 @@ class ControlMixin(object):
         return False
 
     def get_feedback(self, as_dict=False):
-        query = self.feedback.all()
+        if self.has_prefetched("feedback"):
+            query = self.get_prefetched("feedback")
+        else:
+            query = self.feedback.all()
         if as_dict:
             return [feedback.as_dict() for feedback in query]
         return query
@@ -61,88 +94,123 @@ class ControlMixin(object):
                 data.append(feedback)
         return data
 
-    def generate_stats(self, subcontrols=None):
-        if not subcontrols:
-            subcontrols = self.subcontrols.order_by(
-                current_app.models["ProjectSubControl"].date_added.desc()
-            ).all()
-        feedback = self.get_feedback()
-        data = {
-            "description": self.control.description,
-            "guidance": self.control.guidance,
-            "status": "not started",
-            "is_applicable": True,
-            "is_complete": False,
-            "review_complete": self.review_complete(),
-            "progress_completed": 0,
-            "progress_implemented": 0,
-            "progress_evidence": 0,
-            "feedback": self.get_feedback(as_dict=True),
-            "subcontrols": [],
-            "owners": [],
-            "tags": [{"id": tag.id, "name": tag.name} for tag in self.tags.all()],
-            "comments": self.get_comments(),
-            "stats": {
-                "feedback": len(feedback),
-                "complete_feedback": sum(1 for task in feedback if task.is_complete),
-                "evidence": 0,
-                "subcontrols": len(subcontrols),
-                "subcontrols_complete": 0,
-                "applicable_subcontrols": 0,
-                "inapplicable_subcontrols": 0,
-                "infosec_status": 0,
-                "auditor_status": 0,
-                "owners": 0,
+    def generate_stats(self, subcontrols=None, fields=None):
+        # fields that need the subcontrols to be walked
+        computed = [
+            "status",
+            "is_applicable",
+            "is_complete",
+            "progress_completed",
+            "progress_implemented",
+            "progress_evidence",
+            "implemented_status",
+            "subcontrols",
+            "owners",
+            "stats",
+        ]
+        data = select(
+            fields,
+            {
+                "description": lambda: self.control.description,
+                "guidance": lambda: self.control.guidance,
+                "review_complete": self.review_complete,
+                "tags": lambda: [
+                    {"id": tag.id, "name": tag.name} for tag in self.get_tags()
+                ],
+                "comments": self.get_comments,
             },
+        )
+        if wants(fields, "feedback") or wants(fields, "stats"):
+            feedback = self.get_feedback()
+            if wants(fields, "feedback"):
+                data["feedback"] = [task.as_dict() for task in feedback]
+        if not any(wants(fields, name) for name in computed):
+            return data
+
+        if not subcontrols:
+            if self.has_prefetched("subcontrols"):
+                subcontrols = self.get_prefetched("subcontrols")
+            else:
+                subcontrols = self.subcontrols.order_by(
+                    current_app.models["ProjectSubControl"].date_added.desc()
+                ).all()
+        subcontrol_fields = nested_fields(fields, "subcontrols", "subcontrol")
+        User = current_app.models["User"]
+        stats = {
+            "feedback": 0,
+            "complete_feedback": 0,
+            "evidence": 0,
+            "subcontrols": len(subcontrols),
+            "subcontrols_complete": 0,
+            "applicable_subcontrols": 0,
+            "inapplicable_subcontrols": 0,
+            "infosec_status": 0,
+            "auditor_status": 0,
+            "owners": 0,
         }
+        if wants(fields, "stats"):
+            stats["feedback"] = len(feedback)
+            stats["complete_feedback"] = sum(1 for task in feedback if task.is_complete)
+        data.update(
+            {
+                "status": "not started",
+                "is_applicable": True,
+                "is_complete": False,
+                "progress_completed": 0,
+                "progress_implemented": 0,
+                "progress_evidence": 0,
+                "subcontrols": [],
+                "owners": [],
+                "stats": stats,
+            }
+        )
 
         implemented = 0
         completed = 0
         evidence = 0
         for subcontrol in subcontrols:
-            sub = subcontrol.as_dict()
             if subcontrol.owner_id:
-                data["owners"].append(sub["owner"])
-                data["stats"]["owners"] += 1
+                if wants(fields, "owners"):
+                    data["owners"].append(User.query.get(subcontrol.owner_id).email)
+                stats["owners"] += 1
 
-            data["subcontrols"].append(sub)
+            if wants(fields, "subcontrols"):
+                data["subcontrols"].append(
+                    subcontrol.as_dict(fields=subcontrol_fields)
+                )
 
-            if not sub["is_applicable"]:
-                data["stats"]["inapplicable_subcontrols"] += 1
+            if not subcontrol.is_applicable:
+                stats["inapplicable_subcontrols"] += 1
                 continue
-            data["stats"]["applicable_subcontrols"] += 1
-            implemented += sub["implemented"]
-            completed += sub["progress_completed"]
-            if sub["has_evidence"]:
+            stats["applicable_subcontrols"] += 1
+            evidence_list = subcontrol.get_evidence()
+            implemented += subcontrol.implemented
+            completed += subcontrol.get_completion_progress()
+            if evidence_list:
                 evidence += 1
 
-            if sub["is_complete"]:
-                data["stats"]["subcontrols_complete"] += 1
+            if subcontrol.is_complete():
+                stats["subcontrols_complete"] += 1
 
-            data["stats"]["evidence"] += len(sub.get("evidence", []))
-            data["stats"]["infosec_status"] += sub.get("infosec_status", 0)
-            data["stats"]["auditor_status"] += sub.get("auditor_status", 0)
+            stats["evidence"] += len(evidence_list)
 
         if completed:
             data["progress_completed"] = round(
-                (completed / data["stats"]["applicable_subcontrols"]), 0
+                (completed / stats["applicable_subcontrols"]), 0
             )
         if implemented:
             data["progress_implemented"] = round(
-                (implemented / data["stats"]["applicable_subcontrols"]), 0
+                (implemented / stats["applicable_subcontrols"]), 0
             )
         if evidence:
             data["progress_evidence"] = round(
-                (evidence / data["stats"]["applicable_subcontrols"]) * 100, 0
+                (evidence / stats["applicable_subcontrols"]) * 100, 0
             )
 
-        if not data["stats"]["applicable_subcontrols"]:
+        if not stats["applicable_subcontrols"]:
             data["is_applicable"] = False
 
-        if (
-            data["stats"]["subcontrols_complete"]
-            == data["stats"]["applicable_subcontrols"]
-        ):
+        if stats["subcontrols_complete"] == stats["applicable_subcontrols"]:
             data["is_complete"] = True
 
         if not data["is_applicable"]:
@@ -158,11 +226,20 @@ class ControlMixin(object):
         elif data["progress_completed"] == 0:
             data["implemented_status"] = "not implemented"
 
-        return data
+        return {
+            name: value for name, value in data.items() if wants(fields, name)
+        }
 
     def get_comments(self):
+        if self.has_prefetched("comments"):
+            return [comment.as_dict() for comment in self.get_prefetched("comments")]
         return [comment.as_dict() for comment in self.comments.all()]
 
+    def get_tags(self):
+        if self.has_prefetched("tags"):
+            return self.get_prefetched("tags")
+        return self.tags.all()
+
     def get_subcontrols(self, only_applicable=False, as_query=False):
         _query = self.subcontrols
         if only_applicable:
@@ -179,6 +256,7 @@ class ControlMixin(object):
     def set_applicability(self, applicable):
         for subcontrol in self.subcontrols.all():
             subcontrol.is_applicable = applicable
+        current_app.models["ProjectProgress"].refresh(self.project_id, [self.id])
         db.session.commit()
         return True
 
@@ -284,7 +362,7 @@ class ControlMixin(object):
         return subcontrols
 
 
-class SubControlMixin(object):
+class SubControlMixin(PrefetchMixin):
     __table_args__ = {"extend_existing": True}
     """
     mixin model should only be attached to
@@ -295,38 +373,62 @@ class SubControlMixin(object):
     def __tablename__(cls):
         return cls.__name__.lower()
 
-    def as_dict(self, include_evidence=False):
+    def as_dict(self, include_evidence=False, fields=None):
+        """
+        fields: optional set of field names (see app.utils.fields), fields that
+        are not requested are not computed
+        """
         User = current_app.models["User"]
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["implementation_status"] = self.implementation_status()
-        data["completion_status"] = self.completion_description()
-        data["progress_completed"] = self.get_completion_progress()
-        data["is_complete"] = self.is_complete()
-        data["framework"] = self.framework().name
-        data["project"] = self.p_control.project.name
-        data["parent_control"] = self.p_control.control.name
-        data["name"] = self.subcontrol.name
-        data["description"] = self.subcontrol.description
-        data["mitigation"] = self.subcontrol.mitigation
-        data["ref_code"] = self.subcontrol.ref_code
-        data["evidence"] = self.evidence.count()
-
-        data["owner"] = (
-            User.query.get(self.owner_id).email if self.owner_id else "Missing Owner"
-        )
-        data["operator"] = (
-            User.query.get(self.operator_id).email
-            if self.operator_id
-            else "Missing Operator"
+        evidence_fields = nested_fields(fields, "evidence", "evidence")
+        data = {
+            c.name: getattr(self, c.name)
+            for c in self.__table__.columns
+            if wants(fields, c.name)
+        }
+        data.update(
+            select(
+                fields,
+                {
+                    "implementation_status": self.implementation_status,
+                    "completion_status": self.completion_description,
+                    "progress_completed": self.get_completion_progress,
+                    "is_complete": self.is_complete,
+                    "framework": lambda: self.framework().name,
+                    "project": lambda: self.p_control.project.name,
+                    "parent_control": lambda: self.p_control.control.name,
+                    "name": lambda: self.subcontrol.name,
+                    "description": lambda: self.subcontrol.description,
+                    "mitigation": lambda: self.subcontrol.mitigation,
+                    "ref_code": lambda: self.subcontrol.ref_code,
+                    "owner": lambda: (
+                        User.query.get(self.owner_id).email
+                        if self.owner_id
+                        else "Missing Owner"
+                    ),
+                    "operator": lambda: (
+                        User.query.get(self.operator_id).email
+                        if self.operator_id
+                        else "Missing Operator"
+                    ),
+                    "evidence": lambda: [
+                        evidence.as_dict(fields=evidence_fields)
+                        for evidence in self.get_evidence()
+                    ],
+                },
+            )
         )
-        data["evidence"] = self.get_evidence(as_dict=True)
-        data["has_evidence"] = False
-        if data["evidence"]:
-            data["has_evidence"] = True
+        if wants(fields, "has_evidence"):
+            if "evidence" in data:
+                data["has_evidence"] = bool(data["evidence"])
+            else:
+                data["has_evidence"] = self.has_evidence()
         return data
 
     def get_evidence(self, as_dict=False):
-        query = self.evidence.all()
+        if self.has_prefetched("evidence"):
+            query = self.get_prefetched("evidence")
+        else:
+            query = self.evidence.all()
         if as_dict:
             return [evidence.as_dict() for evidence in query]
         return query
@@ -387,6 +489,8 @@ class SubControlMixin(object):
 
     def has_evidence(self, id=None):
         if not id:
+            if self.has_prefetched("evidence"):
+                return bool(self.get_prefetched("evidence"))
             if self.evidence.first():
                 return True
             return False
@@ -402,6 +506,9 @@ class SubControlMixin(object):
         EvidenceAssociation.query.filter(
             EvidenceAssociation.control_id == self.id
         ).delete()
+        current_app.models["ProjectProgress"].refresh(
+            self.project_id, [self.project_control_id]
+        )
         db.session.commit()
         return True
 
@@ -414,6 +521,9 @@ class SubControlMixin(object):
         for id in evidence_id_list:
             if evidence := Evidence.query.get(id):
                 self.evidence.append(evidence)
+        current_app.models["ProjectProgress"].refresh(
+            self.project_id, [self.project_control_id]
+        )
         db.session.commit()
         return True
 
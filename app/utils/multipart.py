@@ -0,0 +1,155 @@
+"""
+Parallel multipart uploads of large files to S3 and GCS
+
+A file larger than STORAGE_PART_SIZE is sent in parts by a bounded pool of
+STORAGE_UPLOAD_WORKERS threads. Each part is read from the file by the
+thread that sends it, so an upload holds at most one part per worker in
+memory. Every part carries its MD5 (S3 Content-MD5, GCS XML multipart
+checksum) and the provider rejects a part that was corrupted on the way.
+A failed part is sent again, up to STORAGE_UPLOAD_ATTEMPTS times, without
+restarting the upload (GCS retries with DEFAULT_RETRY); when a part keeps
+failing the S3 upload is aborted so no orphaned parts are billed
+
+    upload_s3(client, bucket, key, "/tmp/upload", part_size=8 * MB, workers=4)
+    upload_gcs(bucket.blob(key), "/tmp/upload", part_size=8 * MB, workers=4)
+
+The files are uploaded from a path (see blobs.spool), the parts are read
+with positional reads
+"""
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.cloud.storage import transfer_manager
+import hashlib
+import logging
+import base64
+import time
+import os
+
+
+MB = 1024 * 1024
+DEFAULT_PART_SIZE = 8 * MB
+# smallest part accepted by S3 (except the last one)
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+DEFAULT_WORKERS = 4
+DEFAULT_ATTEMPTS = 3
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_part_size(size, part_size):
+    """
+    Returns:
+        part size of a file, doubled until the file fits in MAX_PARTS parts
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    while size > part_size * MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+def iter_parts(size, part_size):
+    """
+    Yields (part number starting at 1, offset, length)
+    """
+    for number, offset in enumerate(range(0, size, part_size), start=1):
+        yield number, offset, min(part_size, size - offset)
+
+
+def read_part(path, offset, length):
+    with open(path, "rb") as f:
+        return os.pread(f.fileno(), length, offset)
+
+
+def with_retries(function, attempts, description):
+    for attempt in range(1, attempts + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == attempts:
+                raise UploadError(f"{description} failed after {attempts} attempts: {e}")
+            logging.warning(f"{description} failed (attempt {attempt}), retrying. Error:{e}")
+            time.sleep(min(2 ** attempt, 10) / 10)
+
+
+def upload_s3(
+    client,
+    bucket,
+    key,
+    path,
+    part_size=DEFAULT_PART_SIZE,
+    workers=DEFAULT_WORKERS,
+    attempts=DEFAULT_ATTEMPTS,
+):
+    size = os.path.getsize(path)
+    part_size = get_part_size(size, part_size)
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def send(number, offset, length):
+        data = read_part(path, offset, length)
+        digest = hashlib.md5(data)
+        response = client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+            ContentMD5=base64.b64encode(digest.digest()).decode(),
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    with_retries,
+                    lambda part=part: send(*part),
+                    attempts,
+                    f"Part {part[0]} of {key}",
+                )
+                for part in iter_parts(size, part_size)
+            ]
+            try:
+                parts = [future.result() for future in futures]
+            except BaseException:
+                # parts that did not start are not sent
+                pool.shutdown(cancel_futures=True)
+                raise
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logging.warning(f"Failed to abort the upload of {key}. Error:{e}")
+        raise
+
+    stored = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if stored != size:
+        raise UploadError(f"Uploaded {stored} bytes of {size} to {key}")
+    return key
+
+
+def upload_gcs(blob, path, part_size=DEFAULT_PART_SIZE, workers=DEFAULT_WORKERS):
+    """
+    XML multipart upload, the parts of a GCS resumable upload can only be
+    sent one after the other. A failed part is retried with DEFAULT_RETRY
+    """
+    size = os.path.getsize(path)
+    transfer_manager.upload_chunks_concurrently(
+        path,
+        blob,
+        chunk_size=get_part_size(size, part_size),
+        worker_type=transfer_manager.THREAD,
+        max_workers=workers,
+        checksum="md5",
+        # the blobs are content addressed, sending a part again is safe
+        retry=DEFAULT_RETRY,
+    )
+    blob.reload()
+    if blob.size != size:
+        raise UploadError(f"Uploaded {blob.size} bytes of {size} to {blob.name}")
+    return blob.name
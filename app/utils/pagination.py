@@ -0,0 +1,66 @@
+"""
+Keyset (cursor) pagination
+
+The cursor is an opaque, url safe token holding the sort values of the last
+row of the previous page. The next page is fetched with a WHERE clause on
+those values instead of an OFFSET, so every page costs the same
+"""
+from flask import abort
+from sqlalchemy import or_, and_
+import base64
+import json
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), default=str).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        abort(422, "Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        abort(422, "Invalid cursor")
+    return values
+
+
+def keyset_paginate(query, columns, cursor=None, limit=None, descending=False):
+    """
+    Apply a stable ordering and a page window to a query
+
+    Args:
+        query: query returning a single entity
+        columns: list of sort expressions, the last one must be unique (e.g. the id)
+        cursor: cursor returned for the previous page
+        limit: page size, defaults to DEFAULT_PAGE_SIZE
+        descending: sort direction
+
+    Returns:
+        (records, next_cursor), next_cursor is None on the last page
+    """
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        conditions = []
+        for index, column in enumerate(columns):
+            equal = [columns[i] == values[i] for i in range(index)]
+            if descending:
+                conditions.append(and_(*equal, column < values[index]))
+            else:
+                conditions.append(and_(*equal, column > values[index]))
+        query = query.filter(or_(*conditions))
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.add_columns(*columns).order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1:])
+    return [row[0] for row in rows], next_cursor
@@ -0,0 +1,214 @@
+"""
+Set-based progress calculations for projects
+
+The per-control/per-subcontrol helpers in ControlMixin and SubControlMixin
+issue several queries for every subcontrol. The functions below compute the
+same numbers with a single aggregate query over
+project_controls -> project_subcontrols LEFT JOIN evidence_association
+and then apply the exact rounding rules of the mixins in python
+"""
+from app import db
+from flask import current_app
+from sqlalchemy import func, case, and_
+
+
+def _models():
+    return (
+        current_app.models["ProjectControl"],
+        current_app.models["ProjectSubControl"],
+        current_app.models["EvidenceAssociation"],
+        current_app.models["ProjectEvidence"],
+    )
+
+
+def evidence_subquery():
+    """
+    distinct subcontrol ids that have at least one evidence item attached
+    """
+    _, _, EvidenceAssociation, ProjectEvidence = _models()
+    return (
+        db.session.query(EvidenceAssociation.control_id.label("control_id"))
+        .join(ProjectEvidence, ProjectEvidence.id == EvidenceAssociation.evidence_id)
+        .distinct()
+        .subquery()
+    )
+
+
+def subcontrol_columns(evidence):
+    """
+    aggregate columns over project_subcontrols (joined with the evidence
+    subquery) that every progress number is derived from
+    """
+    _, ProjectSubControl, _, _ = _models()
+    applicable = ProjectSubControl.is_applicable == True
+    has_evidence = evidence.c.control_id != None
+    implemented = func.coalesce(ProjectSubControl.implemented, 0)
+
+    # mirrors SubControlMixin.get_completion_progress
+    completion = case(
+        [
+            (and_(applicable, has_evidence, implemented >= 25), implemented),
+            (and_(applicable, has_evidence), 25),
+            (and_(applicable, implemented > 0), implemented * 0.75),
+        ],
+        else_=0,
+    )
+    return [
+        func.count(ProjectSubControl.id).label("subcontrols"),
+        func.sum(case([(applicable, 1)], else_=0)).label("applicable"),
+        func.sum(case([(applicable, implemented)], else_=0)).label("implemented"),
+        func.sum(case([(and_(applicable, has_evidence), 1)], else_=0)).label(
+            "with_evidence"
+        ),
+        func.sum(
+            case([(and_(applicable, has_evidence, implemented == 100), 1)], else_=0)
+        ).label("complete"),
+        func.sum(completion).label("completion"),
+    ]
+
+
+def control_stats(project_id=None, project_control_ids=None):
+    """
+    Return the raw counters for every project control, keyed by project control id
+
+    {"<project_control_id>": {"subcontrols": 4, "applicable": 3, ...}}
+    """
+    ProjectControl, ProjectSubControl, _, _ = _models()
+    evidence = evidence_subquery()
+    query = (
+        db.session.query(ProjectControl.id, *subcontrol_columns(evidence))
+        .outerjoin(
+            ProjectSubControl,
+            ProjectSubControl.project_control_id == ProjectControl.id,
+        )
+        .outerjoin(evidence, evidence.c.control_id == ProjectSubControl.id)
+        .group_by(ProjectControl.id)
+    )
+    if project_id is not None:
+        query = query.filter(ProjectControl.project_id == project_id)
+    if project_control_ids is not None:
+        if not project_control_ids:
+            return {}
+        query = query.filter(ProjectControl.id.in_(project_control_ids))
+
+    data = {}
+    for row in query.all():
+        record = row._asdict()
+        control_id = record.pop("id")
+        data[control_id] = {key: int(value or 0) for key, value in record.items()}
+        # SUM over a float expression comes back as Decimal on postgres
+        data[control_id]["completion"] = float(record["completion"] or 0)
+    return data
+
+
+def control_progress(stats):
+    """
+    Derive the progress numbers of a single control from its counters.
+    Rounding matches ControlMixin.completed_progress, progress("with_evidence")
+    and implemented_progress
+    """
+    applicable = stats["applicable"]
+    if not applicable:
+        return {
+            "is_applicable": False,
+            "completed": 0,
+            "evidence": 0,
+            "implemented": 0,
+        }
+    return {
+        "is_applicable": True,
+        "completed": round(stats["completion"] / applicable, 0),
+        "evidence": round((stats["with_evidence"] / applicable) * 100, 0)
+        if stats["with_evidence"]
+        else 0,
+        "implemented": round((stats["implemented"] / applicable), 0),
+    }
+
+
+def project_progress(project_id, default=100):
+    """
+    Return the project level progress numbers in a single query
+
+    {
+        "controls": 10,
+        "applicable_controls": 8,
+        "completion_progress": 40.0,
+        "evidence_progress": 35.0,
+        "implemented_progress": 42.0,
+    }
+    """
+    return summarize(control_stats(project_id=project_id).values(), default=default)
+
+
+def control_totals(stats):
+    """
+    Counters stored for a single control in the project_progress rollup.
+    The project rollup is the sum of these over all controls
+    """
+    progress = control_progress(stats)
+    return {
+        "subcontrols": stats["subcontrols"],
+        "applicable": stats["applicable"],
+        "implemented": stats["implemented"],
+        "with_evidence": stats["with_evidence"],
+        "complete": stats["complete"],
+        "completion": stats["completion"],
+        "controls": 1,
+        "applicable_controls": 1 if progress["is_applicable"] else 0,
+        "progress_completed": progress["completed"],
+        "progress_evidence": progress["evidence"],
+        "progress_implemented": progress["implemented"],
+    }
+
+
+def empty_totals():
+    return {
+        "subcontrols": 0,
+        "applicable": 0,
+        "implemented": 0,
+        "with_evidence": 0,
+        "complete": 0,
+        "completion": 0,
+        "controls": 0,
+        "applicable_controls": 0,
+        "progress_completed": 0,
+        "progress_evidence": 0,
+        "progress_implemented": 0,
+    }
+
+
+def summarize(stats, default=100):
+    """
+    Roll up a list of per-control counters into the project numbers returned
+    by Project.completion_progress, evidence_progress and implemented_progress
+    """
+    totals = empty_totals()
+    for record in stats:
+        for key, value in control_totals(record).items():
+            totals[key] += value
+    return summarize_totals(totals, default=default)
+
+
+def summarize_totals(totals, default=100):
+    """
+    Project numbers from summed control totals (see control_totals)
+    """
+    controls = totals["controls"]
+    applicable_controls = totals["applicable_controls"]
+    data = {
+        "controls": controls,
+        "applicable_controls": applicable_controls,
+        "completion_progress": default,
+        "evidence_progress": 0,
+        "implemented_progress": 0,
+    }
+    if applicable_controls:
+        data["completion_progress"] = round(
+            (totals["progress_completed"] / applicable_controls), 0
+        )
+    if controls:
+        data["evidence_progress"] = round((totals["progress_evidence"] / controls), 0)
+        data["implemented_progress"] = round(
+            (totals["progress_implemented"] / controls), 0
+        )
+    return data
@@ -0,0 +1,125 @@
+"""
+Process wide registry of the storage provider clients
+
+Creating a boto3 or google-cloud-storage client resolves the credentials and
+opens a new HTTP connection pool, FileStorageHandler and GCS ask the registry
+instead so a process keeps one client per (provider, bucket, credentials).
+The clients are thread safe and their pools hold STORAGE_POOL_SIZE
+connections, set it to at least the number of gunicorn threads
+
+Clients are never shared with a forked process: with "gunicorn --preload" a
+client created in the master would share its sockets with every worker, so
+the registry is emptied in the child after a fork
+
+    client = storage_clients.s3(bucket, access_key, secret_key, region)
+    storage_clients.stats()  # {"s3": {"created": 1, "reused": 41}, ...}
+"""
+from flask import current_app
+from botocore.config import Config
+from google.cloud import storage
+from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+import google.auth
+import requests
+import threading
+import hashlib
+import boto3
+import os
+
+
+DEFAULT_POOL_SIZE = 10
+
+
+def fingerprint(*secrets):
+    """
+    Key of a set of credentials, the secrets are not kept in the registry
+    """
+    if not any(secrets):
+        return "default"
+    return hashlib.sha256("\0".join(s or "" for s in secrets).encode()).hexdigest()
+
+
+class StorageClientRegistry:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Drop the clients (and counters) inherited from the parent process
+        """
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.counters = {}
+
+    def get_pool_size(self):
+        return int(current_app.config.get("STORAGE_POOL_SIZE") or DEFAULT_POOL_SIZE)
+
+    def get(self, key, factory):
+        if self.pid != os.getpid():
+            self.reset()
+        with self.lock:
+            counters = self.counters.setdefault(key[0], {"created": 0, "reused": 0})
+            client = self.clients.get(key)
+            if client is not None:
+                counters["reused"] += 1
+                return client
+            client = self.clients[key] = factory()
+            counters["created"] += 1
+            return client
+
+    def s3(self, bucket, access_key=None, secret_key=None, region=None):
+        def create():
+            # a session per client, the default boto3 session is not thread safe
+            session = boto3.session.Session(
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+            )
+            return session.client(
+                "s3", config=Config(max_pool_connections=self.get_pool_size())
+            )
+
+        return self.get(("s3", bucket, region, fingerprint(access_key, secret_key)), create)
+
+    def gcs(self, bucket, credentials_path=None):
+        """
+        Args:
+            credentials_path: service account JSON, ADC when not set
+        """
+
+        def create():
+            if credentials_path:
+                credentials = service_account.Credentials.from_service_account_file(
+                    credentials_path, scopes=storage.Client.SCOPE
+                )
+                project = credentials.project_id
+            else:
+                credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+            session = AuthorizedSession(credentials)
+            pool_size = self.get_pool_size()
+            session.mount(
+                "https://",
+                requests.adapters.HTTPAdapter(
+                    pool_connections=pool_size, pool_maxsize=pool_size
+                ),
+            )
+            return storage.Client(
+                project=project or current_app.config.get("GOOGLE_CLOUD_PROJECT"),
+                credentials=credentials,
+                _http=session,
+            )
+
+        return self.get(("gcs", bucket, credentials_path or "default"), create)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pid": self.pid,
+                "clients": len(self.clients),
+                **{provider: dict(counters) for provider, counters in self.counters.items()},
+            }
+
+
+storage_clients = StorageClientRegistry()
+os.register_at_fork(after_in_child=storage_clients.reset)
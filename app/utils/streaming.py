@@ -0,0 +1,44 @@
+"""
+Opt-in NDJSON streaming for large collection endpoints
+
+A client asks for a stream with "Accept: application/x-ndjson" or "?stream=1".
+The endpoint then returns one JSON document per line from a generator instead
+of building the whole list, so memory stays bounded per record and the first
+bytes are sent before the last record is read
+"""
+from flask import request, current_app, Response, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+YIELD_PER = 200
+# page size used when a paginated endpoint is streamed
+STREAM_PAGE_SIZE = 200
+
+
+def wants_stream():
+    if request.args.get("stream", "").lower() in ["1", "true", "yes"]:
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def stream_query(query, yield_per=YIELD_PER):
+    """
+    Iterate a query with a server side cursor (where the driver supports it)
+    instead of loading every row
+    """
+    return query.execution_options(stream_results=True).yield_per(yield_per)
+
+
+def ndjson_response(records, headers=None):
+    """
+    Args:
+        records: iterable (usually a generator) of dicts
+        headers: optional response headers
+    """
+
+    def generate():
+        for record in records:
+            yield current_app.json.dumps(record) + "\n"
+
+    return Response(
+        stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers=headers
+    )
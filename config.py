@@ -95,11 +95,54 @@ class Config:
     EVIDENCE_FOLDER = os.environ.get(
         "EVIDENCE_FOLDER", os.path.join(basedir, "app/files/evidence")
     )
+    # Compiled snapshot of the base frameworks and policies (see app/utils/catalog.py)
+    CATALOG_CACHE = os.environ.get(
+        "CATALOG_CACHE", os.path.join(basedir, "app/files/catalog.pickle")
+    )
     UPLOAD_EXTENSIONS = os.environ.get(
         "UPLOAD_EXTENSIONS", [".csv", ".jpg", ".png", ".pdf"]
     )
 
+    # Background workers for the completion history snapshots, 0 disables them
+    # (see app/utils/completion.py)
+    COMPLETION_WORKERS = int(os.environ.get("COMPLETION_WORKERS", 2))
+
+    # Background jobs (tenant bootstrap), 0 runs them inside the request
+    # (see app/utils/jobs.py)
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+    JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 900))
+
+    # Project summary cache: local, shared or none (see app/utils/cache.py)
+    PROJECT_CACHE_BACKEND = os.environ.get("PROJECT_CACHE_BACKEND", "local").lower()
+    PROJECT_CACHE_SIZE = int(os.environ.get("PROJECT_CACHE_SIZE", 1024))
+    PROJECT_CACHE_TTL = int(os.environ.get("PROJECT_CACHE_TTL", 300))
+    CACHE_URL = os.environ.get("CACHE_URL")
+
     STORAGE_PROVIDERS = ["local", "s3", "gcs"]
+    # Let the web server send local files: nginx (X-Accel-Redirect), apache
+    # (X-Sendfile) or empty to stream them from the app (see app/utils/downloads.py)
+    STORAGE_OFFLOAD = os.environ.get("STORAGE_OFFLOAD", "").lower()
+    STORAGE_OFFLOAD_PREFIX = os.environ.get(
+        "STORAGE_OFFLOAD_PREFIX", "/protected-evidence/"
+    )
+    # HTTP connections of each S3/GCS client, at least the number of threads
+    STORAGE_POOL_SIZE = int(os.environ.get("STORAGE_POOL_SIZE", 10))
+    # Files larger than a part are uploaded to S3/GCS in parallel parts
+    STORAGE_PART_SIZE = int(os.environ.get("STORAGE_PART_SIZE", 8 * 1024 * 1024))
+    STORAGE_UPLOAD_WORKERS = int(os.environ.get("STORAGE_UPLOAD_WORKERS", 4))
+    STORAGE_UPLOAD_ATTEMPTS = int(os.environ.get("STORAGE_UPLOAD_ATTEMPTS", 3))
+    # Direct uploads (/projects/<pid>/evidence/uploads): seconds to send the
+    # file and part size suggested for the local chunked endpoint
+    UPLOAD_EXPIRATION = int(os.environ.get("UPLOAD_EXPIRATION", 3600))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    # Storage ledger reconciled in the background once older than this
+    # (seconds, 0 to only reconcile on demand), expired uploads are purged then
+    STORAGE_RECONCILE_INTERVAL = int(os.environ.get("STORAGE_RECONCILE_INTERVAL", 86400))
+    # Evidence archives: files fetched ahead and 1 MB chunks buffered per file
+    ARCHIVE_PREFETCH_WORKERS = int(os.environ.get("ARCHIVE_PREFETCH_WORKERS", 4))
+    ARCHIVE_PREFETCH_CHUNKS = int(os.environ.get("ARCHIVE_PREFETCH_CHUNKS", 4))
+    # seconds without data from the storage before a file is left out
+    ARCHIVE_FETCH_TIMEOUT = int(os.environ.get("ARCHIVE_FETCH_TIMEOUT", 60))
 
     # GCS storage backend
     STORAGE_METHOD = os.environ.get("STORAGE_METHOD", "local")
@@ -14,6 +14,15 @@ from app.commands import (
     MigrateDbCommand,
     DataImportCommand,
     ForceDropTablesCommand,
+    RebuildProgressCommand,
+    CheckProgressCommand,
+    SnapshotCompletionCommand,
+    ImportFrameworkCommand,
+    BuildCatalogCommand,
+    ImportControlsCommand,
+    RebuildMappingsCommand,
+    UpgradeFrameworkCommand,
+    ReconcileStorageCommand,
 )
 
 # Setup Flask-Script with command line commands
@@ -24,6 +33,15 @@ manager.add_command("create_db", CreateDbCommand)
 manager.add_command("migrate_db", MigrateDbCommand)
 manager.add_command("import", DataImportCommand)
 manager.add_command("force_drop_db", ForceDropTablesCommand)
+manager.add_command("rebuild_progress", RebuildProgressCommand)
+manager.add_command("check_progress", CheckProgressCommand)
+manager.add_command("snapshot_completion", SnapshotCompletionCommand)
+manager.add_command("import_framework", ImportFrameworkCommand)
+manager.add_command("build_catalog", BuildCatalogCommand)
+manager.add_command("import_controls", ImportControlsCommand)
+manager.add_command("rebuild_mappings", RebuildMappingsCommand)
+manager.add_command("upgrade_framework", UpgradeFrameworkCommand)
+manager.add_command("reconcile_storage", ReconcileStorageCommand)
 
 
 if __name__ == "__main__":
@@ -15,10 +15,17 @@ GUNICORN_WORKERS=${GUNICORN_WORKERS:-1}
 GUNICORN_THREADS=${GUNICORN_THREADS:-0}
 GUNICORN_TIMEOUT=${GUNICORN_TIMEOUT:-60}
 GUNICORN_KEEP_ALIVE=${GUNICORN_KEEP_ALIVE:-60}
+GUNICORN_PRELOAD=${GUNICORN_PRELOAD:-yes}
 
 start_server() {
     echo "[INFO] Starting the server with $GUNICORN_WORKERS workers"
+    # --preload loads the app (and the framework catalog) once before forking
+    PRELOAD_ARGS=()
+    if [ "$GUNICORN_PRELOAD" == "yes" ]; then
+        PRELOAD_ARGS=(--preload)
+    fi
     exec gunicorn --bind "0.0.0.0:$PORT" \
+        "${PRELOAD_ARGS[@]}" \
         flask_app:app \
         --access-logfile '-' --error-logfile '-' \
         --workers="$GUNICORN_WORKERS" \
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Regression tests of the framework upgrade (app/utils/framework_upgrade.py)
+
+Runs against a temporary SQLite database:
+
+    python3 -m unittest test_framework_upgrade
+"""
+
+import copy
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WORK_DIR = tempfile.mkdtemp(prefix="grc-upgrade-")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}"
+os.environ["CATALOG_CACHE"] = os.path.join(WORK_DIR, "catalog.pickle")
+os.environ.setdefault("LOG_TYPE", "stream")
+
+from app import create_app, db
+from app.utils.catalog import catalog
+from app.utils.framework_upgrade import FrameworkUpgrade
+
+
+class FrameworkUpgradeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app("testing")
+        cls.context = cls.app.app_context()
+        cls.context.push()
+        db.create_all()
+        cls.models = cls.app.models
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        db.drop_all()
+        cls.context.pop()
+
+    def count_controls(self, name):
+        Framework = self.models["Framework"]
+        return Framework.get_catalog(name).controls.count()
+
+    def test_upgrade_with_the_shipped_file_is_a_no_op(self):
+        for name in catalog.framework_names():
+            with self.subTest(framework=name):
+                self.models["Framework"].load_catalog(name)
+                before = self.count_controls(name)
+                for _ in range(2):
+                    report = FrameworkUpgrade(name, catalog.get_controls(name)).run()
+                    for framework in report["frameworks"]:
+                        self.assertEqual(framework["added"], [])
+                        self.assertEqual(framework["removed"], [])
+                        self.assertEqual(framework["retained"], [])
+                        self.assertEqual(framework["changed"], [])
+                self.assertEqual(self.count_controls(name), before)
+
+    def test_upgrade_bumps_the_revision_of_the_projects_using_a_changed_control(self):
+        Framework = self.models["Framework"]
+        Project = self.models["Project"]
+        ProjectControl = self.models["ProjectControl"]
+        Framework.load_catalog("soc2")
+        framework = Framework.get_catalog("soc2")
+        control = framework.controls.first()
+        project = Project(
+            name="upgrade", framework_id=framework.id, owner_id="owner", tenant_id="tenant"
+        )
+        db.session.add(project)
+        db.session.commit()
+        db.session.add(ProjectControl(project_id=project.id, control_id=control.id))
+        db.session.commit()
+        revision = Project.query.get(project.id).revision
+
+        controls = copy.deepcopy(catalog.get_controls("soc2"))
+        for item in controls:
+            if item["ref_code"].strip().lower() == control.ref_code.strip().lower():
+                item["name"] = "Renamed control"
+        report = FrameworkUpgrade("soc2", controls).run()
+        self.addCleanup(
+            lambda: FrameworkUpgrade("soc2", catalog.get_controls("soc2")).run()
+        )
+        self.assertEqual(len(report["frameworks"][0]["changed"]), 1)
+
+        db.session.expire_all()
+        self.assertEqual(Project.query.get(project.id).revision, revision + 1)
+        self.assertEqual(
+            self.models["Control"].query.get(control.id).name, "Renamed control"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()